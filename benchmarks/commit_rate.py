@@ -0,0 +1,43 @@
+"""
+Measure how many single row commits per second the SQL storage manages
+with each of the SQLite profiles.
+
+    python -m benchmarks.commit_rate [--commits N]
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from src.models import Konto
+from src.storage.sql import SQLITE_PROFILES, SqlAdapter
+
+
+def commit_rate(profile: str, directory: Path, commits: int) -> float:
+    db = SqlAdapter(host=str(directory / f"{profile}.sqlite3"), profile=profile)
+    db.create()
+
+    start = time.perf_counter()
+    for i in range(commits):
+        # every row is a transaction of its own, just like a single save()
+        with db.Session() as sess:
+            sess.add(Konto(kontonummer=f"K{i:011d}", kontostand=i))
+    elapsed = time.perf_counter() - start
+
+    db.engine.dispose()
+    return commits / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commits", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in SQLITE_PROFILES:
+            rate = commit_rate(profile, Path(directory), args.commits)
+            print(f"{profile:>12}: {rate:10.0f} commits/s")
+
+
+if __name__ == "__main__":
+    main()
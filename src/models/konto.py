@@ -12,8 +12,8 @@ class Konto(ManagerMixin, Base):
 
     pk = None
     kontonummer = sqla.Column(sqla.String, primary_key=True)
-    kontostand = sqla.Column(sqla.Integer)
-    besitzer = sqla.Column(sqla.String, sqla.ForeignKey("kunde.pk"))
+    kontostand = sqla.Column(sqla.Integer, index=True)
+    besitzer = sqla.Column(sqla.String, sqla.ForeignKey("kunde.pk"), index=True)
     waehrung = sqla.Column(sqla.String)
 
     def __init__(self, **kwargs) -> None:
@@ -10,6 +10,7 @@ from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.orm import validates
 
 from src.storage.managers import ManagerMixin, AbstractManager
+from src.storage.related import Related
 
 
 class KundenManager(AbstractManager):
@@ -30,21 +31,50 @@ class KundenManager(AbstractManager):
         Return a user object if the provided credentials are valid,
         otherwise return None
         """
-        user = self.filter(username=username)
+        # only the user that has actually logged in is loaded entirely
+        user = self.values_list("pk", "password", username=username)
         if len(user) > 1:
             raise RuntimeError("Critical error, duplicate users in database.")
         elif len(user) == 0:
             return None
-        user = user[0]
-        if self.is_password_valid(password, user.password):
-            return user
+        pk, hashed_password = user[0]
+        if self.is_password_valid(password, hashed_password):
+            return self.get(pk)
         return None
 
+    async def alogin_user(
+        self, username: str, password: str
+    ) -> Optional[DeclarativeMeta]:
+        """ Awaitable variant of login_user(), bcrypt runs on the thread pool """
+        return await self.executor.run(self.login_user, username, password)
+
     def delete(self) -> None:
-        for konto in self.klass.konten:
-            konto.objects.delete()
+        from src.storage import Storage
+
+        # the accounts and their owner are removed together, or not at all
+        with Storage(self.db_type).transaction():
+            for konto in self.klass.konten:
+                konto.objects.delete()
+
+            super().delete()
+
+    def bulk_delete(self, objects):
+        from src.storage import Storage
 
-        super().delete()
+        objects = list(objects)
+        owners = list({self._identifier_of(obj) for obj in objects})
+        related = self._get_queryable_class().konten
+        konten = related.model.objects
+
+        # just like delete(), the accounts go together with their owners
+        with Storage(self.db_type).transaction():
+            for start in range(0, len(owners), related.batch_size):
+                chunk = owners[start : start + related.batch_size]
+                konten.bulk_delete(
+                    konten.values_list("kontonummer", flat=True, besitzer__in=chunk)
+                )
+
+            return super().bulk_delete(objects)
 
 
 class Kunde(ManagerMixin, Base):
@@ -59,7 +89,7 @@ class Kunde(ManagerMixin, Base):
     strasse = sqla.Column(sqla.String(100))
     stadt = sqla.Column(sqla.String)
     plz = sqla.Column(sqla.String)
-    geb_date = sqla.Column(sqla.Date)
+    geb_date = sqla.Column(sqla.Date, index=True)
 
     def __init__(self, **kwargs) -> None:
         if kwargs.get("pk"):
@@ -156,8 +186,5 @@ class Kunde(ManagerMixin, Base):
 
         return geb_date
 
-    @property
-    def konten(self):
-        from .konto import Konto
-
-        return Konto.objects.filter(besitzer=self.pk)
+    # all accounts owned by this customer
+    konten = Related("Konto", "besitzer")
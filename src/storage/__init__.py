@@ -1,4 +1,4 @@
-from .storage import Storage
+from .storage import Storage, transactional
 from .. import models
 
-__all__ = ["Storage", "models"]
+__all__ = ["Storage", "transactional", "models"]
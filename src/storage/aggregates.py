@@ -0,0 +1,140 @@
+"""
+Aggregates for the aggregate() method of the managers,
+e.g. ``Konto.objects.aggregate(Sum("kontostand"), group_by="besitzer")``.
+"""
+from abc import ABC, abstractmethod
+from array import array
+from typing import Any, Callable, Optional, Sequence
+
+import sqlalchemy as sqla
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    # the file based storages then reduce the values in plain Python
+    numpy = None
+
+# the largest value integer columns are packed into arrays of 64 bits with
+INT64_MAX = 2 ** 63 - 1
+
+
+class Aggregate(ABC):
+    """
+    Base class of the aggregates.
+
+    SQL compiles an aggregate into its aggregate function,
+    the file based storages collect the values of the column per group
+    and reduce them once all rows have been read.
+    Just like in SQL, NULL values are ignored.
+    """
+
+    name: str = ""
+
+    def __init__(self, column: str, alias: Optional[str] = None) -> None:
+        self.column = column
+        self.alias = alias or f"{column}__{self.name}"
+
+    @property
+    @abstractmethod
+    def function(self) -> Callable:
+        """ The matching SQL function, e.g. sqlalchemy.func.sum """
+        pass
+
+    def compile(self, column):
+        """ The SQL expression computing this aggregate over a column """
+        return self.function(column)
+
+    @abstractmethod
+    def reduce(self, values: Sequence) -> Any:
+        """ Compute the aggregate over the values of a group """
+        pass
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.column!r}, alias={self.alias!r})"
+
+
+def _vectorised(values: Sequence):
+    # integer columns are collected in an array, which numpy can use as is
+    if numpy is not None and isinstance(values, array) and len(values):
+        return numpy.frombuffer(values, dtype=numpy.int64)
+    return None
+
+
+def _sums_safely(vector) -> bool:
+    # numpy silently wraps around once a sum does not fit into 64 bits
+    bound = max(abs(int(vector.min())), abs(int(vector.max())))
+    return bound * len(vector) <= INT64_MAX
+
+
+class Sum(Aggregate):
+    name = "sum"
+    function = sqla.func.sum
+
+    def reduce(self, values):
+        if not len(values):
+            return None
+        vector = _vectorised(values)
+        if vector is not None and _sums_safely(vector):
+            return vector.sum().item()
+        # plain Python integers never overflow
+        return sum(values)
+
+
+class Min(Aggregate):
+    name = "min"
+    function = sqla.func.min
+
+    def reduce(self, values):
+        if not len(values):
+            return None
+        vector = _vectorised(values)
+        if vector is not None:
+            return vector.min().item()
+        return min(values)
+
+
+class Max(Aggregate):
+    name = "max"
+    function = sqla.func.max
+
+    def reduce(self, values):
+        if not len(values):
+            return None
+        vector = _vectorised(values)
+        if vector is not None:
+            return vector.max().item()
+        return max(values)
+
+
+class Avg(Aggregate):
+    name = "avg"
+    function = sqla.func.avg
+
+    def reduce(self, values):
+        if not len(values):
+            return None
+        vector = _vectorised(values)
+        if vector is not None:
+            return vector.mean().item()
+        return sum(values) / len(values)
+
+
+class Count(Aggregate):
+    """ Counts the values of a column, or all rows if no column is given """
+
+    name = "count"
+    function = sqla.func.count
+
+    def __init__(self, column: Optional[str] = None, alias: Optional[str] = None):
+        super().__init__(column, alias or (f"{column}__count" if column else "count"))
+
+    def compile(self, column):
+        if column is None:
+            return sqla.func.count()
+        return sqla.func.count(column)
+
+    def reduce(self, values):
+        return len(values)
+
+
+__all__ = ["Aggregate", "Sum", "Min", "Max", "Avg", "Count"]
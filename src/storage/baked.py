@@ -0,0 +1,65 @@
+import threading
+from typing import Callable, Dict, Hashable
+
+from sqlalchemy import util
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import Session
+
+
+class QueryCache:
+    """
+    The compiled queries of the SQL storage.
+
+    Building a Query and compiling it into SQL is what most of the time
+    of a simple lookup goes into, while the same few shapes come up
+    over and over again, e.g. the accounts of a customer or a customer
+    by its username. Every shape, i.e. the model, the lookups and the ordering,
+    is baked once, the values of the lookups are bound on every call.
+
+    'hits' and 'misses' count how often a shape has already been known,
+    whether its rows, its count or its first row is asked for.
+    Every miss is a shape that had to be baked, either as it is new
+    or as it has been dropped in the meantime.
+    Both the shapes and the compiled statements are kept for the 'size'
+    most recently used ones.
+    """
+
+    def __init__(self, size: int = 200) -> None:
+        # the compiled statements, least recently used ones are dropped,
+        # a shape is compiled once for its rows, its count and its first row
+        self.bakery = baked.bakery(size=size * 3)
+        self._queries: Dict[Hashable, baked.BakedQuery] = util.LRUCache(size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        key: Hashable,
+        bake: Callable[[baked.Bakery], baked.BakedQuery],
+        session: Session,
+    ) -> baked.Result:
+        """
+        The baked query of the given shape, bound to the session,
+        'bake' is called the first time
+        """
+        with self._lock:
+            query = self._queries.get(key)
+            if query is None:
+                query = self._queries[key] = bake(self.bakery)
+                self.misses += 1
+            else:
+                self.hits += 1
+        return query(session)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._queries)}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._queries.clear()
+            self.bakery.cache.clear()
+            self.hits = self.misses = 0
+
+
+__all__ = ["QueryCache"]
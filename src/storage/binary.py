@@ -0,0 +1,331 @@
+import datetime
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate, repeat
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import sqlalchemy as sqla
+from drizm_commons.sqla import Base
+
+from .json import JsonAdapter
+from .table import Table
+
+# every snapshot starts with this, followed by blocks of rows
+MAGIC = b"DANKBIN1"
+_LENGTH = struct.Struct("<I")
+# operation, length of the payload and its checksum
+_LOG_HEADER = struct.Struct("<cII")
+
+_UPSERT, _DELETE = b"U", b"D"
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _ordinal(value) -> int:
+    # NULLs are stored as the first valid ordinal
+    if value is None:
+        return 1
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    return value.toordinal()
+
+
+class BlockCodec:
+    """
+    Encodes lists of rows into compact binary blocks.
+
+    The layout is generated from the column types of the table:
+    integers, floats and booleans are packed into fixed size arrays,
+    dates are stored as their ordinal and everything else as UTF-8 strings.
+    The values are stored column by column, so a whole block can be decoded
+    with a handful of calls per column, instead of a few calls per value.
+    """
+
+    def __init__(self, columns: Iterable[sqla.Column]) -> None:
+        columns = list(columns)
+        self.names = [c.name for c in columns]
+        self.kinds = [self._kind(c.type) for c in columns]
+
+    @staticmethod
+    def _kind(column_type) -> str:
+        """ Map a column type to the typecode it is stored with """
+        if isinstance(column_type, sqla.Boolean):
+            return "b"
+        if isinstance(column_type, sqla.Integer):
+            return "q"
+        if isinstance(column_type, sqla.Float):
+            return "d"
+        if isinstance(column_type, sqla.DateTime):
+            return "t"
+        if isinstance(column_type, sqla.Date):
+            return "i"
+        return "s"
+
+    def encode(self, rows: List[dict]) -> bytes:
+        parts = [_LENGTH.pack(len(rows))]
+
+        for name, kind in zip(self.names, self.kinds):
+            values = [row.get(name) for row in rows]
+
+            # a flag telling whether the column has a mask of NULL values
+            nulls = bytes(value is None for value in values)
+            if any(nulls):
+                parts += [b"\x01", nulls]
+            else:
+                parts.append(b"\x00")
+
+            if kind in ("s", "t"):
+                parts += self._encode_strings(values, kind)
+                continue
+
+            if kind == "i":
+                values = [_ordinal(v) for v in values]
+            else:
+                values = [0 if v is None else v for v in values]
+            parts.append(_to_little_endian(array("i" if kind == "i" else kind, values)))
+
+        return b"".join(parts)
+
+    @staticmethod
+    def _encode_strings(values: list, kind: str) -> list:
+        strings = [
+            ""
+            if v is None
+            else v.isoformat()
+            if kind == "t" and not isinstance(v, str)
+            else str(v)
+            for v in values
+        ]
+
+        # Strings are usually stored separated by NUL characters,
+        # as they can then be split apart in a single call.
+        # Only if one of them contains a NUL character we store their lengths.
+        if any("\x00" in string for string in strings):
+            lengths = _to_little_endian(array("I", map(len, strings)))
+            blob = "".join(strings).encode("utf-8")
+            return [b"\x01", lengths, _LENGTH.pack(len(blob)), blob]
+
+        blob = "\x00".join(strings).encode("utf-8")
+        return [b"\x00", _LENGTH.pack(len(blob)), blob]
+
+    def decode(self, data: bytes, offset: int = 0) -> Tuple[List[dict], int]:
+        """ Decode the block at the given offset, returns the rows and its end """
+        (count,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+
+        columns, masks = [], []
+        for kind in self.kinds:
+            nulls = None
+            if data[offset]:
+                nulls = data[offset + 1 : offset + 1 + count]
+                offset += count
+            offset += 1
+
+            if kind in ("s", "t"):
+                values, offset = self._decode_strings(data, offset, count)
+                if kind == "t":
+                    values = [
+                        datetime.datetime.fromisoformat(v) if v else None
+                        for v in values
+                    ]
+            else:
+                typecode = "i" if kind == "i" else kind
+                size = array(typecode).itemsize * count
+                values = _from_little_endian(typecode, data[offset : offset + size])
+                offset += size
+
+                if kind == "i":
+                    values = list(map(datetime.date.fromordinal, values))
+                elif kind == "b":
+                    values = list(map(bool, values))
+                else:
+                    values = values.tolist()
+
+            columns.append(values)
+            masks.append(nulls)
+
+        rows = list(map(dict, map(zip, repeat(self.names), zip(*columns))))
+
+        # NULL values are left out of the rows entirely,
+        # just like attributes that have never been set on an instance
+        for name, nulls in zip(self.names, masks):
+            if nulls is not None:
+                for row, null in zip(rows, nulls):
+                    if null:
+                        del row[name]
+
+        return rows, offset
+
+    @staticmethod
+    def _decode_strings(data: bytes, offset: int, count: int) -> Tuple[list, int]:
+        with_lengths = data[offset]
+        offset += 1
+
+        if with_lengths:
+            size = 4 * count
+            lengths = _from_little_endian("I", data[offset : offset + size])
+            offset += size
+
+        (size,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        text = data[offset : offset + size].decode("utf-8")
+        offset += size
+
+        if not count:
+            return [], offset
+
+        if with_lengths:
+            ends = list(accumulate(lengths))
+            return [text[a:b] for a, b in zip([0] + ends, ends)], offset
+
+        return text.split("\x00"), offset
+
+
+class BinaryTable(Table):
+    """
+    A table stored in a compact binary format.
+
+    The snapshot, '<table>.bin', holds the rows in blocks of 'block_size' rows,
+    each entry of the change log, '<table>.binlog', holds a single row
+    and a checksum, so a write that has been cut off can be detected.
+    """
+
+    log_suffix = ".binlog"
+    snapshot_mode = "rb"
+    block_size: int = 4096
+
+    def __init__(
+        self, path, pk: str, unique: Iterable[str] = (), columns=(), **kwargs
+    ) -> None:
+        self.codec = BlockCodec(columns)
+        super().__init__(path, pk, unique, **kwargs)
+
+    @classmethod
+    def initialize(cls, path) -> None:
+        with open(path, "wb") as fout:
+            fout.write(MAGIC)
+
+    def serialize(self, instance) -> dict:
+        # just like the JSON encoder, we only store what has been set
+        return {
+            name: value
+            for name, value in instance.__dict__.items()
+            if name in self.codec.names
+        }
+
+    def validate(self, row: dict) -> None:
+        # e.g. integers beyond 64 bits, the row would fail every later flush
+        self.codec.encode([row])
+
+    def _read_snapshot(self) -> Iterable[dict]:
+        with open(self.path, "rb") as fin:
+            data = fin.read()
+        self._check_magic(data)
+
+        rows, offset = [], len(MAGIC)
+        while offset < len(data):
+            offset += _LENGTH.size
+            block, offset = self.codec.decode(data, offset)
+            rows += block
+        return rows
+
+    def _iter_snapshot(self, fin) -> Iterator[dict]:
+        self._check_magic(fin.read(len(MAGIC)))
+        while True:
+            header = fin.read(_LENGTH.size)
+            if not header:
+                return
+            (size,) = _LENGTH.unpack(header)
+            block, _ = self.codec.decode(fin.read(size))
+            yield from block
+
+    def _check_magic(self, data: bytes) -> None:
+        if not data.startswith(MAGIC):
+            raise ValueError(f"File '{self.path}' is not a binary table")
+
+    def _write_snapshot(self, path, rows: List[dict]) -> None:
+        with open(path, "wb") as fout:
+            fout.write(MAGIC)
+            for start in range(0, len(rows), self.block_size):
+                block = self.codec.encode(rows[start : start + self.block_size])
+                fout.write(_LENGTH.pack(len(block)))
+                fout.write(block)
+
+    def _encode_entry(self, entry: dict) -> bytes:
+        if entry["op"] == "upsert":
+            op, payload = _UPSERT, self.codec.encode([entry["row"]])
+        else:
+            op, payload = _DELETE, self.codec.encode([{self.pk: entry["pk"]}])
+        return _LOG_HEADER.pack(op, len(payload), zlib.crc32(payload)) + payload
+
+    def _iter_log(self, offset: int) -> Iterator[Tuple[Optional[dict], int]]:
+        try:
+            fin = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return
+
+        with fin:
+            fin.seek(offset)
+            while True:
+                # an entry that is incomplete or does not match its checksum
+                # is a write that is still in progress or has been interrupted,
+                # so we stop right before it
+                header = fin.read(_LOG_HEADER.size)
+                if len(header) < _LOG_HEADER.size:
+                    return
+                op, size, checksum = _LOG_HEADER.unpack(header)
+                payload = fin.read(size)
+                if len(payload) < size or zlib.crc32(payload) != checksum:
+                    return
+                offset += len(header) + size
+
+                (row,), _ = self.codec.decode(payload)
+                if op == _UPSERT:
+                    yield {"op": "upsert", "row": row}, offset
+                else:
+                    yield {"op": "delete", "pk": row[self.pk]}, offset
+
+    def _append(self, entries: Iterable[dict]) -> int:
+        data = b"".join(self._encode_entry(entry) for entry in entries)
+
+        with open(self.log_path, "ab+") as fout:
+            end = fout.tell()
+            if end != self._log_offset:
+                # Either someone else has appended to the log in the meantime,
+                # or the last write has been cut off. Whatever can not be read
+                # is cut off, so our own changes are not stuck behind it.
+                valid = self._log_offset if end > self._log_offset else 0
+                for _, valid in self._iter_log(valid):
+                    pass
+                if valid < end:
+                    fout.truncate(valid)
+            fout.write(data)
+        return len(data)
+
+
+class BinaryAdapter(JsonAdapter):
+    """
+    Stores the tables in the binary format of BinaryTable,
+    otherwise this works just like the JSON storage.
+    """
+
+    directory = ".bin_db"
+    extension = ".bin"
+    table_class = BinaryTable
+
+    def _table_options(self, tablename: str) -> dict:
+        return {"columns": Base.metadata.tables[tablename].columns}
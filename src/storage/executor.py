@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+from weakref import WeakKeyDictionary
+
+
+class StorageExecutor:
+    """
+    Runs the blocking calls behind the awaitable methods of the managers,
+    e.g. aget() or asave(), on a bounded pool of threads,
+    so an event loop can keep serving other tasks in the meantime.
+
+    Writes to the same table are done one at a time.
+    They wait for their turn on the event loop, not on the pool,
+    so reads are never held up by writes queueing for a table.
+    """
+
+    def __init__(self, max_workers: int = 8) -> None:
+        # takes effect when the pool is created, i.e. on the first call
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+        # event loop -> table name -> lock,
+        # as asyncio locks can only be used by a single loop
+        self._write_locks: WeakKeyDictionary = WeakKeyDictionary()
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="storage"
+                    )
+        return self._pool
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """ Call the function on the pool and wait for its result """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, partial(func, *args, **kwargs))
+
+    async def write(self, table: str, func: Callable, *args, **kwargs) -> Any:
+        """ Like run(), but only one call per table is running at a time """
+        loop = asyncio.get_running_loop()
+        locks: Dict[str, asyncio.Lock] = self._write_locks.setdefault(loop, {})
+        lock = locks.get(table)
+        if lock is None:
+            lock = locks[table] = asyncio.Lock()
+
+        async with lock:
+            future = loop.run_in_executor(self.pool, partial(func, *args, **kwargs))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the thread can not be stopped, so the next write
+                # still has to wait until this one is done
+                await asyncio.wait([future])
+                raise
+
+    def shutdown(self, wait: bool = True) -> None:
+        """ Stop the threads, a new pool is created by the next call """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+__all__ = ["StorageExecutor"]
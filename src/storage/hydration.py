@@ -0,0 +1,178 @@
+import datetime
+from typing import Callable, ClassVar, Dict, Optional, Tuple
+
+import sqlalchemy as sqla
+from sqlalchemy.orm.attributes import manager_of_class
+
+# how the rows of a file based storage are turned into model instances
+HYDRATION_MODES = ("validate", "fast", "lazy")
+
+
+def _converter(column_type) -> Optional[Callable]:
+    """ Parse the ISO strings dates and times are stored as in JSON """
+    if isinstance(column_type, sqla.DateTime):
+        return datetime.datetime.fromisoformat
+    if isinstance(column_type, sqla.Date):
+        return datetime.date.fromisoformat
+    return None
+
+
+class Hydrator:
+    """
+    Turns stored rows into instances of a model.
+
+    In 'validate' mode every row goes through the constructor of the model,
+    running all of its validators, just as if the object was created anew.
+
+    Rows loaded from the storage have been validated when they were saved,
+    so in 'fast' mode the instance is created without calling the constructor
+    and the values are put into place directly.
+    Changes made to such an instance afterwards are still validated.
+
+    In 'lazy' mode a RowProxy is returned, which reads its columns
+    straight from the row and only creates the instance once it is needed.
+    """
+
+    _cache: ClassVar[Dict[Tuple[type, str], "Hydrator"]] = {}
+
+    def __init__(self, model: type, mode: str = "fast") -> None:
+        if mode not in HYDRATION_MODES:
+            raise ValueError(
+                f"Value '{mode}' is not a valid hydration mode, "
+                f"must be one of {HYDRATION_MODES}"
+            )
+        self.model = model
+        self.mode = mode
+
+        columns = model.__table__.columns
+        self.columns = frozenset(c.name for c in columns)
+        self.integer_columns = frozenset(
+            c.name for c in columns if isinstance(c.type, sqla.Integer)
+        )
+        # column name -> function parsing the stored value
+        self.converters = {}
+        for column in columns:
+            convert = _converter(column.type)
+            if convert is not None:
+                self.converters[column.name] = convert
+        self._new_instance = manager_of_class(model).new_instance
+
+        self.hydrate = {
+            "validate": self.validated,
+            "fast": self.trusted,
+            "lazy": self.lazy,
+        }[mode]
+
+    @classmethod
+    def for_model(cls, model: type, mode: str = "fast") -> "Hydrator":
+        """ Return the shared hydrator of a model, creating it on first use """
+        try:
+            return cls._cache[model, mode]
+        except KeyError:
+            hydrator = cls._cache[model, mode] = cls(model, mode)
+            return hydrator
+
+    def __call__(self, row: dict):
+        return self.hydrate(row)
+
+    def values(self, row: dict) -> dict:
+        """ The column values of a row, with dates and times parsed """
+        values = {k: v for k, v in row.items() if k in self.columns}
+        for name, convert in self.converters.items():
+            value = values.get(name)
+            if isinstance(value, str):
+                values[name] = convert(value)
+        return values
+
+    def parse(self, name: str, value):
+        """ Parse a stored value of the given column """
+        convert = self.converters.get(name)
+        if convert is not None and isinstance(value, str):
+            return convert(value)
+        return value
+
+    def extract(self, row: dict, columns) -> tuple:
+        """ Pick the values of the given columns from a row """
+        return tuple(self.parse(name, row.get(name)) for name in columns)
+
+    def validated(self, row: dict):
+        return self.model(**row)
+
+    def trusted(self, row: dict):
+        instance = self._new_instance()
+        # Bypassing the attribute events means neither validators
+        # nor change tracking are run, the instance looks as if it had
+        # been loaded by SQLAlchemy itself
+        instance.__dict__.update(self.values(row))
+        return instance
+
+    def lazy(self, row: dict) -> "RowProxy":
+        return RowProxy(row, self)
+
+
+class RowProxy:
+    """
+    Stand-in for a model instance, that reads the columns from its row.
+
+    The actual instance is only created once anything but a column is accessed,
+    e.g. a method, or once an attribute is set. From then on the proxy
+    passes everything on to the instance.
+    isinstance() checks against the model pass as well.
+    """
+
+    __slots__ = ("_row", "_hydrator", "_instance", "__weakref__")
+
+    def __init__(self, row: dict, hydrator: Hydrator) -> None:
+        object.__setattr__(self, "_row", row)
+        object.__setattr__(self, "_hydrator", hydrator)
+        object.__setattr__(self, "_instance", None)
+
+    @property
+    def __class__(self):
+        return self._hydrator.model
+
+    def _get_instance(self):
+        instance = self._instance
+        if instance is None:
+            instance = self._hydrator.trusted(self._row)
+            object.__setattr__(self, "_instance", instance)
+        return instance
+
+    @property
+    def instance(self):
+        """ The actual instance, created if it does not exist yet """
+        return self._get_instance()
+
+    def is_lazy(self) -> bool:
+        """ Whether the columns are still read from the row """
+        return self._instance is None
+
+    def replace_row(self, other: "RowProxy") -> None:
+        """ Read the columns from the row of another proxy from now on """
+        object.__setattr__(self, "_row", other._row)
+
+    def __getattr__(self, name: str):
+        if self._instance is None and name in self._hydrator.columns:
+            value = self._row.get(name)
+            convert = self._hydrator.converters.get(name)
+            if convert is not None and isinstance(value, str):
+                return convert(value)
+            return value
+        return getattr(self._get_instance(), name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._get_instance(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(self._get_instance(), name)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, RowProxy):
+            other = other._get_instance()
+        return self._get_instance() == other
+
+    def __hash__(self) -> int:
+        return hash(self._get_instance())
+
+    def __repr__(self) -> str:
+        return repr(self._get_instance())
@@ -0,0 +1,81 @@
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, MutableMapping, Optional, Tuple
+from weakref import WeakValueDictionary
+
+# (model, primary key) of an object
+Key = Tuple[type, Any]
+
+
+class IdentityMap:
+    """
+    Makes sure the same row is always represented by the same instance.
+
+    Whatever the managers load is replaced by the instance
+    that is already in memory for its primary key, if there is one.
+    Saved objects replace whatever instance was known for their primary key,
+    deleted ones are forgotten, within the scope and outside of it.
+
+    By default the map only holds weak references,
+    so an instance is known for as long as anyone is still using it.
+    Within a scope() every instance that has been loaded is kept,
+    until the scope is left, the map of the scope then starts out empty
+    and only serves the thread that has entered it.
+    get() of the managers only skips the storage within a scope.
+    """
+
+    def __init__(self) -> None:
+        self._shared: MutableMapping[Key, Any] = WeakValueDictionary()
+        self._local = threading.local()
+
+    @property
+    def _objects(self) -> MutableMapping[Key, Any]:
+        scope = getattr(self._local, "scope", None)
+        return self._shared if scope is None else scope
+
+    @contextmanager
+    def scope(self) -> Iterator[Dict[Key, Any]]:
+        previous = getattr(self._local, "scope", None)
+        scope = self._local.scope = {}
+        try:
+            yield scope
+        finally:
+            self._local.scope = previous
+
+    @property
+    def scoped(self) -> bool:
+        """ Whether the current thread is within a scope() """
+        return getattr(self._local, "scope", None) is not None
+
+    def get(self, model: type, pk) -> Optional[Any]:
+        return self._objects.get((model, pk))
+
+    def add(self, model: type, pk, instance) -> None:
+        if pk is not None:
+            self._objects[model, pk] = instance
+
+    def discard(self, model: type, pk) -> None:
+        # deleted rows must not be handed out again, neither within the scope
+        # nor by the shared map once the scope has been left
+        self._shared.pop((model, pk), None)
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope.pop((model, pk), None)
+
+    def clear(self) -> None:
+        self._shared.clear()
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope.clear()
+
+    def items(self) -> List[Tuple[Key, Any]]:
+        """ Every object known to the current thread, by model and primary key """
+        known = dict(self._shared.items())
+        known.update(getattr(self._local, "scope", None) or {})
+        return list(known.items())
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+
+__all__ = ["IdentityMap"]
@@ -1,53 +1,382 @@
-import json
+import atexit
+import os
+import threading
+import time
+from ast import literal_eval
 from configparser import ConfigParser
+from contextlib import ExitStack, contextmanager
+from typing import ClassVar, Dict, Iterator, List, Optional, Type
 
 from drizm_commons.sqla import Base, SQLAIntrospector
 from drizm_commons.utils.pathing import get_absolute_root_path, Path
 
+from .hydration import HYDRATION_MODES
+from .locking import LockStats
+from .table import (
+    AnyTable,
+    JsonTable,
+    ShardedTable,
+    Table,
+    shard_of,
+    shard_paths,
+)
+
 
 class JsonAdapter:
-    def __init__(self) -> None:
+    # folder inside of the project root that holds the tables
+    directory: ClassVar[str] = ".json_db"
+    # file extension of the table snapshots
+    extension: ClassVar[str] = ".json"
+    table_class: ClassVar[Type[Table]] = JsonTable
+
+    def __init__(
+        self,
+        compaction_ratio: float = 2.0,
+        background_compaction: bool = True,
+        write_behind: bool = False,
+        flush_interval: float = 5.0,
+        flush_size: int = 1000,
+        shards: int = 1,
+        hydration: str = "fast",
+    ) -> None:
         self.schema = ConfigParser()
 
-        self.path = Path(get_absolute_root_path()) / ".json_db"
+        # how rows are turned into model instances, see Hydrator for details
+        if hydration not in HYDRATION_MODES:
+            raise ValueError(
+                f"Value '{hydration}' is not a valid hydration mode, "
+                f"must be one of {HYDRATION_MODES}"
+            )
+        self.hydration = hydration
+
+        # number of shards each table is split into when creating the database,
+        # existing tables keep theirs until they are resharded
+        self.shards = shards
+
+        # passed on to every table, see JsonTable for details
+        self.compaction_ratio = compaction_ratio
+        self.background_compaction = background_compaction
+
+        # In write-behind mode changes are only applied in memory at first,
+        # they are written out together once 'flush_interval' seconds have passed
+        # or 'flush_size' changes have piled up, whichever comes first.
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._dirty_since = 0.0
+        if write_behind:
+            # make sure nothing is lost when the interpreter shuts down
+            atexit.register(self.flush)
+
+        # the tables used and changed by the transaction the current thread is in
+        self._transaction = threading.local()
+
+        self.path = Path(get_absolute_root_path()) / self.directory
         self.table_map = Path(self.path) / "tbl_map.ini"
 
+        # parsed table files, shared by all managers of this storage
+        self.tables = {}
+
+    # noinspection PyMethodMayBeStatic
+    def _table_options(self, tablename: str) -> dict:  # noqa unused argument
+        """ Additional keyword arguments for creating the table """
+        return {}
+
+    def table(self, tablename: str) -> AnyTable:
+        """
+        Return the cached table for the given tablename.
+        Within a transaction the table is reserved for the current thread
+        until the transaction is done, see transaction().
+        """
+        table = self.tables.get(tablename)
+        if table is None:
+            shards = int(self.schema[tablename].get("shards", "1"))
+            table = self.tables[tablename] = self._open_table(tablename, shards)
+
+        used = getattr(self._transaction, "used", None)
+        if used is not None and tablename not in used:
+            self._transaction.stack.enter_context(table.reserved())
+            # held back by someone else before, so not part of the transaction
+            table.flush()
+            used[tablename] = table
+        return table
+
+    def _open_table(
+        self, tablename: str, shards: int, filename: Optional[str] = None
+    ) -> AnyTable:
+        # the key lists are stored as their string representation
+        schema = self.schema[tablename]
+        primary_keys = literal_eval(schema["pk"])
+        if len(primary_keys) > 1:
+            raise TypeError("Composite-Primary Keys are not supported by this Adapter")
+
+        tables = [
+            self.table_class(
+                path,
+                primary_keys[0],
+                literal_eval(schema["uq"]),
+                # tables created before sorted indexes existed have none
+                indexed=literal_eval(schema.get("ix", "[]")),
+                foreign_keys=literal_eval(schema.get("fk", "{}")),
+                compaction_ratio=self.compaction_ratio,
+                background_compaction=self.background_compaction,
+                **self._table_options(tablename),
+            )
+            for path in shard_paths(self.path / (filename or schema["file"]), shards)
+        ]
+        if shards == 1:
+            return tables[0]
+        return ShardedTable(tables)
+
+    def commit(self, table: AnyTable) -> None:
+        """
+        Called by the managers after changing a table.
+        Either writes the changes right away or defers them
+        until the end of the transaction, or in write-behind mode.
+        """
+        tables = getattr(self._transaction, "tables", None)
+        if tables is not None:
+            tables.add(table)
+            return
+
+        if not self.write_behind:
+            table.flush()
+            return
+
+        with self._dirty_lock:
+            if not self._dirty:
+                self._dirty_since = time.monotonic()
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+            self._dirty.add(table)
+
+            pending = sum(len(t.pending) for t in self._dirty)
+            overdue = time.monotonic() - self._dirty_since >= self.flush_interval
+        if pending >= self.flush_size or overdue:
+            self.flush()
+
+    def defers_writes(self) -> bool:
+        """
+        Whether commit() holds the changes back instead of writing them,
+        i.e. within a transaction or in write-behind mode.
+        """
+        return (
+            self.write_behind or getattr(self._transaction, "tables", None) is not None
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Group the changes of all manager calls within the block,
+        they are written out together once it is done.
+        If the block raises, they are dropped instead.
+        Transactions within a transaction are part of the outer one.
+
+        The rows of a table are shared by all threads, so every table
+        the transaction uses is reserved for it until it is done.
+        Other threads neither see its changes before they are written,
+        nor do they write them out along with their own.
+        """
+        if getattr(self._transaction, "tables", None) is not None:
+            yield
+            return
+
+        # changes held back before are not part of the transaction
+        self.flush()
+        with ExitStack() as stack:
+            tables = self._transaction.tables = set()
+            self._transaction.used = {}
+            self._transaction.stack = stack
+            try:
+                yield
+            except BaseException:
+                for table in tables:
+                    table.rollback()
+                raise
+            else:
+                for table in tables:
+                    table.flush()
+            finally:
+                self._transaction.tables = None
+                self._transaction.used = None
+                self._transaction.stack = None
+
+    def _take_dirty(self) -> set:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        return dirty
+
+    def flush(self) -> None:
+        """ Write all changes that have been held back to disk """
+        for table in self._take_dirty():
+            table.flush()
+
     def _load(self):
         with open(self.table_map, "r") as fin:
             self.schema.read_file(fin)
 
-    def create(self) -> None:
-        """ Create the JSON 'database' or schema """
+    def create(self) -> List[str]:
+        """
+        Create the JSON 'database' or schema.
+        Returns what had to be migrated, see migrate().
+        """
         # If a table mapping already exists,
-        # load it instead of deleting
+        # load it instead of deleting and bring it up to date
         # if not create the folder for our 'json db'
         if self.path.exists():
             self._load()
-            return
+            return self.migrate()
         self.path.mkdir()
 
         # goes through all declared tables
         for t in Base.metadata.sorted_tables:
-            # inspect the table
-            table = SQLAIntrospector(t)
-            filename = f"{table.tablename}.json"
-            with open((self.path / filename), "w") as fout:
-                json.dump([], fout)
-            # declares the schema for the table
-            data = {
-                "file": filename,
-                "pk": table.primary_keys(),
-                "uq": table.unique_keys(),
-                "fk": table.foreign_keys(),
-            }
-            self.schema[table.tablename] = data
+            self._create_table(t)
 
         # creates the file 'tbl_map.ini'
         # and dumps the content of self.schema into it
         self.table_map.touch()
-        with open(self.table_map, "w") as fout:
+        self._write_table_map()
+        return []
+
+    def _create_table(self, t) -> None:
+        # inspect the table
+        table = SQLAIntrospector(t)
+        filename = f"{table.tablename}{self.extension}"
+        for path in shard_paths(self.path / filename, self.shards):
+            self.table_class.initialize(path)
+        # declares the schema for the table
+        self.schema[table.tablename] = {
+            "file": filename,
+            "pk": table.primary_keys(),
+            "uq": table.unique_keys(),
+            **self._indexes(t),
+            "shards": self.shards,
+        }
+
+    @staticmethod
+    def _indexes(t) -> dict:
+        """ The index declarations of a table, as stored in the table map """
+        return {
+            "fk": SQLAIntrospector(t).foreign_keys(),
+            # columns declared with 'index=True' get a sorted index
+            "ix": [c.name for c in t.columns if c.index],
+        }
+
+    def migrate(self) -> List[str]:
+        """
+        Bring the table map of an existing database up to date with the models.
+
+        Tables that have been declared since are created, indexes that
+        have been declared or removed since are updated. The indexes are only
+        kept in memory, so they are built the next time a table is loaded.
+        Returns a description of every change.
+        """
+        changes = []
+        for t in Base.metadata.sorted_tables:
+            if t.name not in self.schema:
+                self._create_table(t)
+                changes.append(f"Created table '{t.name}'")
+                continue
+
+            section = self.schema[t.name]
+            updated = False
+            for key, declared in self._indexes(t).items():
+                # tables created before an index type existed do not list it
+                if literal_eval(section.get(key, "None")) != declared:
+                    section[key] = str(declared)
+                    changes.append(f"Updated '{key}' of table '{t.name}' to {declared}")
+                    updated = True
+
+            # cached tables are opened again, with the new indexes
+            table = self.tables.pop(t.name, None) if updated else None
+            if table is not None:
+                table.flush()
+                table.close()
+
+        if changes:
+            self._write_table_map()
+        return changes
+
+    def _write_table_map(self) -> None:
+        # replaced in one go, so there is always a complete map to read
+        tmp_path = self.table_map.with_name(f"{self.table_map.name}.tmp")
+        with open(tmp_path, "w") as fout:
             self.schema.write(fout)
+        os.replace(tmp_path, self.table_map)
+
+    @staticmethod
+    def _table_files(table: AnyTable) -> list:
+        """ Every file of a table, those of all of its shards """
+        tables = table.shards if isinstance(table, ShardedTable) else [table]
+        return [path for t in tables for path in (t.path, t.log_path, t.lock.path)]
+
+    def reshard(self, tablename: str, shards: int) -> None:
+        """
+        Redistribute the rows of a table over a new number of shards.
+
+        This rewrites the whole table, so it must only be run
+        while no other process is using the storage.
+        The old files are only removed once the table map points
+        to the new ones, so a crash leaves either of them intact.
+        """
+        if shards < 1:
+            raise ValueError("A table needs at least one shard")
+
+        self.flush()
+        old = self.table(tablename)
+        rows = list(old.load().values())
+        old_files = self._table_files(old)
+
+        # The new shards must not overwrite any of the old files,
+        # so they alternate between two file names if they would.
+        filename = f"{tablename}{self.extension}"
+        new = self._open_table(tablename, shards, filename)
+        if set(self._table_files(new)) & set(old_files):
+            filename = f"{tablename}.resharded{self.extension}"
+            new = self._open_table(tablename, shards, filename)
+
+        tables = new.shards if isinstance(new, ShardedTable) else [new]
+        partitions = [[] for _ in range(shards)]
+        for row in rows:
+            partitions[shard_of(row[new.pk], shards)].append(row)
+
+        for table, partition in zip(tables, partitions):
+            # whatever is left over from a reshard that did not finish
+            if table.log_path.exists():
+                os.remove(table.log_path)
+            tmp_path = table.path.with_name(table.path.name + ".tmp")
+            table._write_snapshot(tmp_path, partition)  # noqa protected member
+            os.replace(tmp_path, table.path)
+
+        self.schema[tablename]["file"] = filename
+        self.schema[tablename]["shards"] = str(shards)
+        self._write_table_map()
+        self.tables[tablename] = new
+
+        old.close()
+        for path in old_files:
+            if path.exists():
+                os.remove(path)
+
+    def lock_stats(self) -> Dict[str, LockStats]:
+        """
+        How often this process had to wait for the locks of each table
+        it has used so far, and for how long.
+        """
+        return {name: table.lock_stats() for name, table in self.tables.items()}
 
     def destroy(self):
         """ Destroys the JSON 'database' """
+        # whatever has been held back is gone with the database
+        self._take_dirty()
+        for table in self.tables.values():
+            table.close()
         self.path.rmdir()
+        self.tables.clear()
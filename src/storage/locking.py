@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows does not have fcntl, there the locks only work within the process
+    fcntl = None
+
+
+class LockStats:
+    """ How often a lock has been taken and how long we had to wait for it """
+
+    def __init__(self) -> None:
+        self.acquired = 0
+        # how many of those had to wait for another process
+        self.contended = 0
+        # in seconds
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float, contended: bool) -> None:
+        self.acquired += 1
+        if contended:
+            self.contended += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def __iadd__(self, other: "LockStats") -> "LockStats":
+        self.acquired += other.acquired
+        self.contended += other.contended
+        self.wait_time += other.wait_time
+        self.max_wait = max(self.max_wait, other.max_wait)
+        return self
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(acquired={self.acquired}, "
+            f"contended={self.contended}, wait_time={self.wait_time:.6f}, "
+            f"max_wait={self.max_wait:.6f})"
+        )
+
+
+class FileLock:
+    """
+    Reader/writer lock shared between processes, backed by flock()
+    on a file of its own, so the locked files themselves can be replaced.
+
+    Any number of processes may hold the shared lock at the same time,
+    while the exclusive lock is only held by a single process.
+    Within a process, locks can be nested, an exclusive lock
+    also covers any shared lock that is taken while holding it.
+    Threads of the same process take turns.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.stats = LockStats()
+
+        self._fd = None
+        # the modes held by this process, innermost last
+        self._held: List[int] = []
+        self._thread_lock = threading.RLock()
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._hold(fcntl.LOCK_SH if fcntl else 0):
+            yield
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._hold(fcntl.LOCK_EX if fcntl else 0):
+            yield
+
+    @contextmanager
+    def _hold(self, mode: int) -> Iterator[None]:
+        with self._thread_lock:
+            current = self._mode()
+            # only lock if we do not already hold a lock at least as strong
+            locked = fcntl is not None and mode != current != fcntl.LOCK_EX
+            if locked:
+                self._flock(mode)
+            self._held.append(mode)
+            try:
+                yield
+            finally:
+                self._held.pop()
+                if locked:
+                    # go back to whatever the outer block was holding
+                    self._flock(current or fcntl.LOCK_UN)
+
+    def _mode(self) -> int:
+        if fcntl is None or not self._held:
+            return 0
+        return fcntl.LOCK_EX if fcntl.LOCK_EX in self._held else fcntl.LOCK_SH
+
+    def _flock(self, mode: int) -> None:
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if mode == fcntl.LOCK_UN:
+            fcntl.flock(self._fd, mode)
+            return
+
+        try:
+            fcntl.flock(self._fd, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # someone else holds a conflicting lock, so we wait for it
+            start = time.perf_counter()
+            fcntl.flock(self._fd, mode)
+            self.stats.record(time.perf_counter() - start, True)
+        else:
+            self.stats.record(0.0, False)
+
+    def close(self) -> None:
+        """ Release the lock file, must not be called while holding the lock """
+        with self._thread_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
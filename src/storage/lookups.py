@@ -0,0 +1,73 @@
+"""
+Django-style lookups for the filter methods of the managers,
+e.g. ``Konto.objects.filter(kontostand__gte=100)``.
+"""
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple
+
+LOOKUP_SEPARATOR = "__"
+
+
+def _compare(op: Callable[[Any, Any], bool]) -> Callable[[Any, Any], bool]:
+    # just like in SQL, NULL values never match a comparison
+    return lambda stored, value: stored is not None and op(stored, value)
+
+
+# name of the lookup -> whether a stored value matches the value of the lookup
+PREDICATES: Dict[str, Callable[[Any, Any], bool]] = {
+    "exact": lambda stored, value: stored == value,
+    "gt": _compare(lambda stored, value: stored > value),
+    "gte": _compare(lambda stored, value: stored >= value),
+    "lt": _compare(lambda stored, value: stored < value),
+    "lte": _compare(lambda stored, value: stored <= value),
+    "in": lambda stored, value: stored in value,
+    "range": _compare(lambda stored, value: value[0] <= stored <= value[1]),
+    "startswith": lambda stored, value: (
+        isinstance(stored, str) and stored.startswith(value)
+    ),
+}
+
+
+class Lookup(NamedTuple):
+    column: str
+    lookup: str
+    value: Any
+
+    def matches(self, stored) -> bool:
+        return PREDICATES[self.lookup](stored, self.value)
+
+
+def parse_lookups(filters: Dict[str, Any], columns: Iterable[str]) -> List[Lookup]:
+    """
+    Split the keyword arguments of a filter call into their column and lookup,
+    e.g. 'kontostand__gt' into ('kontostand', 'gt').
+    Arguments without a lookup are exact matches.
+    """
+    columns = set(columns)
+    lookups = []
+
+    for key, value in filters.items():
+        column, _, lookup = key.partition(LOOKUP_SEPARATOR)
+        lookup = lookup or "exact"
+
+        if column not in columns:
+            raise ValueError(
+                f"Unknown column '{column}', must be one of {sorted(columns)}"
+            )
+        if lookup not in PREDICATES:
+            raise ValueError(
+                f"Unknown lookup '{lookup}' for column '{column}', "
+                f"must be one of {list(PREDICATES)}"
+            )
+
+        if lookup == "in":
+            value = list(value)
+        elif lookup == "range":
+            low, high = value
+            value = (low, high)
+
+        lookups.append(Lookup(column, lookup, value))
+
+    return lookups
+
+
+__all__ = ["LOOKUP_SEPARATOR", "PREDICATES", "Lookup", "parse_lookups"]
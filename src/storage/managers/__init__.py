@@ -1,4 +1,4 @@
-from .base import BaseManager, AbstractManager
+from .base import BaseManager, AbstractManager, BulkResult
 from .mixin import ManagerMixin
 
-__all__ = ["BaseManager", "AbstractManager", "ManagerMixin"]
+__all__ = ["BaseManager", "AbstractManager", "BulkResult", "ManagerMixin"]
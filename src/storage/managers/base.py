@@ -1,17 +1,70 @@
 from abc import ABC, abstractmethod
 from inspect import isclass
+from typing import Dict, Tuple
 
-from drizm_commons.inspect import SQLAIntrospector
+from drizm_commons.sqla import Base
 from drizm_commons.testing.truthiness import is_dunder
 from drizm_commons.utils import decorate_class_object_methods
 from drizm_commons.utils.decorators import resolve_super_auto_resolution
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
+
+from ..exc import ObjectNotFound
+from ..executor import StorageExecutor
+from ..hydration import RowProxy
+from ..identity import IdentityMap
+from ..metadata import MetadataRegistry
+from ..query import QuerySet
+from ..related import written
+
+
+class BulkResult:
+    """
+    Outcome of a bulk operation.
+
+    'succeeded' lists the objects (or primary keys) that have been written,
+    'failed' lists the ones that have not, together with the exception
+    the corresponding single operation would have raised.
+    """
+
+    def __init__(self) -> None:
+        self.succeeded = []
+        self.failed = []
+
+    def __bool__(self) -> bool:
+        """ True if nothing has failed """
+        return not self.failed
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(succeeded={len(self.succeeded)}, "
+            f"failed={len(self.failed)})"
+        )
 
 
 class BaseManagerInterface(ABC):
-    def __init__(self, klass, storage, store_type):
+    def __init__(
+        self,
+        klass,
+        storage,
+        store_type,
+        identity_map=None,
+        metadata=None,
+        executor=None,
+    ):
         self.klass = klass
         self.db = storage
 
+        # what is known about the model, see MetadataRegistry for details
+        if metadata is None:
+            metadata = MetadataRegistry()
+        self.meta = metadata[self._get_queryable_class()]
+
+        # shared by all managers of a storage, see IdentityMap for details
+        self.identity_map = identity_map if identity_map is not None else IdentityMap()
+
+        # runs the awaitable methods, see StorageExecutor for details
+        self.executor = executor if executor is not None else StorageExecutor()
+
         # This value gives subclasses a way to execute
         # different code based on the type of storage we are using.
         # Manager classes can also manually specify this as a class attribute.
@@ -25,15 +78,39 @@ class BaseManagerInterface(ABC):
 
     def _get_identifier_column_name(self):
         """ Get the name of the primary key column """
-        primary_keys = SQLAIntrospector(self.klass).primary_keys()
-        if len(primary_keys) > 1:
-            raise TypeError("Composite-Primary Keys are not supported by this Manager")
-        return primary_keys[0]
+        return self.meta.pk
 
     def _get_identifier(self):
         """ Get the value of the primary key column """
         return getattr(self.klass, self._get_identifier_column_name())
 
+    def _get_queryable_class(self):
+        """ Get the model class, even if we are serving an instance """
+        if self._is_static():
+            return self.klass
+        return self.klass.__class__
+
+    def _get_column_names(self, columns=()):
+        """ Check the requested columns, all columns of the model by default """
+        klass = self._get_queryable_class()
+        available = list(self.meta.column_names)
+        if not columns:
+            return available
+
+        unknown = [column for column in columns if column not in available]
+        if unknown:
+            raise ValueError(
+                f"Model '{klass.__name__}' has no column(s) named {unknown}, "
+                f"must be one of {available}"
+            )
+        return list(columns)
+
+    def _identifier_of(self, obj):
+        """ Get the primary key of either a model instance or a primary key """
+        if isinstance(obj, Base):
+            return getattr(obj, self._get_identifier_column_name())
+        return obj
+
     @abstractmethod
     def save(self):
         """
@@ -51,34 +128,293 @@ class BaseManagerInterface(ABC):
         """
         pass
 
-    @abstractmethod
     def get(self, identifier):
         """
         Retrieve an instance by its primary key.
 
+        If the object is already in memory, that very instance is returned,
+        brought up to date with the storage, as someone else may have changed it.
+        Only within a session() it is returned without going to the storage.
         If no matching object is found,
         a src.storage.exc.ObjectNotFound exception is raised.
         """
-        pass
+        if self.identity_map.scoped:
+            klass = self._get_queryable_class()
+            instance = self.identity_map.get(klass, identifier)
+            if instance is not None:
+                return instance
+        return self._identify(self._get(identifier))
 
     @abstractmethod
+    def _get(self, identifier):
+        """ Load an instance from the storage, see get() """
+        pass
+
+    def _identify(self, loaded):
+        """
+        Return the instance that is already known for the primary key
+        of a loaded object, brought up to date with the values loaded,
+        or make the loaded object the known instance if there is none.
+        Every object handed out by the manager goes through here.
+        """
+        klass = self._get_queryable_class()
+        pk = getattr(loaded, self._get_identifier_column_name())
+        known = self.identity_map.get(klass, pk)
+        if known is None:
+            self.identity_map.add(klass, pk, loaded)
+            return loaded
+        if known is not loaded:
+            self._refresh(known, loaded)
+        return known
+
+    def _refresh(self, known, loaded, keep_changes: bool = True) -> None:
+        """
+        Take over the column values of a copy that has just been loaded.
+        Attributes that have been changed but not saved yet keep their values,
+        unless 'keep_changes' is unset.
+        """
+        if isinstance(known, RowProxy):
+            if isinstance(loaded, RowProxy) and known.is_lazy():
+                # the proxy just reads from the newer row from now on
+                known.replace_row(loaded)
+                return
+            known = known.instance
+
+        # just like SQLAlchemy, which does not overwrite modified attributes
+        # when it loads a row again, the changes are tracked in the state
+        changed = instance_state(known).committed_state if keep_changes else {}
+        # like values loaded by SQLAlchemy itself,
+        # neither validators nor change tracking are run
+        for column in self.meta.column_names:
+            if column not in changed:
+                set_committed_value(known, column, getattr(loaded, column))
+
+    def _resync(self, pk, instance) -> None:
+        """
+        Bring an instance back in line with the storage,
+        e.g. once a transaction it has been changed in has failed.
+        Instances whose row is gone are dropped from the identity map.
+        """
+        klass = self._get_queryable_class()
+        try:
+            loaded = self._get(pk)
+        except ObjectNotFound:
+            self.identity_map.discard(klass, pk)
+            return
+        if loaded is not instance:
+            self._refresh(instance, loaded, keep_changes=False)
+
+    def _remember(self, instances) -> None:
+        """
+        Make saved instances the ones returned by get() from now on,
+        related objects that have been prefetched are outdated by them
+        """
+        klass = self._get_queryable_class()
+        pk_name = self._get_identifier_column_name()
+        for instance in instances:
+            # the values are saved now, so they are no longer changes of their own
+            state = instance_state(instance)
+            state._commit_all(state.dict)  # noqa protected member
+            self.identity_map.add(klass, getattr(instance, pk_name), instance)
+        written(klass)
+
+    def _forget(self, identifiers) -> None:
+        """ Drop deleted objects from the identity map and the prefetched ones """
+        klass = self._get_queryable_class()
+        for identifier in identifiers:
+            self.identity_map.discard(klass, identifier)
+        written(klass)
+
     def filter(self, **kwargs):
         """
-        Do exact and case sensitive filtering,
-        based on provided kwargs.
+        Do case sensitive filtering, based on provided kwargs.
+
+        Arguments are exact matches by default, other comparisons
+        are selected by appending a lookup to the column name,
+        e.g. 'kontostand__gte=100', see src.storage.lookups for all of them.
 
-        This will never throw an error and instead simply return an empty list,
-        if no matching entities could be found.
+        Returns a lazy QuerySet, which is only evaluated once it is used.
+        It is simply empty if no matching entities could be found.
+        Unknown columns or lookups raise a ValueError right away.
         """
-        pass
+        return QuerySet(self).filter(**kwargs)
 
-    @abstractmethod
     def all(self):
         """
         Syntactic / Semantic sugar for querying all entities of a Model.
         """
+        return QuerySet(self)
+
+    def prefetch_related(self, *names):
+        """ All entities, with their related objects loaded along with them """
+        return QuerySet(self).prefetch_related(*names)
+
+    @abstractmethod
+    def _fetch(self, filters, ordering, low, high):
+        """
+        Return the entities matching the filters, sorted by the ordering,
+        from position 'low' up to 'high' (or the end, if it is None).
+        This evaluates a QuerySet.
+        """
         pass
 
+    @abstractmethod
+    def _count(self, filters, low, high):
+        """ Count the entities matching the filters, within the given bounds """
+        pass
+
+    @abstractmethod
+    def _exists(self, filters, low, high):
+        """ Check whether any entity within the given bounds matches the filters """
+        pass
+
+    def values(self, *columns, **kwargs):
+        """
+        Like filter(), but returns a dict per entity,
+        holding only the requested columns (or all of them if none are given).
+
+        No model instances are created, so this is a lot cheaper
+        if only a few columns are needed.
+        """
+        columns = self._get_column_names(columns)
+        return [dict(zip(columns, row)) for row in self._select(columns, kwargs)]
+
+    def values_list(self, *columns, flat=False, **kwargs):
+        """
+        Like values(), but returns a tuple per entity.
+        If 'flat' is set and a single column is requested,
+        a plain list of its values is returned instead.
+        """
+        if flat and len(columns) != 1:
+            raise TypeError("'flat' can only be used with a single column")
+
+        columns = self._get_column_names(columns)
+        rows = self._select(columns, kwargs)
+        if flat:
+            return [row[0] for row in rows]
+        return [tuple(row) for row in rows]
+
+    @abstractmethod
+    def _select(self, columns, filters):
+        """
+        Return the values of the given columns
+        for all entities matching the filters, as a sequence per entity.
+        """
+        pass
+
+    def aggregate(self, *aggregates, group_by=None, **kwargs):
+        """
+        Compute aggregates, see src.storage.aggregates,
+        over all entities matching the filters.
+
+        Returns a dict holding the value of every aggregate by its alias.
+        If 'group_by' names one or more columns, a dict is returned
+        for every group instead, holding the values of those columns as well.
+        """
+        if not aggregates:
+            raise TypeError("aggregate() needs at least one aggregate")
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        group_by = self._get_column_names(group_by) if group_by else []
+        self._get_column_names([a.column for a in aggregates if a.column is not None])
+
+        keys = group_by + [aggregate.alias for aggregate in aggregates]
+        rows = self._aggregate(aggregates, group_by, kwargs)
+        results = [dict(zip(keys, row)) for row in rows]
+        return results if group_by else results[0]
+
+    @abstractmethod
+    def _aggregate(self, aggregates, group_by, filters):
+        """
+        Return a sequence per group, holding the values of the 'group_by' columns
+        followed by the values of the aggregates, sorted by the groups.
+        Without 'group_by' there is exactly one group, even if nothing matches.
+        """
+        pass
+
+    @abstractmethod
+    def bulk_save(self, instances):
+        """
+        Save many objects at once, in a single write to the storage.
+
+        Objects that do not pass the UNIQUE checks, either against the database
+        or against each other, are skipped instead of failing the whole batch.
+        Returns a BulkResult listing the saved and the skipped objects.
+        """
+        pass
+
+    @abstractmethod
+    def bulk_delete(self, objects):
+        """
+        Remove many objects at once, given either as instances
+        or by their primary keys.
+
+        Objects that could not be found are reported as failed
+        in the returned BulkResult.
+        """
+        pass
+
+    @abstractmethod
+    def iterator(self, chunk_size=1000, **kwargs):
+        """
+        Streaming variant of filter() and all().
+
+        Yields the matching entities one by one instead of returning a list.
+        Entities are fetched from the storage in chunks of 'chunk_size',
+        so going over a whole table only needs memory for a single chunk.
+        """
+        pass
+
+    # The awaitable variants run the blocking methods on the thread pool
+    # of the storage. Thread-local state, i.e. transactions and scopes
+    # of the identity map, does not carry over into them.
+
+    async def aget(self, identifier):
+        """ Awaitable variant of get() """
+        return await self.executor.run(self.get, identifier)
+
+    async def afilter(self, **kwargs):
+        """ Awaitable variant of filter(), returns the evaluated list """
+        return await self.executor.run(lambda: list(self.filter(**kwargs)))
+
+    async def aall(self):
+        """ Awaitable variant of all(), returns the evaluated list """
+        return await self.executor.run(lambda: list(self.all()))
+
+    async def asave(self):
+        """ Awaitable variant of save(), one write per table at a time """
+        return await self.executor.write(self.meta.tablename, self.save)
+
+    async def adelete(self):
+        """ Awaitable variant of delete(), one write per table at a time """
+        return await self.executor.write(self.meta.tablename, self.delete)
+
+
+# (user defined manager class, manager class of the storage) -> merged class
+_manager_classes: Dict[Tuple[type, type], type] = {}
+# (user defined manager class, model class) -> (storage, manager)
+_class_managers: Dict[Tuple[type, type], tuple] = {}
+
+
+def _merge_manager_class(cls: type, base: type) -> type:
+    try:
+        return _manager_classes[cls, base]
+    except KeyError:
+        pass
+
+    # Manually merge the class namespaces
+    # of our selected default manager class, e.g. SqlManager
+    # and the overriding Manager class the user defined
+    Manager = type(
+        cls.__name__,
+        (base,),
+        {attr: getattr(cls, attr) for attr in dir(cls) if not is_dunder(attr)},
+    )
+    Manager = decorate_class_object_methods(Manager, resolve_super_auto_resolution)
+
+    _manager_classes[cls, base] = Manager
+    return Manager
+
 
 class AbstractManager:
     """
@@ -97,30 +433,33 @@ class AbstractManager:
 
     def __new__(cls, klass, storage_type=None):
         from ..storage import Storage
-        from drizm_commons.sqla import Database
 
-        if not storage_type:
-            storage = Storage()
-        else:
-            storage = Storage(storage_type)
+        storage = Storage(storage_type)
 
-        db = storage.db
-        if isinstance(db, Database):
-            storage_name = "sql"
+        # Managers are created once per model class or instance,
+        # after that accessing 'objects' is a dictionary lookup.
+        # The manager of an instance is kept in its InstanceState,
+        # as the __dict__ of an instance is what gets stored.
+        if isclass(klass):
+            cache, key = _class_managers, (cls, klass)
         else:
-            storage_name = "json"
-
-        # Manually merge the class namespaces
-        # of our selected default manager class, e.g. SqlManager
-        # and the overriding Manager class the user defined
-        Manager = type(
-            cls.__name__,
-            (storage.manager,),
-            {attr: getattr(cls, attr) for attr in dir(cls) if not is_dunder(attr)},
-        )
-        Manager = decorate_class_object_methods(Manager, resolve_super_auto_resolution)
+            cache, key = instance_state(klass).info, ("manager", cls)
+
+        cached = cache.get(key)
+        if cached is not None and cached[0] is storage:
+            return cached[1]
 
-        return Manager(klass, db, storage_name)
+        Manager = _merge_manager_class(cls, storage.manager)
+        manager = Manager(
+            klass,
+            storage.db,
+            storage.manager.db_type,
+            storage.identity_map,
+            storage.metadata,
+            storage.executor,
+        )
+        cache[key] = (storage, manager)
+        return manager
 
 
 class BaseManager(AbstractManager):
@@ -1,8 +1,26 @@
 from abc import ABC
-from typing import Generic, List, Optional, TypeVar, ClassVar
+from typing import (
+    Any,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    ClassVar,
+    Union,
+)
 
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
+from src.storage.aggregates import Aggregate
+from src.storage.executor import StorageExecutor
+from src.storage.identity import IdentityMap
+from src.storage.metadata import MetadataRegistry, ModelMetadata
+from src.storage.query import QuerySet
 from src.storage.root_types import (
     ManagerT,
     AnyScalar,
@@ -11,22 +29,88 @@ from src.storage.root_types import (
     DatabaseObject,
 )
 
+class BulkResult:
+    succeeded: List[Union[DatabaseObject, Identifier]]
+    failed: List[Tuple[Union[DatabaseObject, Identifier], Exception]]
+    def __init__(self) -> None: ...
+    def __bool__(self) -> bool: ...
+
 class BaseManagerInterface(ABC, Generic[ManagerT]):
     klass: DatabaseObject
     db: ManagerT
     db_type: Optional[ClassVar[StorageType]]
     db_type: StorageType
+    identity_map: IdentityMap
+    executor: StorageExecutor
+    meta: ModelMetadata
     def __init__(
-        self, klass: DatabaseObject, storage: ManagerT, store_type: StorageType
+        self,
+        klass: DatabaseObject,
+        storage: ManagerT,
+        store_type: StorageType,
+        identity_map: Optional[IdentityMap] = None,
+        metadata: Optional[MetadataRegistry] = None,
+        executor: Optional[StorageExecutor] = None,
     ) -> None: ...
     def _is_static(self) -> bool: ...
     def _get_identifier_column_name(self) -> str: ...
     def _get_identifier(self) -> Identifier: ...
+    def _get_queryable_class(self) -> DeclarativeMeta: ...
+    def _get_column_names(self, columns: Sequence[str] = ...) -> List[str]: ...
+    def _identifier_of(self, obj: Union[DatabaseObject, Identifier]) -> Identifier: ...
     def save(self) -> None: ...
     def delete(self) -> None: ...
     def get(self, identifier: Identifier) -> DatabaseObject: ...
-    def filter(self, **kwargs: AnyScalar) -> List[DatabaseObject]: ...
-    def all(self) -> List[DatabaseObject]: ...
+    def _get(self, identifier: Identifier) -> DatabaseObject: ...
+    def _remember(self, instances: Iterable[DatabaseObject]) -> None: ...
+    def _forget(self, identifiers: Iterable[Identifier]) -> None: ...
+    def filter(self, **kwargs: AnyScalar) -> QuerySet: ...
+    def all(self) -> QuerySet: ...
+    def prefetch_related(self, *names: str) -> QuerySet: ...
+    def _fetch(
+        self,
+        filters: Dict[str, AnyScalar],
+        ordering: Sequence[str],
+        low: int,
+        high: Optional[int],
+    ) -> List[DatabaseObject]: ...
+    def _count(
+        self, filters: Dict[str, AnyScalar], low: int, high: Optional[int]
+    ) -> int: ...
+    def _exists(
+        self, filters: Dict[str, AnyScalar], low: int, high: Optional[int]
+    ) -> bool: ...
+    def values(self, *columns: str, **kwargs: AnyScalar) -> List[Dict[str, Any]]: ...
+    def values_list(
+        self, *columns: str, flat: bool = False, **kwargs: AnyScalar
+    ) -> List[Any]: ...
+    def _select(
+        self, columns: List[str], filters: Dict[str, AnyScalar]
+    ) -> Sequence[Sequence[Any]]: ...
+    def aggregate(
+        self,
+        *aggregates: Aggregate,
+        group_by: Optional[Union[str, Sequence[str]]] = None,
+        **kwargs: AnyScalar,
+    ) -> Union[Dict[str, Any], List[Dict[str, Any]]]: ...
+    def _aggregate(
+        self,
+        aggregates: Sequence[Aggregate],
+        group_by: List[str],
+        filters: Dict[str, AnyScalar],
+    ) -> Sequence[Sequence[Any]]: ...
+    def bulk_save(self, instances: Iterable[DatabaseObject]) -> BulkResult: ...
+    def bulk_delete(
+        self, objects: Iterable[Union[DatabaseObject, Identifier]]
+    ) -> BulkResult: ...
+    def iterator(
+        self, chunk_size: int = 1000, **kwargs: AnyScalar
+    ) -> Iterator[DatabaseObject]: ...
+    async def aget(self, identifier: Identifier) -> DatabaseObject: ...
+    async def afilter(self, **kwargs: AnyScalar) -> List[DatabaseObject]: ...
+    async def aall(self) -> List[DatabaseObject]: ...
+    async def asave(self) -> None: ...
+    async def adelete(self) -> None: ...
 
 T = TypeVar("T", bound=BaseManagerInterface)
 
@@ -0,0 +1,10 @@
+from .json import JsonManager
+
+
+class BinaryManager(JsonManager):
+    """
+    The binary storage keeps the same table interface as the JSON storage,
+    only the format of the files differs, so does nothing else.
+    """
+
+    db_type = "bin"
@@ -1,12 +1,13 @@
-import json
-from typing import List, NoReturn
+from array import array
+from itertools import islice
+from typing import Collection, Iterator, List, Mapping, NoReturn, Tuple
 
-from drizm_commons.inspect import SQLAIntrospector
-from drizm_commons.sqla import Registry, Base, SqlaDeclarativeEncoder
 
-from src.utils import find_index_by_value_at_key
-from .base import BaseManagerInterface
+from .base import BaseManagerInterface, BulkResult
 from ..exc import ObjectAlreadyExists, ObjectNotFound
+from ..hydration import Hydrator
+from ..lookups import Lookup, parse_lookups
+from ..table import AnyTable
 
 
 class JsonManager(BaseManagerInterface):
@@ -15,155 +16,260 @@ class JsonManager(BaseManagerInterface):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
-        self.inspect = SQLAIntrospector(self.klass)
-
-        self.filename = self.db.schema[self.inspect.tablename]["file"]
-        self.filepath = self.db.path / self.filename
-
-    # noinspection PyMethodMayBeStatic
-    def _read_file_contents(self):
-        # the default JSON decoder does not accept a file,
-        # that has just an empty list in it so we ignore the error
-        with open(self.filepath, "r") as fin:
-            try:
-                content = json.load(fin)
-            except ValueError:
-                content = []
-            return content
-
-    # noinspection PyMethodMayBeStatic
-    def _save(self, current_content, fout) -> None:
-        """ Writes the provided content into the provided file-object """
-        json.dump(current_content, fout, indent=4, cls=SqlaDeclarativeEncoder)
-
-    def _check_unique(self, current_content: List[dict]) -> None:
-        pk_column = self._get_identifier_column_name()
-        unique_keys = [k for k in self.inspect.unique_keys() if not k == pk_column]
-
-        instance_unique_values = {
-            key: getattr(self.klass, key)
-            for key in unique_keys
-            if key != self._get_identifier_column_name()
-        }
-        instance_primary_key = {pk_column: self._get_identifier()}
-
-        for entity in current_content:
-            entity_unique_values = [entity.get(key) for key in unique_keys]
-            entity_primary_key = entity.get(pk_column)
-
-            for (column_name, instance_value), entity_value in zip(
-                instance_unique_values.items(), entity_unique_values
-            ):
-                # The idea here is that if the value already exists,
-                # but the primary key is the same then we are just updating the object.
-                # If the value does exist on an instance with a different primary key however,
-                # that means there is actually a uniqueness violation occurring.
-                if instance_value == entity_value and (
-                    instance_primary_key != entity_primary_key
-                ):
-                    raise ObjectAlreadyExists(
-                        f"Value '{instance_value}' for Column "
-                        f"'{column_name}' of model "
-                        f"'{self.klass.__class__.__name__}' is not unique."
-                    )
-
-    def save(self):
-        current_content = self._read_file_contents()
-
-        with open(self.filepath, "w") as fout:
-            # If this finds a result,
-            # that means we are possibly updating the object right now
-            index = find_index_by_value_at_key(
-                current_content,
-                self._get_identifier_column_name(),
-                self._get_identifier(),
-            )
+        # resolved once, instead of for every row that is read
+        self.hydrator = Hydrator.for_model(
+            self._get_queryable_class(), self.db.hydration
+        )
 
-            # read the file -> add some content -> overwrite the file
-            try:
-                self._check_unique(current_content)
-
-            except Exception as exc:  # noqa too broad exception clause
-                # Make sure that in case anything goes wrong,
-                # we write the data back into the file.
-                # Otherwise even just a UniqueError would result in all data being lost.
-                self._save(current_content, fout)
-                raise exc
-
-            # We need to check for literal 'None',
-            # as an index of 0 would also be Falsy.
-            if index is None:
-                current_content.append(self.klass)
-            else:
-                current_content[index] = self.klass
+    @property
+    def table(self) -> AnyTable:
+        # looked up every time, as resharding replaces the table
+        return self.db.table(self.meta.tablename)
+
+    def _read_file_contents(self) -> Mapping:
+        """
+        Returns the cached rows of the table, indexed by their primary key.
+        The file itself is only read again if it was changed on disk.
+        """
+        return self.table.load()
+
+    def _unique_error(self, row: dict, column_name: str) -> ObjectAlreadyExists:
+        return ObjectAlreadyExists(
+            f"Value '{row[column_name]}' for Column "
+            f"'{column_name}' of model "
+            f"'{self._get_queryable_class().__name__}' is not unique."
+        )
 
-            self._save(current_content, fout)
+    def save(self):
+        row = self.table.serialize(self.klass)
+
+        # The unique indexes of the table map every value to the primary key
+        # of the row holding it. If the value is held by the row we are saving,
+        # we are just updating the object, if it is held by another row
+        # there is actually a uniqueness violation occurring.
+        # The row is checked and written while the table is locked,
+        # so no other thread or process can take the same values in between.
+        # A failing save leaves both the cache and the file untouched.
+        column_name = self._upsert([row])[0]
+        if column_name is not None:
+            raise self._unique_error(row, column_name)
+        self.db.commit(self.table)
+        self._remember([self.klass])
+
+    def _upsert(self, rows: List[dict]) -> List:
+        # Held back changes are only seen by this process until they are written,
+        # so the unique values of those are only safe against its own threads.
+        return self.table.upsert_many(rows, flush=not self.db.defers_writes())
 
     def delete(self) -> None:
-        current_content = self._read_file_contents()
-
-        with open(self.filepath, "w") as fout:
-            # read the file -> delete some content -> overwrite the file
-            index = find_index_by_value_at_key(
-                current_content,
-                self._get_identifier_column_name(),
-                self._get_identifier(),
-            )
-            current_content.pop(index)
-            self._save(current_content, fout)
+        # Looking the row up only reads the shard holding it,
+        # removing it then only appends to the log of that shard
+        identifier = self._get_identifier()
+        if self.table.get(identifier) is None:
+            self._not_found(identifier)
+        self.table.remove(identifier)
+        self.db.commit(self.table)
+        self._forget([identifier])
+
+    def bulk_save(self, instances):
+        instances = list(instances)
+        rows = [self.table.serialize(instance) for instance in instances]
+
+        # every row is checked against the table and the rows before it,
+        # all rows that pass are written out together
+        result = BulkResult()
+        conflicts = self._upsert(rows)
+        for instance, row, column_name in zip(instances, rows, conflicts):
+            if column_name is None:
+                result.succeeded.append(instance)
+            else:
+                result.failed.append((instance, self._unique_error(row, column_name)))
+        self.db.commit(self.table)
+        self._remember(result.succeeded)
+        return result
+
+    def bulk_delete(self, objects):
+        result = BulkResult()
+        for obj in objects:
+            identifier = self._identifier_of(obj)
+            if self.table.get(identifier) is None:
+                result.failed.append((obj, self._not_found_error(identifier)))
+            else:
+                self.table.remove(identifier)
+                result.succeeded.append(obj)
+        self.db.commit(self.table)
+        self._forget(map(self._identifier_of, result.succeeded))
+        return result
 
     def _construct_instance(self, data):
-        cls = Registry(Base)[self.inspect.classname]
-        cls = cls.__class__
-        return cls(**data)
+        return self.hydrator(data)
 
     def _not_found(self, identifier) -> NoReturn:
-        raise ObjectNotFound(
-            f"Object of type '{self.klass.__name__}' "
+        raise self._not_found_error(identifier)
+
+    def _not_found_error(self, identifier) -> ObjectNotFound:
+        return ObjectNotFound(
+            f"Object of type '{self._get_queryable_class().__name__}' "
             f"with primary key '{identifier}', "
             "could not be found."
         )
 
-    def get(self, identifier):
-        current_content = self._read_file_contents()
-        if not current_content:
-            self._not_found(identifier)
-
-        index = find_index_by_value_at_key(
-            current_content, self._get_identifier_column_name(), identifier
-        )
-        if not index:
-            self._not_found(identifier)
-
-        item = current_content[index]
+    def _get(self, identifier):
+        item = self.table.get(identifier)
         if not item:
             self._not_found(identifier)
 
         return self._construct_instance(item)
 
-    def filter(self, **kwargs):
-        current_content = self._read_file_contents()
+    def _parse_lookups(self, filters: dict) -> List[Lookup]:
+        lookups = []
+        for lookup in parse_lookups(filters, self.hydrator.columns):
+            # dates may be passed as ISO strings, just like to the constructor
+            value = lookup.value
+            if lookup.lookup == "in":
+                value = [self.hydrator.parse(lookup.column, v) for v in value]
+            elif lookup.lookup == "range":
+                value = tuple(self.hydrator.parse(lookup.column, v) for v in value)
+            else:
+                value = self.hydrator.parse(lookup.column, value)
+            lookups.append(lookup._replace(value=value))
+        return lookups
+
+    def _matches(self, entity: dict, lookups: List[Lookup]) -> bool:
+        parse = self.hydrator.parse
+        return all(
+            lookup.matches(parse(lookup.column, entity.get(lookup.column)))
+            for lookup in lookups
+        )
 
-        if not current_content:
-            return []
+    def _candidates(self, lookups: List[Lookup]) -> Tuple[Collection[dict], list]:
+        """
+        The first lookup that can be answered by an index narrows down the rows,
+        returns those rows and the lookups that still have to be checked.
+        """
+        rows = self._read_file_contents()
+
+        for position, (column, lookup, value) in enumerate(lookups):
+            pks = None
+            if column == self.table.pk and lookup in ("exact", "in"):
+                pks = [value] if lookup == "exact" else value
+            elif lookup != "exact" or value is not None:
+                pks = self.table.search(column, lookup, value)
+            if pks is not None:
+                candidates = [rows[pk] for pk in dict.fromkeys(pks) if pk in rows]
+                return candidates, lookups[:position] + lookups[position + 1 :]
+
+        return rows.values(), lookups
+
+    def _iter_rows(self, filters: dict) -> Iterator[dict]:
+        candidates, lookups = self._candidates(self._parse_lookups(filters))
+        if not lookups:
+            return iter(candidates)
+        return (entity for entity in candidates if self._matches(entity, lookups))
+
+    def _sorted(self, rows: List[dict], ordering) -> List[dict]:
+        parse = self.hydrator.parse
+
+        # Sorting is stable, so sorting by the last column first
+        # and by the first column last sorts by all of them.
+        # Just like in SQL, NULL values come before everything else.
+        for column in reversed(ordering):
+            descending = column.startswith("-")
+            name = column.lstrip("-")
+
+            def key(entity: dict, name=name):
+                value = parse(name, entity.get(name))
+                return (False,) if value is None else (True, value)
+
+            rows.sort(key=key, reverse=descending)
+        return rows
+
+    def _fetch(self, filters, ordering, low, high):
+        rows = self._iter_rows(filters)
+        if ordering:
+            rows = self._sorted(list(rows), ordering)
+        # only the rows within the slice are turned into instances
+        return [
+            self._identify(self._construct_instance(entity))
+            for entity in islice(rows, low, high)
+        ]
+
+    def _count(self, filters, low, high):
+        candidates, lookups = self._candidates(self._parse_lookups(filters))
+        if lookups:
+            total = sum(1 for entity in candidates if self._matches(entity, lookups))
+        else:
+            # answered by the primary key or an index alone
+            total = len(candidates)
+        return len(range(total)[low:high])
+
+    def _exists(self, filters, low, high):
+        if high is not None and high <= low:
+            return False
+        return next(islice(self._iter_rows(filters), low, None), None) is not None
+
+    def _select(self, columns, filters):
+        # the values are taken straight from the rows, no instances are created
+        return [
+            self.hydrator.extract(entity, columns)
+            for entity in self._iter_rows(filters)
+        ]
+
+    def _aggregate(self, aggregates, group_by, filters):
+        columns = list(
+            dict.fromkeys(a.column for a in aggregates if a.column is not None)
+        )
+        integers = self.hydrator.integer_columns
+        parse = self.hydrator.parse
+
+        def new_group() -> list:
+            # the number of rows and the values of every column,
+            # integers are packed into arrays, which can be reduced vectorised
+            return [0, {c: array("q") if c in integers else [] for c in columns}]
+
+        # group -> its rows and values, filled in a single pass over the rows
+        groups = {}
+        for entity in self._iter_rows(filters):
+            key = self.hydrator.extract(entity, group_by)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = new_group()
+            group[0] += 1
+            values = group[1]
+            for column in columns:
+                value = entity.get(column)
+                if value is None:
+                    continue
+                value = parse(column, value)
+                try:
+                    values[column].append(value)
+                except OverflowError:
+                    # beyond 64 bits, the column is reduced in plain Python
+                    values[column] = list(values[column]) + [value]
+
+        if not group_by and not groups:
+            groups[()] = new_group()
 
         results = []
-        for entity in current_content:
+        # Just like in SQL, NULL values come before everything else
+        for key in sorted(groups, key=lambda k: [(v is not None, v) for v in k]):
+            count, values = groups[key]
             results.append(
-                all([entity.get(column) == value for column, value in kwargs.items()])
+                key
+                + tuple(
+                    aggregate.reduce(
+                        range(count)
+                        if aggregate.column is None
+                        else values[aggregate.column]
+                    )
+                    for aggregate in aggregates
+                )
             )
-
-        entities = []
-        for index, matches_filter_params in enumerate(results):
-            if matches_filter_params:
-                entities.append(self._construct_instance(current_content[index]))
-
-        return entities
-
-    def all(self):
-        current_content = self._read_file_contents()
-
-        if not current_content:
-            return []
-
-        return [self._construct_instance(entity) for entity in current_content]
+        return results
+
+    def iterator(self, chunk_size=1000, **kwargs):
+        lookups = self._parse_lookups(kwargs)
+        for chunk in self.table.iter_chunks(chunk_size):
+            for entity in chunk:
+                if self._matches(entity, lookups):
+                    yield self._identify(self._construct_instance(entity))
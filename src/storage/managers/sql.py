@@ -1,39 +1,302 @@
+import operator
+from contextlib import contextmanager
+from typing import Hashable, Iterator, List
+
 import sqlalchemy.exc
-from sqlalchemy import inspect
-from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.orm import object_session
 
-from .base import BaseManagerInterface
+from .base import BaseManagerInterface, BulkResult
 from ..exc import ObjectNotFound, ObjectAlreadyExists
+from ..lookups import parse_lookups
+
+
+def _chunks(values: list, size: int = 500) -> Iterator[list]:
+    # SQLite allows at most 999 parameters per statement
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+# comparisons whose value is bound as a single parameter
+_OPERATORS = {
+    "exact": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+
+def _type_of(lookup: str, value):
+    # the type of a bound parameter depends on the type of its value,
+    # e.g. dates can be compared to dates or to strings
+    if lookup == "in":
+        types = {type(v) for v in value}
+        return types.pop() if len(types) == 1 else None
+    if lookup == "range":
+        return tuple(map(type, value))
+    return type(value)
+
+
+def _shape(lookups: list) -> tuple:
+    """ The part of the lookups that ends up in the SQL, their values do not """
+    # comparing to None is compiled to 'IS NULL', which takes no parameter
+    shape = [
+        (column, "isnull", None)
+        if lookup == "exact" and value is None
+        else (column, lookup, _type_of(lookup, value))
+        for column, lookup, value in lookups
+    ]
+    # the order of the keyword arguments does not matter
+    return tuple(sorted(shape, key=lambda entry: entry[:2]))
+
+
+def _selected(column) -> Hashable:
+    """ The part of a selected column or aggregate that ends up in the SQL """
+    if isinstance(column, str):
+        return column
+    return type(column), column.column
+
+
+def _bind(column, name: str, value, **kwargs):
+    # the same type a comparison to the plain value would bind it as
+    type_ = column.type.coerce_compared_value(operator.eq, value)
+    return bindparam(name, type_=type_, **kwargs)
+
+
+def _criterion(column, lookup: str, name: str, value):
+    """ The condition of a lookup, with bound parameters in place of its value """
+    if lookup == "exact" and value is None:
+        return column.is_(None)
+    if lookup == "in":
+        # expanded into as many parameters as there are values on every call
+        if _type_of(lookup, value) is None:
+            return column.in_(bindparam(name, expanding=True))
+        return column.in_(_bind(column, name, next(iter(value)), expanding=True))
+    if lookup == "range":
+        low, high = value
+        return column.between(
+            _bind(column, f"{name}_low", low), _bind(column, f"{name}_high", high)
+        )
+    if lookup == "startswith":
+        return column.like(_bind(column, name, value), escape="/")
+    return _OPERATORS[lookup](column, _bind(column, name, value))
+
+
+def _parameters(lookups: list) -> dict:
+    """ The values of the lookups, bound to the parameters of _criterion() """
+    parameters = {}
+    for column, lookup, value in lookups:
+        name = f"{column}__{lookup}"
+        if lookup == "exact" and value is None:
+            continue
+        if lookup == "in":
+            parameters[name] = list(value)
+        elif lookup == "range":
+            parameters[f"{name}_low"], parameters[f"{name}_high"] = value
+        elif lookup == "startswith":
+            # the same escaping as startswith(autoescape=True)
+            escaped = value.replace("/", "//").replace("%", "/%").replace("_", "/_")
+            parameters[name] = f"{escaped}%"
+        else:
+            parameters[name] = value
+    return parameters
 
 
 class SqlManager(BaseManagerInterface):
     db_type = "sql"
 
-    def _get_queryable_class(self):
-        klass = self.klass
-        if not isinstance(self.klass, DeclarativeMeta):
-            klass = self.klass.__class__
-        return klass
+    def _conditions(self, filters: dict) -> list:
+        """ Compile the lookups of a filter call into SQL expressions """
+        klass = self._get_queryable_class()
+        conditions = []
+
+        lookups = parse_lookups(filters, self._get_column_names())
+        for column_name, lookup, value in lookups:
+            column = getattr(klass, column_name)
+            if lookup == "exact":
+                # comparing to None is compiled to 'IS NULL'
+                conditions.append(column == value)
+            elif lookup == "gt":
+                conditions.append(column > value)
+            elif lookup == "gte":
+                conditions.append(column >= value)
+            elif lookup == "lt":
+                conditions.append(column < value)
+            elif lookup == "lte":
+                conditions.append(column <= value)
+            elif lookup == "in":
+                conditions.append(column.in_(value))
+            elif lookup == "range":
+                conditions.append(column.between(*value))
+            elif lookup == "startswith":
+                conditions.append(column.startswith(value, autoescape=True))
+
+        return conditions
 
     def _is_transient(self) -> bool:
         return inspect(self.klass).transient
 
+    @contextmanager
+    def _savepoint(self, sess, instances: List) -> Iterator[None]:
+        """
+        Within a transaction, a failing flush only rolls back to a SAVEPOINT,
+        so the transaction can go on once the error has been handled.
+        Outside of one the session is simply rolled back.
+        The instances to be flushed keep the values they have had in memory,
+        instead of being expired by the rollback, their rows may be gone.
+        """
+        if not self.db.in_transaction():
+            yield
+            return
+
+        values = self.db.snapshot(instances)
+        try:
+            with sess.begin_nested():
+                yield
+        except BaseException:
+            self.db.restore(values)
+            raise
+
     def save(self):
         try:
-            with self.db.Session() as sess:
+            with self.db.Session() as sess, self._savepoint(sess, [self.klass]):
                 sess.add(self.klass)
+                # within a transaction the commit only happens later on,
+                # conflicts still have to be raised right here
+                sess.flush()
         except sqlalchemy.exc.IntegrityError as exc:
             raise ObjectAlreadyExists(exc.args[0]) from None
+        self._remember([self.klass])
+
+    def bulk_save(self, instances):
+        instances = list(instances)
+        result = BulkResult()
+
+        # The objects are checked and written within the same transaction,
+        # all that pass are added to a single session, the unit of work
+        # then inserts and updates them in batches using executemany()
+        try:
+            with self.db.Session() as sess:
+                conflicts = self._find_conflicts(sess, instances)
+                for instance in instances:
+                    if id(instance) in conflicts:
+                        result.failed.append((instance, conflicts[id(instance)]))
+                    else:
+                        result.succeeded.append(instance)
+
+                with self._savepoint(sess, result.succeeded):
+                    sess.add_all(result.succeeded)
+                    sess.flush()
+        except sqlalchemy.exc.IntegrityError:
+            # someone else has written conflicting rows since we have checked,
+            # so we fall back to saving the objects one by one
+            saved = []
+            for instance in result.succeeded:
+                try:
+                    with self.db.Session() as sess, self._savepoint(sess, [instance]):
+                        sess.add(instance)
+                        sess.flush()
+                except sqlalchemy.exc.IntegrityError as exc:
+                    result.failed.append((instance, ObjectAlreadyExists(exc.args[0])))
+                else:
+                    saved.append(instance)
+            result.succeeded = saved
+
+        self._remember(result.succeeded)
+        return result
+
+    def _find_conflicts(self, sess, instances: List) -> dict:
+        """
+        Check the UNIQUE columns of all instances with a query per column,
+        returns the ObjectAlreadyExists error of every conflicting instance,
+        indexed by the id() of the instance.
+        """
+        klass = self._get_queryable_class()
+        pk_name = self._get_identifier_column_name()
+        pk_column = getattr(klass, pk_name)
+        conflicts = {}
+
+        for column_name in self.meta.unique:
+            column = getattr(klass, column_name)
+            values = list({getattr(i, column_name) for i in instances} - {None})
+
+            # value -> primary key of the row holding it
+            owners = {}
+            for chunk in _chunks(values):
+                owners.update(sess.query(column, pk_column).filter(column.in_(chunk)))
+
+            for instance in instances:
+                value = getattr(instance, column_name)
+                if value is None or id(instance) in conflicts:
+                    continue
+                pk = getattr(instance, pk_name)
+
+                if column_name == pk_name:
+                    # new objects can not take the primary key of an existing row
+                    taken = value in owners and inspect(instance).transient
+                else:
+                    taken = owners.get(value, pk) != pk
+
+                if taken:
+                    conflicts[id(instance)] = ObjectAlreadyExists(
+                        f"Value '{value}' for Column '{column_name}' "
+                        f"of model '{klass.__name__}' is not unique."
+                    )
+                else:
+                    # the following instances are checked against this one
+                    owners[value] = pk
+
+        return conflicts
+
+    def bulk_delete(self, objects):
+        klass = self._get_queryable_class()
+        pk_column = getattr(klass, self._get_identifier_column_name())
+        objects = list(objects)
+        identifiers = [self._identifier_of(obj) for obj in objects]
+
+        existing = set()
+        with self.db.Session() as sess:
+            for chunk in _chunks(identifiers):
+                existing.update(
+                    pk for (pk,) in sess.query(pk_column).filter(pk_column.in_(chunk))
+                )
+                sess.query(klass).filter(pk_column.in_(chunk)).delete(
+                    synchronize_session=False
+                )
+
+        result = BulkResult()
+        for obj, identifier in zip(objects, identifiers):
+            if identifier in existing:
+                result.succeeded.append(obj)
+                # the same object may be listed twice, it is only deleted once
+                existing.discard(identifier)
+            else:
+                result.failed.append(
+                    (
+                        obj,
+                        ObjectNotFound(
+                            f"Object of type '{klass.__name__}' "
+                            f"with primary key '{identifier}', could not be found."
+                        ),
+                    )
+                )
+        self._forget(map(self._identifier_of, result.succeeded))
+        return result
 
     def delete(self) -> None:
         with self.db.Session() as sess:
             sess.delete(self.klass)
+        self._forget([self._get_identifier()])
 
-    def get(self, identifier):
+    def _get(self, identifier):
         klass = self._get_queryable_class()
 
+        def bake(bakery):
+            return bakery(lambda s: s.query(klass), klass)
+
         with self.db.Session() as sess:
-            obj = sess.query(klass).get(identifier)
+            obj = self.db.queries.get((klass, "get"), bake, sess).get(identifier)
             if not obj:
                 raise ObjectNotFound(
                     f"Object of type '{klass.__name__}' "
@@ -41,14 +304,155 @@ class SqlManager(BaseManagerInterface):
                 )
             return obj
 
-    def filter(self, **kwargs):
+    def _query(self, sess, filters: dict, ordering=(), low: int = 0, high=None):
+        """ Build the query behind a QuerySet """
         klass = self._get_queryable_class()
+        query = sess.query(klass).filter(*self._conditions(filters))
 
-        with self.db.Session() as sess:
-            return sess.query(klass).filter_by(**kwargs).all()
+        if ordering:
+            query = query.order_by(*self._ordering(ordering))
+        # slicing is pushed down to OFFSET and LIMIT
+        if low:
+            query = query.offset(low)
+        if high is not None:
+            query = query.limit(high - low)
+        return query
+
+    def _baked(
+        self,
+        sess,
+        filters: dict,
+        ordering=(),
+        low: int = 0,
+        high=None,
+        columns=None,
+        group_by=(),
+    ):
+        """
+        The same query as _query(), taken from the QueryCache of the storage.
+        Only the shape of the query is part of the key, e.g. filtering
+        the accounts of different customers compiles the query just once.
+        'columns' are the names of the columns or the aggregates
+        to be selected instead of the instances, grouped by 'group_by'.
+        """
+        klass = self._get_queryable_class()
+        lookups = parse_lookups(filters, self._get_column_names())
+        selected = None if columns is None else tuple(map(_selected, columns))
+        shape = (
+            klass,
+            selected,
+            tuple(group_by),
+            _shape(lookups),
+            tuple(ordering),
+            bool(low),
+            high is not None,
+        )
+
+        def bake(bakery):
+            entities = [klass] if columns is None else self._entities(columns)
+            group_columns = [getattr(klass, column) for column in group_by]
+            query = bakery(lambda s: s.query(*group_columns, *entities), shape)
+            # the values of this call only decide on the types of the parameters,
+            # which are the same for every call of this shape
+            query.add_criteria(
+                lambda q: self._bake(
+                    q, lookups, ordering, bool(low), high is not None, group_columns
+                )
+            )
+            return query
+
+        parameters = _parameters(lookups)
+        # slicing is pushed down to OFFSET and LIMIT
+        if low:
+            parameters["offset"] = low
+        if high is not None:
+            parameters["limit"] = high - low
+        return self.db.queries.get(shape, bake, sess).params(**parameters)
 
-    def all(self):
+    def _entities(self, columns) -> list:
         klass = self._get_queryable_class()
+        return [
+            getattr(klass, column)
+            if isinstance(column, str)
+            else column.compile(
+                None if column.column is None else getattr(klass, column.column)
+            )
+            for column in columns
+        ]
+
+    def _bake(self, query, lookups, ordering, offset: bool, limit: bool, group_by=()):
+        klass = self._get_queryable_class()
+        query = query.filter(
+            *[
+                _criterion(getattr(klass, column), lookup, f"{column}__{lookup}", value)
+                for column, lookup, value in lookups
+            ]
+        )
+        if group_by:
+            query = query.group_by(*group_by).order_by(*group_by)
+        if ordering:
+            query = query.order_by(*self._ordering(ordering))
+        if offset:
+            query = query.offset(bindparam("offset"))
+        if limit:
+            query = query.limit(bindparam("limit"))
+        return query
+
+    def _ordering(self, ordering) -> list:
+        klass = self._get_queryable_class()
+        # a leading '-' sorts by that column in descending order
+        return [
+            getattr(klass, column[1:]).desc()
+            if column.startswith("-")
+            else getattr(klass, column)
+            for column in ordering
+        ]
+
+    def _refresh(self, known, loaded, keep_changes: bool = True) -> None:
+        # super() is bound to the merged manager class, see _merge_manager_class
+        BaseManagerInterface._refresh(self, known, loaded, keep_changes)
+        sess = object_session(loaded)
+        if sess is not None:
+            # Within a transaction the loaded copy belongs to its session,
+            # the known instance takes its place, so it can be saved in there.
+            sess.expunge(loaded)
+            sess.add(known)
+
+    def _fetch(self, filters, ordering, low, high):
+        with self.db.Session() as sess:
+            objects = self._baked(sess, filters, ordering, low, high).all()
+            return [self._identify(obj) for obj in objects]
+
+    def _count(self, filters, low, high):
+        with self.db.Session() as sess:
+            return self._baked(sess, filters, (), low, high).count()
+
+    def _exists(self, filters, low, high):
+        with self.db.Session() as sess:
+            if low or high is not None:
+                query = self._query(sess, filters, (), low, high)
+                return sess.query(query.exists()).scalar()
+            # a single row is enough to tell
+            return self._baked(sess, filters).first() is not None
+
+    def _select(self, columns, filters):
+        # only the requested columns are selected, no instances are created
+        with self.db.Session() as sess:
+            return self._baked(sess, filters, columns=columns).all()
+
+    def _aggregate(self, aggregates, group_by, filters):
+        # a single GROUP BY query, no rows are sent back but the results
+        with self.db.Session() as sess:
+            return self._baked(
+                sess, filters, columns=aggregates, group_by=group_by
+            ).all()
 
+    def iterator(self, chunk_size=1000, **kwargs):
+        # The session stays open while the caller iterates,
+        # rows are fetched from the cursor 'chunk_size' at a time
         with self.db.Session() as sess:
-            return sess.query(klass).all()
+            query = self._baked(sess, kwargs).with_post_criteria(
+                lambda q: q.yield_per(chunk_size)
+            )
+            for obj in query:
+                yield self._identify(obj)
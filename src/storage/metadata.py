@@ -0,0 +1,78 @@
+from inspect import isclass
+from typing import Dict, Tuple
+
+from drizm_commons.inspect import SQLAIntrospector
+from drizm_commons.sqla import Base
+from sqlalchemy.types import TypeEngine
+
+
+class ModelMetadata:
+    """
+    Everything the managers need to know about a model,
+    introspected once instead of on every call.
+    """
+
+    __slots__ = (
+        "model",
+        "tablename",
+        "primary_keys",
+        "unique",
+        "foreign_keys",
+        "columns",
+        "column_names",
+        "indexed",
+    )
+
+    def __init__(self, model: type) -> None:
+        inspect = SQLAIntrospector(model)
+        table = model.__table__
+
+        self.model = model
+        self.tablename: str = inspect.tablename
+        self.primary_keys: Tuple[str, ...] = tuple(inspect.primary_keys())
+        # all UNIQUE columns, including the primary key
+        self.unique: Tuple[str, ...] = tuple(inspect.unique_keys())
+        # column name -> '<table>.<column>' it references
+        self.foreign_keys: Dict[str, str] = dict(inspect.foreign_keys())
+        # column name -> type, in the order the columns are declared in
+        self.columns: Dict[str, TypeEngine] = {c.name: c.type for c in table.columns}
+        self.column_names: Tuple[str, ...] = tuple(self.columns)
+        self.indexed: Tuple[str, ...] = tuple(c.name for c in table.columns if c.index)
+
+    @property
+    def pk(self) -> str:
+        """ Name of the primary key column """
+        if len(self.primary_keys) > 1:
+            raise TypeError("Composite-Primary Keys are not supported by this Manager")
+        return self.primary_keys[0]
+
+
+class MetadataRegistry:
+    """
+    The metadata of all models, built once when a Storage is created.
+
+    Models declared later on are added once they are first asked for.
+    """
+
+    def __init__(self) -> None:
+        self.models: Dict[type, ModelMetadata] = {}
+        self.tables: Dict[str, ModelMetadata] = {}
+
+        registry = Base._decl_class_registry  # noqa protected member
+        for model in list(registry.values()):
+            if isclass(model) and hasattr(model, "__table__"):
+                self.add(model)
+
+    def add(self, model: type) -> ModelMetadata:
+        meta = ModelMetadata(model)
+        self.models[model] = self.tables[meta.tablename] = meta
+        return meta
+
+    def __getitem__(self, model: type) -> ModelMetadata:
+        try:
+            return self.models[model]
+        except KeyError:
+            return self.add(model)
+
+
+__all__ = ["ModelMetadata", "MetadataRegistry"]
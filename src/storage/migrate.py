@@ -0,0 +1,36 @@
+"""
+Command for bringing an existing storage up to date with the models,
+e.g. after an index has been declared on a column:
+``python -m src.storage.migrate sql``
+
+The storages are migrated on startup as well, this only reports what changed.
+"""
+import argparse
+import os
+from typing import List, Optional
+
+from .storage import Storage
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.storage.migrate",
+        description="Create missing tables and indexes of an existing storage.",
+    )
+    parser.add_argument("storage_type", choices=["sql", "json", "bin"])
+    args = parser.parse_args(argv)
+
+    db = Storage(args.storage_type).db
+    location = db.engine.url.database if args.storage_type == "sql" else db.path
+    if not os.path.exists(location):
+        parser.error(f"There is no {args.storage_type} storage at '{location}'")
+
+    changes = db.create()
+    for change in changes:
+        print(change)
+    if not changes:
+        print("Everything is up to date.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .lookups import parse_lookups
+from .related import Related
+
+
+class QuerySet:
+    """
+    Lazy result of filter() and all().
+
+    Nothing is read from the storage until the result is actually needed,
+    e.g. when iterating over it or calling len() on it.
+    The result is then cached, so evaluating it again is free.
+
+    count(), exists(), first() and slicing do not evaluate the whole result,
+    instead they are passed on to the manager, which can answer them
+    without reading or creating every single object,
+    e.g. by using COUNT, LIMIT and OFFSET in SQL.
+    """
+
+    def __init__(
+        self,
+        manager,
+        filters: Optional[Dict[str, Any]] = None,
+        ordering: Tuple[str, ...] = (),
+        low: int = 0,
+        high: Optional[int] = None,
+        prefetch: Tuple[str, ...] = (),
+    ) -> None:
+        self.manager = manager
+        self.filters = filters or {}
+        self.ordering = ordering
+        # the slice of the result, set by indexing
+        self.low = low
+        self.high = high
+        # names of the Related attributes to load along with the result
+        self.prefetch = prefetch
+
+        self._result_cache: Optional[List] = None
+
+    def _clone(self, **changes) -> "QuerySet":
+        options = {
+            "filters": self.filters,
+            "ordering": self.ordering,
+            "low": self.low,
+            "high": self.high,
+            "prefetch": self.prefetch,
+        }
+        options.update(changes)
+        return self.__class__(self.manager, **options)
+
+    def _fetch_all(self) -> List:
+        if self._result_cache is None:
+            result = list(
+                self.manager._fetch(self.filters, self.ordering, self.low, self.high)
+            )
+            for name in self.prefetch:
+                self._related(name).prefetch(result)
+            self._result_cache = result
+        return self._result_cache
+
+    def filter(self, **kwargs) -> "QuerySet":
+        """ Narrow the result down further, see the filter() of the managers """
+        if self.low or self.high is not None:
+            raise TypeError("Can not filter a query once it has been sliced")
+        # fail early on unknown columns or lookups, instead of when evaluating
+        parse_lookups(kwargs, self.manager._get_column_names())
+        return self._clone(filters={**self.filters, **kwargs})
+
+    def all(self) -> "QuerySet":
+        """ A copy of this query, which is evaluated anew """
+        return self._clone()
+
+    def order_by(self, *columns: str) -> "QuerySet":
+        """
+        Sort the result by the given columns,
+        a leading '-' sorts by that column in descending order.
+        """
+        if self.low or self.high is not None:
+            raise TypeError("Can not reorder a query once it has been sliced")
+        self.manager._get_column_names([column.lstrip("-") for column in columns])
+        return self._clone(ordering=columns)
+
+    def prefetch_related(self, *names: str) -> "QuerySet":
+        """
+        Load the related objects, see src.storage.related.Related,
+        of all objects in the result along with it,
+        using a single query per name instead of one per object.
+        """
+        for name in names:
+            self._related(name)
+        return self._clone(prefetch=self.prefetch + names)
+
+    def _related(self, name: str) -> Related:
+        model = self.manager._get_queryable_class()
+        related = getattr(model, name, None)
+        if not isinstance(related, Related):
+            raise ValueError(
+                f"'{name}' is not a related attribute of model '{model.__name__}'"
+            )
+        return related
+
+    def count(self) -> int:
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return self.manager._count(self.filters, self.low, self.high)
+
+    def exists(self) -> bool:
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        return self.manager._exists(self.filters, self.low, self.high)
+
+    def aggregate(self, *aggregates, group_by=None):
+        """ Compute aggregates over the result, see aggregate() of the managers """
+        if self.low or self.high is not None:
+            raise TypeError("Can not aggregate a query once it has been sliced")
+        return self.manager.aggregate(*aggregates, group_by=group_by, **self.filters)
+
+    def first(self):
+        """ The first object of the result, or None if there is none """
+        if self._result_cache is not None:
+            return self._result_cache[0] if self._result_cache else None
+        result = list(self[:1])
+        return result[0] if result else None
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop = item.start or 0, item.stop
+            if item.step is not None or start < 0 or (stop is not None and stop < 0):
+                raise ValueError("Only slices with positive bounds are supported")
+            if self._result_cache is not None:
+                return self._result_cache[item]
+
+            # slicing a slice narrows down the bounds of the outer one
+            low, high = self.low + start, self.high
+            if stop is not None:
+                high = self.low + max(start, stop)
+                if self.high is not None:
+                    high = min(high, self.high)
+            if high is not None:
+                low = min(low, high)
+            return self._clone(low=low, high=high)
+
+        if not isinstance(item, int):
+            raise TypeError(f"Indices must be integers or slices, not {type(item)}")
+        if self._result_cache is not None:
+            return self._result_cache[item]
+        if item < 0:
+            raise ValueError("Negative indexing is not supported")
+
+        result = list(self[item : item + 1])
+        if not result:
+            raise IndexError("QuerySet index out of range")
+        return result[0]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._fetch_all())
+
+    def __len__(self) -> int:
+        return len(self._fetch_all())
+
+    def __bool__(self) -> bool:
+        return bool(self._fetch_all())
+
+    def __repr__(self) -> str:
+        items = list(islice(self, 21))
+        if len(items) > 20:
+            items[-1] = "..."
+        return f"<{self.__class__.__name__} {items!r}>"
+
+
+__all__ = ["QuerySet"]
@@ -0,0 +1,102 @@
+from collections import defaultdict
+from typing import Dict, Iterable
+
+from drizm_commons.sqla import Base
+
+# name of the entry in the InstanceState.info of an object,
+# that holds the related objects which have been prefetched for it
+PREFETCH_CACHE = "prefetched"
+
+# model -> how often objects of it have been saved or deleted,
+# prefetched objects are only used as long as this has not changed
+_writes: Dict[type, int] = defaultdict(int)
+
+
+def written(model) -> None:
+    """
+    Called by the managers, whenever objects of a model are saved or deleted.
+    Everything that has been prefetched of that model is loaded again.
+    """
+    _writes[model] += 1
+
+
+def _info(instance) -> dict:
+    # Lazily hydrated rows pass the attribute on to the instance
+    # they stand in for, so the cache always ends up on the actual instance.
+    # It can not be put into the __dict__, as that is what is stored.
+    return instance._sa_instance_state.info  # noqa protected member
+
+
+class Related:
+    """
+    The objects of another model, that reference an object by a foreign key.
+
+    Used as a class attribute of the referenced model, e.g.
+    ``konten = Related("Konto", "besitzer")`` on Kunde,
+    accessing it on an instance returns the QuerySet of all objects
+    whose foreign key column holds the primary key of that instance.
+
+    QuerySet.prefetch_related() loads the related objects
+    of a whole list of instances with a single query,
+    accessing the attribute then does not touch the storage anymore,
+    until an object of the related model is saved or deleted.
+    """
+
+    # at most this many primary keys are looked up with a single query
+    batch_size: int = 500
+
+    def __init__(self, model: str, column: str) -> None:
+        # the model is given by its name, as it is usually declared later on
+        self.model_name = model
+        self.column = column
+        self.name = None
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+
+    @property
+    def model(self):
+        return Base._decl_class_registry[self.model_name]  # noqa protected member
+
+    @property
+    def target(self) -> str:
+        """ Name of the column the foreign key references """
+        column = self.model.__table__.columns[self.column]
+        return next(iter(column.foreign_keys)).column.name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        queryset = self.model.objects.filter(
+            **{self.column: getattr(instance, self.target)}
+        )
+
+        prefetched = _info(instance).get(PREFETCH_CACHE, {})
+        writes, objects = prefetched.get(self.name, (None, None))
+        if writes == _writes[self.model]:
+            # the QuerySet is handed out already evaluated
+            queryset._result_cache = list(objects)
+        return queryset
+
+    def prefetch(self, instances: Iterable) -> None:
+        """ Load the related objects of all instances in one go """
+        instances = list(instances)
+        target = self.target
+        pks = list(dict.fromkeys(getattr(instance, target) for instance in instances))
+
+        # taken before the query, so writes in the meantime are not missed
+        writes = _writes[self.model]
+        related = defaultdict(list)
+        manager = self.model.objects
+        for start in range(0, len(pks), self.batch_size):
+            chunk = pks[start : start + self.batch_size]
+            for obj in manager.filter(**{f"{self.column}__in": chunk}):
+                related[getattr(obj, self.column)].append(obj)
+
+        for instance in instances:
+            prefetched = _info(instance).setdefault(PREFETCH_CACHE, {})
+            prefetched[self.name] = (writes, related.get(getattr(instance, target), []))
+
+
+__all__ = ["Related"]
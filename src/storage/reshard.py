@@ -0,0 +1,36 @@
+"""
+Offline command for changing the number of shards of a file based table.
+
+Stop everything that is using the storage before running it, e.g.:
+``python -m src.storage.reshard json konto 4``
+"""
+import argparse
+from typing import List, Optional
+
+from .storage import Storage
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.storage.reshard",
+        description="Redistribute the rows of a table over a new number of shards.",
+    )
+    parser.add_argument("storage_type", choices=["json", "bin"])
+    parser.add_argument("table", help="name of the table, e.g. 'konto'")
+    parser.add_argument("shards", type=int, help="the new number of shards")
+    args = parser.parse_args(argv)
+
+    db = Storage(args.storage_type).db
+    if not db.path.exists():
+        parser.error(f"There is no {args.storage_type} storage at '{db.path}'")
+    db.create()
+
+    if args.table not in db.schema:
+        parser.error(f"Unknown table '{args.table}'")
+    db.reshard(args.table, args.shards)
+
+    print(f"Table '{args.table}' now has {args.shards} shard(s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,16 @@ from typing import TypeVar
 
 from drizm_commons.sqla import Database, Base
 
+from src.storage.binary import BinaryAdapter
 from src.storage.json import JsonAdapter
-from src.storage.managers import sql, json
+from src.storage.managers import binary, sql, json
 from src.storage.managers.mixin import ManagerMixin
 
-ManagerT = TypeVar("ManagerT", sql.SqlManager, json.JsonManager)
-StorageT = TypeVar("StorageT", JsonAdapter, Database)
+ManagerT = TypeVar("ManagerT", sql.SqlManager, json.JsonManager, binary.BinaryManager)
+StorageT = TypeVar("StorageT", JsonAdapter, BinaryAdapter, Database)
 
 AnyScalar = typing.Union[int, float, str]
 Identifier = typing.Union[int, str]
-StorageType = typing.Literal["sql", "json"]
+StorageType = typing.Literal["sql", "json", "bin"]
 
 class DatabaseObject(ManagerMixin, Base): ...
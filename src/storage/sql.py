@@ -0,0 +1,233 @@
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from drizm_commons.sqla import Base, Database
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Session as SqlaSession
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
+from sqlalchemy.pool import QueuePool
+
+from .baked import QueryCache
+
+# name of the profile -> PRAGMA statements run on every new connection
+SQLITE_PROFILES: Dict[str, Dict[str, Union[int, str]]] = {
+    # whatever SQLite does by default
+    "default": {},
+    "performance": {
+        # Readers do not block the writer and the other way round,
+        # a commit only appends to the write-ahead log.
+        "journal_mode": "WAL",
+        # In WAL mode this only syncs at checkpoints, a crash of the application
+        # never corrupts the database, a power loss may lose the last commits.
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        # negative values are in KiB instead of pages
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+        # wait for other processes to release their locks, in milliseconds
+        "busy_timeout": 5000,
+    },
+}
+
+_PRAGMA_VALUE = re.compile(r"^(-?\d+|[A-Za-z_]+)$")
+
+
+class SqlAdapter(Database):
+    """
+    The SQL storage, an SQLite database file by default.
+
+    Every manager call runs in a session of its own, unless it is made
+    within transaction(). All calls within it then share a single session,
+    which is committed once the block is done, or rolled back if it raises.
+    Connections are pooled, so they are reused across sessions,
+    just like the queries of the managers are compiled only once.
+
+    The 'profile' is applied to every connection, it is either the name
+    of one of the SQLITE_PROFILES or a dict of PRAGMA names and values.
+    """
+
+    def __init__(
+        self,
+        host: str = "data.sqlite3",
+        profile: Union[str, Dict[str, Union[int, str]]] = "default",
+    ) -> None:
+        self.pragmas = self._get_pragmas(profile)
+        super().__init__(dialect="sqlite", host=host)
+        event.listen(self.engine, "connect", self._apply_pragmas)
+        # pysqlite only begins a transaction right before the first change,
+        # so a SAVEPOINT taken before that would be released as the transaction
+        # itself, committing it. SQLAlchemy begins them instead.
+        event.listen(self.engine, "connect", self._disable_implicit_begin)
+        event.listen(self.engine, "begin", self._begin)
+
+        # the session of the transaction the current thread is in
+        self._local = threading.local()
+
+        # the compiled queries of the managers, see QueryCache
+        self.queries = QueryCache()
+
+    @staticmethod
+    def _get_pragmas(profile) -> Dict[str, Union[int, str]]:
+        if isinstance(profile, str):
+            try:
+                return dict(SQLITE_PROFILES[profile])
+            except KeyError:
+                raise ValueError(
+                    f"Value '{profile}' is not a valid profile, "
+                    f"must be one of {list(SQLITE_PROFILES)}"
+                ) from None
+
+        # PRAGMAs can not be parametrized, so only plain values are accepted
+        for name, value in profile.items():
+            if not name.isidentifier() or not _PRAGMA_VALUE.match(str(value)):
+                raise ValueError(f"Invalid PRAGMA '{name} = {value}'")
+        return dict(profile)
+
+    def _apply_pragmas(self, connection, _) -> None:
+        cursor = connection.cursor()
+        try:
+            for name, value in self.pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _disable_implicit_begin(connection, _) -> None:
+        connection.isolation_level = None
+
+    @staticmethod
+    def _begin(connection) -> None:
+        connection.execute("BEGIN")
+
+    def _get_connection_conf(self, config) -> Tuple[str, dict]:
+        uri, engine_args = super()._get_connection_conf(config)
+        if config.get("dialect") == "sqlite" and config.get("host"):
+            # SQLAlchemy does not pool connections to SQLite files by default,
+            # so every session would open the file again.
+            # There is no server that could drop them, so they are not pinged.
+            engine_args["poolclass"] = QueuePool
+            engine_args.pop("pool_pre_ping", None)
+        return uri, engine_args
+
+    def create(self, base_override=None) -> List[str]:
+        """
+        Create all tables that do not exist yet.
+        Returns what had to be migrated, see migrate().
+        """
+        super().create(base_override)
+        return self.migrate(base_override)
+
+    def migrate(self, base_override=None) -> List[str]:
+        """
+        Bring an existing database up to date with the models.
+
+        Tables that have been declared since are created,
+        just like indexes that have been declared on existing tables,
+        which create_all() leaves alone.
+        Returns a description of every change.
+        """
+        base = base_override or Base
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        changes = []
+
+        for table in base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                # its indexes are created along with it
+                table.create(bind=self.engine)
+                changes.append(f"Created table '{table.name}'")
+                continue
+
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=self.engine)
+                    changes.append(
+                        f"Created index '{index.name}' on table '{table.name}'"
+                    )
+
+        for change in changes:
+            self.logger.info(change)
+        return changes
+
+    def in_transaction(self) -> bool:
+        return getattr(self._local, "session", None) is not None
+
+    @contextmanager
+    def Session(self) -> Iterator[SqlaSession]:
+        """ The session of the current transaction, or a new one """
+        session = getattr(self._local, "session", None)
+        if session is not None:
+            # committed by the transaction, once it is done
+            yield session
+            return
+
+        with super().Session() as session:
+            yield session
+
+    @contextmanager
+    def transaction(self) -> Iterator[SqlaSession]:
+        """
+        Share a single session between all manager calls within the block.
+        Transactions within a transaction are part of the outer one.
+        """
+        if self.in_transaction():
+            yield self._local.session
+            return
+
+        with super().Session() as session:
+            self._local.session = session
+            try:
+                yield session
+            except BaseException:
+                self._rollback(session)
+                raise
+            finally:
+                self._local.session = None
+
+    @staticmethod
+    def snapshot(instances: Iterable) -> List[Tuple[object, dict]]:
+        """ The values the instances currently have in memory """
+        values = []
+        for instance in instances:
+            state = instance_state(instance)
+            keys = [attr.key for attr in state.mapper.column_attrs]
+            values.append(
+                (instance, {k: state.dict[k] for k in keys if k in state.dict})
+            )
+        return values
+
+    @staticmethod
+    def restore(values: List[Tuple[object, dict]]) -> None:
+        """
+        Give instances expired by a rollback the values of a snapshot() again,
+        as far as they have not been loaded anew.
+        """
+        for instance, snapshot in values:
+            state = instance_state(instance)
+            for key, value in snapshot.items():
+                if key not in state.dict:
+                    set_committed_value(instance, key, value)
+
+    def _rollback(self, session: SqlaSession) -> None:
+        """
+        Roll the session back and detach its instances, loaded again
+        from the database, instead of being expired, which could not be
+        loaded anymore once the session is closed. Those whose row is gone
+        keep the values they have had in memory.
+        """
+        values = self.snapshot(session)
+        session.rollback()
+        for instance, _ in values:
+            try:
+                session.refresh(instance)
+            except InvalidRequestError:
+                pass
+        self.restore(values)
+        session.expunge_all()
+
+
+__all__ = ["SqlAdapter"]
@@ -1,43 +1,62 @@
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+from .executor import StorageExecutor
+from .identity import IdentityMap
+from .metadata import MetadataRegistry
+
+
 class Storage:
     __interned = {}
 
-    def __new__(cls, storage_type=None):
+    def __new__(cls, storage_type=None, **options):
+        # Once a storage type has been initialized, it is simply returned.
+        # This is called whenever a manager is created, so it has to be cheap.
+        try:
+            return cls.__interned[storage_type or None]
+        except KeyError:
+            pass
+
         # We do all imports inside of the methods scope,
         # to avoid circular dependencies since we import this
         # module from across the board in the package
         from .json import JsonAdapter
-        from drizm_commons.sqla import Database
+        from .binary import BinaryAdapter
+        from .sql import SqlAdapter
 
         STORAGE_TYPES = {
-            "sql": lambda: Database(
-                dialect="sqlite",
-                host="data.sqlite3",
-            ),
-            "json": lambda: JsonAdapter(),
+            "sql": lambda **kwargs: SqlAdapter(host="data.sqlite3", **kwargs),
+            "json": lambda **kwargs: JsonAdapter(**kwargs),
+            "bin": lambda **kwargs: BinaryAdapter(**kwargs),
         }
 
         from .managers.sql import SqlManager
         from .managers.json import JsonManager
+        from .managers.binary import BinaryManager
 
-        MANAGER_TYPES = {"sql": SqlManager, "json": JsonManager}
+        MANAGER_TYPES = {
+            "sql": SqlManager,
+            "json": JsonManager,
+            "bin": BinaryManager,
+        }
 
-        # if no storage_type has explicitly been passed, attempt to return
-        # the saved default implementation
+        # if no storage_type has explicitly been passed,
+        # there is no saved default implementation yet
         if not storage_type:
-            try:
-                return cls.__interned[None]
-            except KeyError:
-                raise RuntimeError(
-                    f"Class Storage ({cls.__name__}) still awaiting initialization. "
-                    "You may have called storage related code, or created a model instance "
-                    "before initializing this class."
-                )
+            raise RuntimeError(
+                f"Class Storage ({cls.__name__}) still awaiting initialization. "
+                "You may have called storage related code, or created a model instance "
+                "before initializing this class."
+            )
 
         # If we do have a provided type, check if it is valid
-        # and initialize the database from that
+        # and initialize the database from that.
+        # Any additional options are passed on to the storage adapter,
+        # they only take effect on the first initialization of a storage type.
         try:
             db = STORAGE_TYPES[storage_type]
-            db = db()
+            db = db(**options)
 
             # managers get initialized dynamically,
             # with either a class object or class instance
@@ -50,14 +69,71 @@ class Storage:
                 f"a storage type, must be one of {STORAGE_TYPES.keys()}"
             )
 
+        obj = super().__new__(cls)
+        obj.db = db
+        obj.manager = manager
+        # the same row is always represented by the same instance
+        obj.identity_map = IdentityMap()
+        # runs the awaitable methods of the managers, e.g. aget()
+        obj.executor = StorageExecutor()
+        # everything the managers need to know about the models
+        obj.metadata = MetadataRegistry()
+
         # if this is the first initialization, we set this storage as default
-        if not cls.__interned or not cls.__interned[storage_type]:
-            obj = super().__new__(cls)
-            obj.db = db
-            obj.manager = manager
+        cls.__interned.setdefault(None, obj)
+        cls.__interned[storage_type] = obj
+        return obj
+
+    def session(self):
+        """
+        Scope the identity map to a block, e.g. ``with storage.session():``.
+
+        Every object loaded within the block is kept in memory
+        and returned again by get(), until the block is left.
+        """
+        return self.identity_map.scope()
+
+    @contextmanager
+    def transaction(self) -> Iterator["Storage"]:
+        """
+        Run all manager calls within the block as a single transaction,
+        e.g. ``with storage.transaction():``.
+
+        SQL uses a single session for all of them and commits once,
+        the file based storages write all changes out together.
+        If the block raises, nothing is written at all.
+        """
+        try:
+            with self.db.transaction():
+                yield self
+        except BaseException:
+            # instances changed within the block no longer match the storage
+            self._resync()
+            raise
+
+    def _resync(self) -> None:
+        """ Bring every instance in memory back in line with the storage """
+        from .managers import BaseManager
+
+        for (model, pk), instance in self.identity_map.items():
+            BaseManager(model, self.manager.db_type)._resync(pk, instance)
+
+    def flush(self) -> None:
+        """ Write out all changes the storage may still be holding back """
+        flush = getattr(self.db, "flush", None)
+        if flush is not None:
+            flush()
+
+
+def transactional(func: Callable) -> Callable:
+    """
+    Decorator running the function in a transaction of the default storage,
+    see Storage.transaction() for details.
+    """
 
-            if not cls.__interned:
-                cls.__interned[None] = obj
-            cls.__interned[storage_type] = obj
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with Storage().transaction():
+            return func(*args, **kwargs)
 
-        return cls.__interned[storage_type]
+    return wrapper
@@ -1,5 +1,9 @@
 import typing
-from typing import Dict, Optional, Type
+from typing import Any, ContextManager, Dict, Optional, Tuple, Type
+
+from src.storage.executor import StorageExecutor
+from src.storage.identity import IdentityMap
+from src.storage.metadata import MetadataRegistry
 from src.storage.root_types import StorageType, ManagerT, StorageT
 
 class Storage:
@@ -7,4 +11,11 @@ class Storage:
 
     db: StorageT
     manager: Type[ManagerT]
-    def __new__(cls, storage_type: Optional[StorageType] = None) -> Storage: ...
+    identity_map: IdentityMap
+    executor: StorageExecutor
+    metadata: MetadataRegistry
+    def __new__(
+        cls, storage_type: Optional[StorageType] = None, **options: Any
+    ) -> Storage: ...
+    def session(self) -> ContextManager[Dict[Tuple[type, Any], Any]]: ...
+    def flush(self) -> None: ...
@@ -0,0 +1,992 @@
+import json
+import os
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import ChainMap
+from contextlib import ExitStack, contextmanager
+from operator import itemgetter
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from drizm_commons.sqla import SqlaDeclarativeEncoder
+
+from .locking import FileLock, LockStats
+
+# (mtime, size) of a file, or None if it does not exist (yet)
+FileSignature = Optional[Tuple[int, int]]
+
+
+def iter_json_array(fin, block_size: int = 64 * 1024) -> Iterator[Any]:
+    """
+    Incrementally parse a JSON array from a text file,
+    yielding its items one by one.
+
+    Only a single block of the file and the item that is currently
+    being parsed are held in memory at any time.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position = "", 0
+    opened, eof = False, False
+
+    while True:
+        # skip the whitespace and separators in between the items
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+
+        if position < len(buffer):
+            if not opened:
+                if buffer[position] != "[":
+                    raise ValueError("File does not contain a JSON array")
+                opened = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # the item is cut off at the end of the buffer
+                if eof:
+                    raise
+            else:
+                # numbers at the very end of the buffer may be cut off as well
+                if end < len(buffer) or eof:
+                    position = end
+                    yield item
+                    continue
+
+        elif eof:
+            # just like json.load, we treat an empty file as an empty table
+            if not opened:
+                return
+            raise ValueError("Unterminated JSON array")
+
+        block = fin.read(block_size)
+        eof = not block
+        buffer, position = buffer[position:] + block, 0
+
+
+class SortedIndex:
+    """
+    The values of a column in sorted order, next to the primary keys
+    of the rows holding them, so ranges of values can be found by bisection.
+    NULL values are not indexed.
+    """
+
+    def __init__(self) -> None:
+        self.values = []
+        self.pks = []
+
+    def clear(self) -> None:
+        self.values, self.pks = [], []
+
+    def rebuild(self, pairs: Iterable[Tuple[Any, Any]]) -> None:
+        """ Fill the index from (value, primary key) pairs in a single sort """
+        pairs = sorted(pairs, key=itemgetter(0))
+        self.values = [value for value, _ in pairs]
+        self.pks = [pk for _, pk in pairs]
+
+    def add(self, value, pk) -> None:
+        position = bisect_right(self.values, value)
+        self.values.insert(position, value)
+        self.pks.insert(position, pk)
+
+    def discard(self, value, pk) -> None:
+        position = bisect_left(self.values, value)
+        while position < len(self.values) and self.values[position] == value:
+            if self.pks[position] == pk:
+                del self.values[position]
+                del self.pks[position]
+                return
+            position += 1
+
+    def range(
+        self,
+        low=None,
+        high=None,
+        include_low: bool = True,
+        include_high: bool = True,
+    ) -> list:
+        """ The primary keys of all rows with values in between the bounds """
+        start, end = 0, len(self.values)
+        if low is not None:
+            start = (bisect_left if include_low else bisect_right)(self.values, low)
+        if high is not None:
+            end = (bisect_right if include_high else bisect_left)(self.values, high)
+        return self.pks[start:end]
+
+
+class Table(ABC):
+    """
+    In-memory copy of a single table of a file based storage.
+
+    A table is stored as a snapshot, which holds all of its rows
+    and a change log, to which every change is appended as a single entry.
+    The log is replayed on top of the snapshot when loading.
+    Once the log grows too large compared to the snapshot,
+    it is folded into a new snapshot, this is called compaction.
+
+    The parsed content is kept around between manager calls
+    and is only read from disk again, if the files have been changed
+    by someone else in the meantime.
+
+    Several processes can share the files of a table. Reading takes
+    a shared lock, so any number of processes can read at the same time,
+    while appending to the log and replacing the files takes an exclusive one.
+
+    Rows are indexed by their primary key,
+    so single rows can be found, replaced and removed in constant time.
+    Every unique column gets an index of its own, which maps
+    the values of that column to the primary key of the row holding them.
+    Columns listed in 'indexed' get a sorted index,
+    which answers comparisons and ranges without going through all rows.
+    Foreign key columns, listed in 'foreign_keys', map each of their values
+    to the primary keys of all rows referencing it, so the rows related
+    to another one are found without going through all rows either.
+    """
+
+    # suffix of the change log, the snapshot uses the path it is given
+    log_suffix: ClassVar[str]
+    # mode the snapshot is opened with for reading
+    snapshot_mode: ClassVar[str] = "r"
+
+    # the log is never compacted while it is smaller than this (in bytes)
+    min_compaction_size: int = 64 * 1024
+
+    def __init__(
+        self,
+        path,
+        pk: str,
+        unique: Iterable[str] = (),
+        compaction_ratio: float = 2.0,
+        background_compaction: bool = True,
+        indexed: Iterable[str] = (),
+        foreign_keys: Iterable[str] = (),
+    ) -> None:
+        self.path = path
+        self.log_path = path.with_suffix(self.log_suffix)
+        self.lock = FileLock(path.with_suffix(".lock"))
+        self.pk = pk
+
+        # compact once the log is this many times the size of the snapshot
+        self.compaction_ratio = compaction_ratio
+        self.background_compaction = background_compaction
+
+        # primary key -> row, dicts keep their insertion order
+        # so the order of the rows in the file is preserved as well
+        self.rows: Dict[Any, dict] = {}
+
+        # column name -> {value -> primary key}
+        self.unique: Dict[str, Dict[Any, Any]] = {
+            column: {} for column in unique if column != pk
+        }
+        # column name -> sorted index of its values
+        self.sorted: Dict[str, SortedIndex] = {
+            column: SortedIndex() for column in indexed
+        }
+        # column name -> {value -> {primary key: None}},
+        # the inner dicts serve as ordered sets
+        self.foreign: Dict[str, Dict[Any, Dict[Any, None]]] = {
+            column: {} for column in foreign_keys
+        }
+        # while reading a snapshot, the sorted indexes are built in one go
+        self._defer_sorting = False
+
+        # changes that have been applied to the rows,
+        # but have not been written to the log yet.
+        # Only the latest change per primary key is kept.
+        self.pending: Dict[Any, dict] = {}
+
+        # signatures of the snapshot and the log at the time we last read them,
+        # if the files on disk do not match these anymore our copy is stale
+        self._signature: Optional[Tuple[FileSignature, FileSignature]] = None
+        # how many bytes of the log have been replayed onto our rows
+        self._log_offset = 0
+
+        self._lock = threading.RLock()
+        self._compaction: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _stat(path) -> FileSignature:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    @abstractmethod
+    def initialize(cls, path) -> None:
+        """ Create the snapshot file of an empty table """
+        pass
+
+    @abstractmethod
+    def serialize(self, instance) -> dict:
+        """ Convert a model instance into the row format stored in the files """
+        pass
+
+    def validate(self, row: dict) -> None:
+        """
+        Raise if the row can not be stored in the files,
+        before it is applied to the rows and held back for the log.
+        """
+        pass
+
+    @abstractmethod
+    def _read_snapshot(self) -> Iterable[dict]:
+        """ Read all rows from the snapshot """
+        pass
+
+    @abstractmethod
+    def _iter_snapshot(self, fin) -> Iterator[dict]:
+        """ Incrementally read the rows from the opened snapshot """
+        pass
+
+    @abstractmethod
+    def _write_snapshot(self, path, rows: List[dict]) -> None:
+        """ Write the provided rows as a snapshot to the given path """
+        pass
+
+    @abstractmethod
+    def _iter_log(self, offset: int) -> Iterator[Tuple[Optional[dict], int]]:
+        """
+        Yield the entries of the log starting at the given offset,
+        together with the offset right behind each of them.
+        Entries that can not be read are yielded as None.
+        """
+        pass
+
+    @abstractmethod
+    def _append(self, entries: Iterable[dict]) -> int:
+        """
+        Append the provided entries to the log in a single write
+        and return the number of bytes written.
+        """
+        pass
+
+    def load(self) -> Dict[Any, dict]:
+        """
+        Return the rows of this table, indexed by their primary key.
+
+        The files are only parsed if they have changed since we last read them.
+        The returned dict is the cache itself and must not be modified directly,
+        use upsert() and remove() followed by flush() instead.
+        """
+        with self._lock:
+            # unchanged files are not even locked
+            if self._is_fresh():
+                return self.rows
+
+            with self.lock.shared():
+                snapshot, log = self._stat(self.path), self._stat(self.log_path)
+                if self._signature is None or snapshot != self._signature[0]:
+                    self._reload()
+                elif log != self._signature[1]:
+                    if log is None or log[1] < self._log_offset:
+                        self._reload()
+                    else:
+                        # only the log has changed, so someone has appended to it,
+                        # we just need to replay the part we have not seen yet
+                        self._replay_log(self._log_offset)
+                self._signature = (snapshot, log)
+            return self.rows
+
+    def get(self, pk) -> Optional[dict]:
+        """ Return the row with the given primary key, if there is one """
+        return self.load().get(pk)
+
+    def _reload(self) -> None:
+        content = self._read_snapshot()
+
+        self.rows = {}
+        for index in self.unique.values():
+            index.clear()
+        for index in self.foreign.values():
+            index.clear()
+
+        self._defer_sorting = True
+        try:
+            for row in content:
+                self._upsert(row)
+        finally:
+            self._defer_sorting = False
+        for column, index in self.sorted.items():
+            index.rebuild(
+                (row[column], pk)
+                for pk, row in self.rows.items()
+                if row.get(column) is not None
+            )
+
+        self._replay_log(0)
+
+        # our own changes that have not been written yet,
+        # still have to be visible after reading the files again
+        for entry in self.pending.values():
+            self._apply(entry)
+
+    def _replay_log(self, offset: int) -> None:
+        for entry, offset in self._iter_log(offset):
+            if entry is not None:
+                self._apply(entry)
+        self._log_offset = offset
+
+    def _is_fresh(self) -> bool:
+        return self._signature == (self._stat(self.path), self._stat(self.log_path))
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[dict]]:
+        """
+        Yield the rows of this table in lists of at most 'chunk_size' rows.
+
+        If the table is already held in memory, the cached rows are used.
+        Otherwise the files are parsed incrementally without being cached,
+        so only the changes in the log and a single chunk of the snapshot
+        are held in memory at any time.
+        """
+        with self._lock:
+            in_memory = bool(self.pending) or self._is_fresh()
+            if in_memory:
+                rows = list(self.rows.values())
+
+        if in_memory:
+            for start in range(0, len(rows), chunk_size):
+                yield rows[start : start + chunk_size]
+            return
+
+        # primary key -> latest row, or None if the row has been deleted
+        changes = {}
+        # The lock is only held while reading the log and opening the snapshot,
+        # as a snapshot that is replaced afterwards stays readable through
+        # the opened file. Holding it while yielding could block the writes
+        # of whoever is iterating.
+        with self.lock.shared():
+            for entry, _ in self._iter_log(0):
+                if entry is None:
+                    continue
+                if entry["op"] == "upsert":
+                    changes[entry["row"][self.pk]] = entry["row"]
+                else:
+                    changes[entry["pk"]] = None
+            fin = open(self.path, self.snapshot_mode)
+
+        with fin:
+            yield from self._overlay(fin, changes, chunk_size)
+
+    def _overlay(
+        self, fin, changes: Dict[Any, Optional[dict]], chunk_size: int
+    ) -> Iterator[List[dict]]:
+        chunk = []
+        for row in self._iter_snapshot(fin):
+            pk = row[self.pk]
+            if pk in changes:
+                # rows that have been changed keep their position,
+                # rows that have been deleted are skipped
+                row = changes.pop(pk)
+                if row is None:
+                    continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        # whatever is left has been inserted after the snapshot was written
+        for row in changes.values():
+            if row is not None:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def _apply(self, entry: dict) -> None:
+        if entry["op"] == "upsert":
+            self._upsert(entry["row"])
+        else:
+            self._remove(entry["pk"])
+
+    def _index(self, row: dict) -> None:
+        for column, index in self.unique.items():
+            value = row.get(column)
+            # just like in SQL, NULL values never collide with each other
+            if value is not None:
+                index[value] = row[self.pk]
+
+        for column, index in self.foreign.items():
+            value = row.get(column)
+            if value is not None:
+                index.setdefault(value, {})[row[self.pk]] = None
+
+        if not self._defer_sorting:
+            for column, index in self.sorted.items():
+                value = row.get(column)
+                if value is not None:
+                    index.add(value, row[self.pk])
+
+    def _unindex(self, row: dict) -> None:
+        pk = row[self.pk]
+        for column, index in self.unique.items():
+            value = row.get(column)
+            if index.get(value) == pk:
+                del index[value]
+
+        for column, index in self.foreign.items():
+            value = row.get(column)
+            pks = index.get(value)
+            if pks is not None:
+                pks.pop(pk, None)
+                if not pks:
+                    del index[value]
+
+        for column, index in self.sorted.items():
+            value = row.get(column)
+            if value is not None:
+                index.discard(value, pk)
+
+    # noinspection PyMethodMayBeStatic
+    def stored_value(self, value):
+        """ Convert a value to the form it is stored in the rows """
+        return value
+
+    def search(self, column: str, lookup: str, value) -> Optional[list]:
+        """
+        Use the indexes of the column to find the primary keys
+        of the rows matching a lookup, see src.storage.lookups.
+
+        Returns None if the column has no fitting index or the lookup
+        can not be answered by it, the rows then have to be scanned instead.
+        """
+        if value is None:
+            return None
+
+        foreign = self.foreign.get(column)
+        if foreign is not None and lookup in ("exact", "in"):
+            values = [value] if lookup == "exact" else dict.fromkeys(value)
+            with self._lock:
+                return [
+                    pk for v in values for pk in foreign.get(self.stored_value(v), ())
+                ]
+
+        index = self.sorted.get(column)
+        if index is None:
+            return None
+
+        if lookup == "in":
+            value = [self.stored_value(v) for v in value]
+        elif lookup == "range":
+            value = tuple(self.stored_value(v) for v in value)
+        else:
+            value = self.stored_value(value)
+
+        with self._lock:
+            try:
+                if lookup == "exact":
+                    return index.range(value, value)
+                if lookup == "gt":
+                    return index.range(low=value, include_low=False)
+                if lookup == "gte":
+                    return index.range(low=value)
+                if lookup == "lt":
+                    return index.range(high=value, include_high=False)
+                if lookup == "lte":
+                    return index.range(high=value)
+                if lookup == "range":
+                    return index.range(*value)
+                if lookup == "in":
+                    pks = []
+                    for v in dict.fromkeys(value):
+                        if v is not None:
+                            pks += index.range(v, v)
+                    return pks
+                if lookup == "startswith" and isinstance(value, str) and value:
+                    # all strings starting with the prefix sort in between
+                    # the prefix and the prefix with its last character incremented
+                    if value[-1] == chr(0x10FFFF):
+                        return None
+                    high = value[:-1] + chr(ord(value[-1]) + 1)
+                    return index.range(value, high, include_high=False)
+            except TypeError:
+                # the column holds values that can not be compared to this one
+                return None
+        return None
+
+    def _upsert(self, row: dict) -> None:
+        pk = row[self.pk]
+        previous = self.rows.get(pk)
+        if previous is not None:
+            self._unindex(previous)
+        self.rows[pk] = row
+        self._index(row)
+
+    def _remove(self, pk) -> Optional[dict]:
+        row = self.rows.pop(pk, None)
+        if row is not None:
+            self._unindex(row)
+        return row
+
+    def find_conflict(self, row: dict) -> Optional[str]:
+        """
+        Return the name of the first unique column,
+        for which another row already holds the same value as the provided one.
+        """
+        self.load()
+        return self._find_conflict(row)
+
+    def _find_conflict(self, row: dict) -> Optional[str]:
+        pk = row[self.pk]
+        for column, index in self.unique.items():
+            value = row.get(column)
+            if value is not None and index.get(value, pk) != pk:
+                return column
+        return None
+
+    def upsert(self, row: dict) -> None:
+        """ Insert a row or replace the row with the same primary key """
+        self.validate(row)
+        with self._lock:
+            self._upsert(row)
+            self.pending[row[self.pk]] = {"op": "upsert", "row": row}
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """
+        Hold the table exclusively, against other threads and processes,
+        with the rows brought up to date first.
+        Whatever is checked within the block can not change until it is left.
+        """
+        with self._lock, self.lock.exclusive():
+            self.load()
+            yield
+
+    @contextmanager
+    def reserved(self) -> Iterator[None]:
+        """
+        Keep all other threads of this process away from the table,
+        they can neither read nor change it until the block is left.
+        """
+        with self._lock:
+            yield
+
+    def upsert_many(
+        self, rows: Iterable[dict], flush: bool = False
+    ) -> List[Optional[str]]:
+        """
+        Upsert all rows that do not violate a unique column.
+
+        The rows are checked against the table and against each other,
+        the table is only read once for the whole batch.
+        With 'flush' the rows are written before the table is released,
+        so no other process can take the same unique values in between.
+        Returns the conflicting column of every row, or None if it has been written.
+        """
+        rows = list(rows)
+        # a row that can not be stored fails the whole batch
+        for row in rows:
+            self.validate(row)
+
+        with self.locked():
+            conflicts = []
+            for row in rows:
+                column = self._find_conflict(row)
+                if column is None:
+                    self.upsert(row)
+                conflicts.append(column)
+            if flush:
+                self.flush()
+            return conflicts
+
+    def remove(self, pk) -> Optional[dict]:
+        """ Remove the row with the given primary key and return it """
+        with self._lock:
+            row = self._remove(pk)
+            if row is not None:
+                self.pending[pk] = {"op": "delete", "pk": pk}
+            return row
+
+    def flush(self) -> None:
+        """
+        Append all pending changes to the log,
+        compacting the table if the log has grown too large.
+        """
+        with self._lock:
+            if not self.pending:
+                return
+            log = self._write_pending()
+
+            if self._needs_compaction(log):
+                self._start_compaction()
+
+    def _write_pending(self) -> FileSignature:
+        with self.lock.exclusive():
+            try:
+                # all changes go out in a single write at the end of the file,
+                # so a crash can at most cut off the very last entry
+                written = self._append(self.pending.values())
+            except OSError:
+                # we do not know what made it to the disk,
+                # so the next load has to read the files again
+                self.invalidate()
+                raise
+            except Exception:  # noqa too broad exception clause
+                # The changes could not be encoded, so nothing has been written.
+                # They would fail every later flush as well, so they are dropped
+                # and the next load reads the rows again without them.
+                self.rollback()
+                raise
+            log = self._stat(self.log_path)
+        self.pending.clear()
+
+        # If nobody else has touched the log in the meantime,
+        # we do not have to read back what we have just written.
+        # Otherwise the next load will pick up their changes and ours.
+        if self._signature is not None and log is not None:
+            if log[1] == self._log_offset + written:
+                self._signature = (self._signature[0], log)
+                self._log_offset = log[1]
+        return log
+
+    def _needs_compaction(self, log: FileSignature) -> bool:
+        if log is None or log[1] < self.min_compaction_size:
+            return False
+        snapshot = self._stat(self.path)
+        snapshot_size = snapshot[1] if snapshot else 0
+        return log[1] > snapshot_size * self.compaction_ratio
+
+    def _start_compaction(self) -> None:
+        if not self.background_compaction:
+            self.compact()
+            return
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(target=self.compact, daemon=True)
+        self._compaction.start()
+
+    def compact(self) -> None:
+        """
+        Fold the log into a new snapshot.
+
+        The snapshot is written without holding the lock,
+        whatever is appended to the log in the meantime is carried over
+        into the new log, so writers never have to wait for the whole table
+        to be written.
+        """
+        with self._lock:
+            if self.pending:
+                self._write_pending()
+            self.load()
+            rows = list(self.rows.values())
+            snapshot, offset = self._signature[0], self._log_offset
+
+        # Write to a temporary file first, so that there always is
+        # a complete snapshot on disk, even if we die halfway through.
+        # Other processes may be compacting at the same time,
+        # so every process writes to a file of its own.
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        self._write_snapshot(tmp_path, rows)
+
+        with self._lock, self.lock.exclusive():
+            if self._stat(self.path) != snapshot:
+                # someone else has compacted the table in the meantime
+                os.remove(tmp_path)
+                return
+
+            try:
+                with open(self.log_path, "rb") as fin:
+                    fin.seek(offset)
+                    tail = fin.read()
+            except FileNotFoundError:
+                tail = b""
+            tmp_log_path = self.log_path.with_name(
+                f"{self.log_path.name}.{os.getpid()}.tmp"
+            )
+            with open(tmp_log_path, "wb") as fout:
+                fout.write(tail)
+
+            # Replaying a log on top of a snapshot that already contains
+            # some of its changes leads to the same result,
+            # so dying in between these two is not a problem.
+            os.replace(tmp_path, self.path)
+            os.replace(tmp_log_path, self.log_path)
+
+            # Whatever we have replayed after the first phase is now at the start
+            # of the new log. If the tail holds more than that,
+            # another process has appended in the meantime and the next load
+            # has to replay the rest of it.
+            self._log_offset -= offset
+            log = self._stat(self.log_path)
+            if len(tail) != self._log_offset:
+                log = None
+            self._signature = (self._stat(self.path), log)
+
+    def wait_for_compaction(self) -> None:
+        """ Block until a running background compaction has finished """
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+    def invalidate(self) -> None:
+        """ Force the next load to read the files again """
+        with self._lock:
+            self._signature = None
+
+    def rollback(self) -> None:
+        """ Drop all changes that have not been written yet """
+        with self._lock:
+            self.pending.clear()
+            self._signature = None
+
+    def lock_stats(self) -> LockStats:
+        """ How long this process has been waiting for the locks of this table """
+        return self.lock.stats
+
+    def close(self) -> None:
+        """ Release the lock file, the table can still be used afterwards """
+        self.wait_for_compaction()
+        self.lock.close()
+
+
+class JsonTable(Table):
+    """
+    A table stored as JSON.
+
+    The snapshot, '<table>.json', holds a list of rows
+    and every entry of the change log, '<table>.jsonl', is a single line.
+    """
+
+    log_suffix = ".jsonl"
+
+    @classmethod
+    def initialize(cls, path) -> None:
+        with open(path, "w") as fout:
+            json.dump([], fout)
+
+    def serialize(self, instance) -> dict:
+        return SqlaDeclarativeEncoder().default(instance)
+
+    def stored_value(self, value):
+        # dates and times are stored as ISO strings, which sort just the same
+        return SqlaDeclarativeEncoder().dump(value)
+
+    def _read_snapshot(self) -> Iterable[dict]:
+        # the default JSON decoder does not accept a file,
+        # that has just an empty list in it so we ignore the error
+        with open(self.path, "r") as fin:
+            try:
+                return json.load(fin)
+            except ValueError:
+                return []
+
+    def _iter_snapshot(self, fin) -> Iterator[dict]:
+        return iter_json_array(fin)
+
+    def _write_snapshot(self, path, rows: List[dict]) -> None:
+        with open(path, "w") as fout:
+            json.dump(rows, fout, indent=4, cls=SqlaDeclarativeEncoder)
+
+    def _iter_log(self, offset: int) -> Iterator[Tuple[Optional[dict], int]]:
+        try:
+            fin = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return
+
+        with fin:
+            fin.seek(offset)
+            for line in fin:
+                # a line without a newline is a write that is still in progress
+                # or has been interrupted, so we stop right before it
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the remains of a write that has been cut off,
+                    # which has been terminated by the next writer
+                    entry = None
+                yield entry, offset
+
+    def _append(self, entries: Iterable[dict]) -> int:
+        data = "".join(
+            json.dumps(entry, cls=SqlaDeclarativeEncoder) + "\n" for entry in entries
+        ).encode("utf-8")
+
+        with open(self.log_path, "ab+") as fout:
+            # if the last write has been cut off, we terminate its line
+            # so our own changes start on a line of their own
+            if fout.tell():
+                fout.seek(-1, os.SEEK_END)
+                if fout.read(1) != b"\n":
+                    data = b"\n" + data
+            fout.write(data)
+        return len(data)
+
+
+def shard_of(pk, shards: int) -> int:
+    """ Return the number of the shard holding the row with the given primary key """
+    # unlike hash(), crc32 is the same across processes and interpreter runs
+    return zlib.crc32(str(pk).encode("utf-8")) % shards
+
+
+def shard_paths(path, shards: int) -> list:
+    """ The snapshot paths of the shards, e.g. 'konto.json' -> 'konto.0.json' """
+    if shards == 1:
+        return [path]
+    return [path.with_suffix(f".{i}{path.suffix}") for i in range(shards)]
+
+
+class ShardedTable:
+    """
+    A table that is split into several shards, each of them a table of its own.
+
+    Rows are routed to their shard by a hash of their primary key,
+    so reading, writing or compacting a single row only ever touches
+    the files of a single shard. Anything that spans the whole table,
+    like listing all rows or checking unique values, fans out over all shards.
+    """
+
+    def __init__(self, shards: List[Table]) -> None:
+        self.shards = shards
+        self.pk = shards[0].pk
+
+    def shard(self, pk) -> Table:
+        """ Return the shard responsible for the given primary key """
+        return self.shards[shard_of(pk, len(self.shards))]
+
+    @property
+    def pending(self) -> Mapping[Any, dict]:
+        return ChainMap(*(shard.pending for shard in self.shards))
+
+    def serialize(self, instance) -> dict:
+        return self.shards[0].serialize(instance)
+
+    def validate(self, row: dict) -> None:
+        self.shards[0].validate(row)
+
+    def load(self) -> Mapping[Any, dict]:
+        """
+        Return a read-only view of the rows of all shards,
+        indexed by their primary key.
+        """
+        return ChainMap(*(shard.load() for shard in self.shards))
+
+    def get(self, pk) -> Optional[dict]:
+        return self.shard(pk).get(pk)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[dict]]:
+        for shard in self.shards:
+            yield from shard.iter_chunks(chunk_size)
+
+    def _shards_to_check(self, row: dict) -> List[Table]:
+        # Every shard only indexes the values of its own rows,
+        # so all of them have to be asked. Without any unique columns
+        # besides the primary key, only the shard of the row is read.
+        shard = self.shard(row[self.pk])
+        return self.shards if shard.unique else [shard]
+
+    def find_conflict(self, row: dict) -> Optional[str]:
+        for shard in self._shards_to_check(row):
+            column = shard.find_conflict(row)
+            if column is not None:
+                return column
+        return None
+
+    def upsert(self, row: dict) -> None:
+        self.shard(row[self.pk]).upsert(row)
+
+    def search(self, column: str, lookup: str, value) -> Optional[list]:
+        pks = []
+        for shard in self.shards:
+            found = shard.search(column, lookup, value)
+            if found is None:
+                return None
+            pks += found
+        return pks
+
+    def upsert_many(
+        self, rows: Iterable[dict], flush: bool = False
+    ) -> List[Optional[str]]:
+        rows = list(rows)
+        shards = {}
+        for row in rows:
+            self.validate(row)
+            for shard in self._shards_to_check(row):
+                shards[id(shard)] = shard
+
+        # Every shard is only read once for the whole batch.
+        # They are always locked in the same order, so two batches
+        # can not end up waiting for each other.
+        with ExitStack() as stack:
+            for shard in sorted(shards.values(), key=self.shards.index):
+                stack.enter_context(shard.locked())
+
+            conflicts = []
+            for row in rows:
+                column = None
+                for shard in self._shards_to_check(row):
+                    column = shard._find_conflict(row)  # noqa protected member
+                    if column is not None:
+                        break
+                if column is None:
+                    self.upsert(row)
+                conflicts.append(column)
+            if flush:
+                for shard in shards.values():
+                    shard.flush()
+            return conflicts
+
+    @contextmanager
+    def reserved(self) -> Iterator[None]:
+        # all shards at once and in the same order as upsert_many()
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.reserved())
+            yield
+
+    def remove(self, pk) -> Optional[dict]:
+        return self.shard(pk).remove(pk)
+
+    def flush(self) -> None:
+        for shard in self.shards:
+            shard.flush()
+
+    def compact(self) -> None:
+        for shard in self.shards:
+            shard.compact()
+
+    def wait_for_compaction(self) -> None:
+        for shard in self.shards:
+            shard.wait_for_compaction()
+
+    def invalidate(self) -> None:
+        for shard in self.shards:
+            shard.invalidate()
+
+    def rollback(self) -> None:
+        for shard in self.shards:
+            shard.rollback()
+
+    def lock_stats(self) -> LockStats:
+        stats = LockStats()
+        for shard in self.shards:
+            stats += shard.lock_stats()
+        return stats
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+
+AnyTable = Union[Table, ShardedTable]
@@ -1,14 +1,15 @@
 from abc import ABC, abstractmethod
 from typing import ClassVar, Optional
 
-from src.storage import Storage
+from src.storage import Storage, transactional
 from src import models
 
 
 class UI(ABC):
     storage_types: ClassVar = {
-        "sql": lambda: Storage("sql"),
+        "sql": lambda: Storage("sql", profile="performance"),
         "json": lambda: Storage("json"),
+        "bin": lambda: Storage("bin"),
     }
 
     storage: Storage
@@ -76,6 +77,8 @@ class UI(ABC):
         konto.kontostand -= sum_to_withdraw
         konto.objects.save()
 
+    # both accounts are updated together, or not at all
+    @transactional
     def do_transfer(
         self,
         sum_to_transfer: int,
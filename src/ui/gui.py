@@ -1,5 +1,8 @@
+from concurrent.futures import Future
 from datetime import date
+from difflib import SequenceMatcher
 from tkinter import *
+from typing import Callable, List, Optional, Sequence, Tuple
 import sys
 from src.models import Kunde
 from src.models.konto import Konto
@@ -9,12 +12,62 @@ from drizm_commons.utils.type import IterableKeyDictionary
 from .base import UI
 
 
+class BackgroundTask:
+    """
+    A call running on the worker pool of the storage,
+    so the window keeps responding while bcrypt or the storage are busy.
+
+    Tk may only be used from the main thread, so the result is polled
+    with after() and the callbacks are run by the main loop.
+    A cancelled task drops its result, as a running thread can not be stopped.
+    """
+
+    # milliseconds between two checks for the result
+    poll_interval = 50
+
+    def __init__(
+        self, root: Misc, future: Future, on_done: Callable, on_error: Callable
+    ) -> None:
+        self.root = root
+        self.future = future
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+        self.root.after(self.poll_interval, self._poll)
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        # only calls that have not started yet are actually stopped
+        self.future.cancel()
+
+    def _poll(self) -> None:
+        if self.cancelled:
+            return
+        if not self.future.done():
+            self.root.after(self.poll_interval, self._poll)
+            return
+
+        try:
+            result = self.future.result()
+        except Exception as exc:
+            self.on_error(exc)
+        else:
+            self.on_done(result)
+
 
 class GUI(UI):
     def __init__(self):
         self.storage = None
         self.login_window = None
 
+        # the call running in the background and its busy indicator
+        self.task: Optional[BackgroundTask] = None
+        self.busy: Optional[Frame] = None
+
+        # the list of accounts and the lines it currently shows
+        self.konten_list: Optional[Listbox] = None
+        self.konten_lines: List[str] = []
+
         self.tmpNamen = None
         self.tmpAnschrift = None
         self.tmpStadt = None
@@ -58,6 +111,13 @@ class GUI(UI):
             width=20,
             command=self.login_json,
         ).grid(row=6, sticky=N, pady=10)
+        Button(
+            self.master,
+            text="BIN",
+            font=("Calibri", 12),
+            width=20,
+            command=self.login_bin,
+        ).grid(row=7, sticky=N, pady=10)
         self.master.mainloop()
 
         super().__init__(self.storage)
@@ -161,6 +221,7 @@ class GUI(UI):
         Button(
             self.login_window,
             text="Bestehendes Konto auswählen",
+            command=self.show_konten,
             font=("Calibri", 12),
         ).grid(row=3, sticky=N, pady=5)
         Button(
@@ -185,6 +246,11 @@ class GUI(UI):
         self.master.destroy()
         self.storage.db.create()
 
+    def login_bin(self):
+        self.storage = self.storage_types["bin"]()
+        self.master.destroy()
+        self.storage.db.create()
+
     def login(self):
         self.login_window.destroy()
         self.login_window = Toplevel(self.master)
@@ -218,8 +284,91 @@ class GUI(UI):
             row=4, sticky=W, pady=5, padx=5
         )
 
-    def buttonLogin(self) -> Kunde:
-        user = Kunde.objects.login_user(self.tmpUsernameL.get(), self.tmpPasswortL.get())
+    def run_in_background(
+        self,
+        func: Callable,
+        *args,
+        on_done: Callable,
+        on_error: Optional[Callable] = None,
+        cancellable: bool = True,
+    ) -> None:
+        """
+        Run the function on the worker pool of the storage and pass its result
+        to 'on_done' on the main thread, or the exception it raised to 'on_error'.
+        Until then a busy indicator is shown, which allows to cancel the call,
+        unless it is not 'cancellable', e.g. as it writes to the storage.
+        Only one call runs at a time, starting another one cancels it.
+        """
+        self.cancel_task()
+
+        def finish(callback: Callable) -> Callable:
+            def wrapper(value) -> None:
+                self.task = None
+                self.hide_busy()
+                callback(value)
+
+            return wrapper
+
+        future = self.storage.executor.pool.submit(func, *args)
+        self.task = BackgroundTask(
+            self.master, future, finish(on_done), finish(on_error or self.show_error)
+        )
+        self.show_busy(cancellable)
+
+    def cancel_task(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.hide_busy()
+
+    def show_busy(self, cancellable: bool = True) -> None:
+        self.login_window.config(cursor="watch")
+        self.busy = Frame(self.login_window)
+        self.busy.grid(row=99, sticky=W, pady=5, padx=5)
+        Label(self.busy, text="Bitte warten ...", font=("Calibri", 12)).grid(
+            row=0, column=0
+        )
+        Button(
+            self.busy,
+            text="Abbrechen",
+            command=self.cancel_task,
+            font=("Calibri", 12),
+            state=NORMAL if cancellable else DISABLED,
+        ).grid(row=0, column=1, padx=5)
+
+    def hide_busy(self) -> None:
+        # the window may have been closed in the meantime
+        if self.busy is not None and self.busy.winfo_exists():
+            self.busy.destroy()
+            self.login_window.config(cursor="")
+        self.busy = None
+
+    def show_error(self, exc: Exception) -> None:
+        self.login_window.destroy()
+        self.login_window = Toplevel(self.master)
+        self.login_window.title("Fehler")
+
+        Label(self.login_window, text=str(exc), font=("Calibri", 12)).grid(
+            row=0, sticky=N, pady=10
+        )
+        Button(
+            self.login_window,
+            text="Zurück",
+            width=15,
+            font=("Calibri", 12),
+            command=self.backloginwindow,
+        ).grid(row=1, sticky=W, pady=5, padx=5)
+
+    def buttonLogin(self) -> None:
+        # checking the password takes bcrypt a moment, on purpose
+        self.run_in_background(
+            Kunde.objects.login_user,
+            self.tmpUsernameL.get(),
+            self.tmpPasswortL.get(),
+            on_done=self.finish_login,
+        )
+
+    def finish_login(self, user: Optional[Kunde]) -> None:
         if not user:
             self.login_window.destroy()
             self.login_window = Toplevel(self.master)
@@ -241,6 +390,9 @@ class GUI(UI):
                 font=("Calibri", 12),
                 command=self.backloginwindow,
             ).grid(row=2, sticky=W, pady=5, padx=5)
+            return
+
+        self.user = user
         self.user_actions()
 
     def createUser(self):
@@ -317,7 +469,7 @@ class GUI(UI):
             row=9, sticky=W, pady=5, padx=5
         )
 
-    def buttonCreate(self) -> Kunde:
+    def buttonCreate(self) -> None:
         kundendaten = {}  # noqa dict literal
         kundendaten["name"] = self.tmpNamen.get()
         kundendaten["strasse"] = self.tmpAnschrift.get()
@@ -328,29 +480,49 @@ class GUI(UI):
         kundendaten["geb_date"] = date(day=d, month=m, year=y)
 
         kundendaten["username"] = self.tmpUsername.get()
-        kundendaten["password"] = Kunde.objects.hash_password(self.tmpPasswort.get())
 
-        try:
-            kunde = Kunde(**kundendaten)
-            kunde.objects.save()
-            return kunde
+        # The password is hashed first and the customer saved afterwards,
+        # so cancelling while bcrypt is busy does not create the customer.
+        # Once saving has started the customer is created anyway,
+        # so that can not be cancelled anymore.
+        def save(password: str) -> None:
+            self.run_in_background(
+                self.save_kunde,
+                {**kundendaten, "password": password},
+                on_done=lambda _: self.backloginwindow(),
+                on_error=self.create_failed,
+                cancellable=False,
+            )
+
+        self.run_in_background(
+            Kunde.objects.hash_password, self.tmpPasswort.get(), on_done=save
+        )
 
-        except ObjectAlreadyExists:
-            self.login_window.destroy()
-            self.login_window = Toplevel(self.master)
-            self.login_window.title("Fehler")
-            Label(
-                self.login_window, text="Nutzer existiert bereits", font=("Calibri", 12)
-            ).grid(row=0, sticky=N, pady=10)
-            Button(
-                self.login_window,
-                text="Zurück",
-                width=15,
-                font=("Calibri", 12),
-                command=self.backloginwindow,
-            ).grid(row=1, sticky=W, pady=5, padx=5)
+    # noinspection PyMethodMayBeStatic
+    def save_kunde(self, kundendaten: dict) -> Kunde:
+        kunde = Kunde(**kundendaten)
+        kunde.objects.save()
+        return kunde
+
+    def create_failed(self, exc: Exception) -> None:
+        if not isinstance(exc, ObjectAlreadyExists):
+            # e.g. the validators of the model
+            self.show_error(exc)
+            return
 
-        self.backloginwindow()
+        self.login_window.destroy()
+        self.login_window = Toplevel(self.master)
+        self.login_window.title("Fehler")
+        Label(
+            self.login_window, text="Nutzer existiert bereits", font=("Calibri", 12)
+        ).grid(row=0, sticky=N, pady=10)
+        Button(
+            self.login_window,
+            text="Zurück",
+            width=15,
+            font=("Calibri", 12),
+            command=self.backloginwindow,
+        ).grid(row=1, sticky=W, pady=5, padx=5)
 
     def deleteUser(self):
         self.login_window.destroy()
@@ -372,11 +544,80 @@ class GUI(UI):
         ).grid(row=1, sticky=W, pady=5, padx=5)
 
     def backloginwindow(self):
+        self.cancel_task()
         self.login_window.destroy()
         self.login_window = Toplevel(self.master)
         self.login_window.title("Login")
         self.create_login_window()
 
+    def show_konten(self) -> None:
+        self.cancel_task()
+        self.login_window.destroy()
+        self.login_window = Toplevel(self.master)
+        self.login_window.title("Konten")
+
+        # Labels
+        Label(self.login_window, text="Ihre Konten", font=("Calibri", 12)).grid(
+            row=0, sticky=N, pady=10
+        )
+
+        # List
+        self.konten_list = Listbox(self.login_window, width=40, font=("Calibri", 12))
+        self.konten_list.grid(row=1, sticky=N, padx=5)
+        self.konten_lines = []
+
+        # Buttons
+        Button(
+            self.login_window,
+            text="Aktualisieren",
+            width=15,
+            font=("Calibri", 12),
+            command=self.load_konten,
+        ).grid(row=2, sticky=W, pady=5, padx=5)
+        Button(
+            self.login_window,
+            text="Zurück",
+            width=15,
+            font=("Calibri", 12),
+            command=self.user_actions,
+        ).grid(row=3, sticky=W, pady=5, padx=5)
+
+        self.load_konten()
+
+    def load_konten(self) -> None:
+        # only the shown columns are read, no Konto objects are created
+        self.run_in_background(
+            lambda pk: Konto.objects.values_list(
+                "kontonummer", "kontostand", besitzer=pk
+            ),
+            self.user.pk,
+            on_done=self.refresh_konten,
+        )
+
+    def refresh_konten(self, rows: Sequence[Tuple[str, int]]) -> None:
+        """
+        Bring the list of accounts up to date.
+        Only the lines that have changed are replaced,
+        instead of filling the whole list again.
+        """
+        if self.konten_list is None or not self.konten_list.winfo_exists():
+            return
+
+        lines = [
+            f"{kontonummer}: {self._format_balance(kontostand)}"
+            for kontonummer, kontostand in sorted(rows)
+        ]
+        matcher = SequenceMatcher(None, self.konten_lines, lines, autojunk=False)
+        # from the back, so the positions of the earlier changes stay valid
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if i2 > i1:
+                self.konten_list.delete(i1, i2 - 1)
+            if j2 > j1:
+                self.konten_list.insert(i1, *lines[j1:j2])
+        self.konten_lines = lines
+
     def konto_create(self) -> None:
         konto = Konto(besitzer=self.user.pk)
         konto.objects.save()
@@ -384,6 +625,7 @@ class GUI(UI):
 
 
     def user_actions(self):
+        self.cancel_task()
         self.login_window.destroy()
         self.login_window = Toplevel(self.master)
         self.login_window.title("Login")
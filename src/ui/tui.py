@@ -1,7 +1,7 @@
 import atexit
 from datetime import date
 from getpass import getpass
-from typing import Optional, Callable, ClassVar, List, Tuple, Any
+from typing import Optional, Callable, ClassVar, List, Tuple, Any, Union, Sequence
 
 import colorama
 from colorama import Fore
@@ -26,7 +26,7 @@ class TUI(UI):
             # Let the user select their storage type
             while True:
                 self.prompt("Bitte wählen sie ihren Speichertypen.")
-                print("JSON oder SQL?")
+                print("JSON, BIN oder SQL?")
                 storage_type = input()
 
                 try:
@@ -83,7 +83,7 @@ class TUI(UI):
 
             # If the user does not have a bank account yet
             # we create a default one automatically
-            if not self.user.konten:
+            if not Konto.objects.filter(besitzer=self.user.pk).exists():
                 print("Es scheint so als haben sie bisher noch kein Konto bei uns.")
                 print("Wir werden ihnen automatisch eines eröffnen.\n")
                 self.konto_create()
@@ -286,15 +286,24 @@ class TUI(UI):
         self.konto = action()
         return
 
-    def show_konten(self, konten: List[Konto]) -> None:
+    def show_konten(self, konten: Sequence[Union[Konto, dict]]) -> None:
+        """
+        List the provided accounts, either as Konto objects
+        or as rows holding their 'kontonummer' and 'kontostand'.
+        """
         if not konten:
             print("Es sind keine Konten verfügbar.")
             return
 
         for i, konto in enumerate(konten):
+            if not isinstance(konto, dict):
+                konto = {
+                    "kontonummer": konto.kontonummer,
+                    "kontostand": konto.kontostand,
+                }
             index = self.format_as_selectable(f"{i + 1}.")
-            print(f"\n{index} {konto.kontonummer}:")
-            print(f"Kontostand: {self._format_balance(konto.kontostand)}\n")
+            print(f"\n{index} {konto['kontonummer']}:")
+            print(f"Kontostand: {self._format_balance(konto['kontostand'])}\n")
 
     def konto_delete(self) -> None:
         konten = self.user.konten
@@ -331,7 +340,7 @@ class TUI(UI):
         return konto
 
     # noinspection PyMethodMayBeStatic
-    def choose_bank_account(self, konten: List[Konto]) -> Optional[Konto]:
+    def choose_bank_account(self, konten: Sequence[Konto]) -> Optional[Konto]:
         if not konten:
             return None
 
@@ -431,7 +440,13 @@ class TUI(UI):
         )
         print("Eigenen Konten, welche als Ziel gelten können:")
         self.show_konten(
-            [k for k in self.user.konten if not k.kontonummer == self.konto.kontonummer]
+            [
+                k
+                for k in Konto.objects.values(
+                    "kontonummer", "kontostand", besitzer=self.user.pk
+                )
+                if not k["kontonummer"] == self.konto.kontonummer
+            ]
         )
 
         while True:
@@ -5,9 +5,9 @@ import pytest
 from src.storage import Storage
 
 
-@pytest.fixture(scope="session", params=["sql", "json"])
+@pytest.fixture(scope="session", params=["sql", "json", "bin"])
 def storage(request) -> Storage:
-    storage_type: Literal['sql', 'json'] = request.param
+    storage_type: Literal["sql", "json", "bin"] = request.param
 
     # We can conveniently sneak in a test case right here
     with pytest.raises(RuntimeError):
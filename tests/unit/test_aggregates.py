@@ -0,0 +1,22 @@
+from array import array
+
+import pytest
+
+from src.storage.aggregates import Aggregate, Avg, Max, Sum
+
+
+def test_aggregate_is_abstract():
+    with pytest.raises(TypeError):
+        Aggregate("kontostand")
+
+
+def test_sum_beyond_64_bits():
+    # the sum does not fit into 64 bits, although every value does
+    values = array("q", [2 ** 62, 2 ** 62, 2 ** 62])
+    assert Sum("kontostand").reduce(values) == 3 * 2 ** 62
+    assert Avg("kontostand").reduce(values) == 2 ** 62
+
+    # values that do not even fit into an array are reduced in plain Python
+    values = [2 ** 64, -(2 ** 70), 1]
+    assert Sum("kontostand").reduce(values) == 2 ** 64 - 2 ** 70 + 1
+    assert Max("kontostand").reduce(values) == 2 ** 64
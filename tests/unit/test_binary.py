@@ -0,0 +1,103 @@
+import datetime
+
+import pytest
+import sqlalchemy as sqla
+
+from src.storage.binary import BinaryTable, BlockCodec
+
+COLUMNS = [
+    sqla.Column("pk", sqla.String, primary_key=True),
+    sqla.Column("stand", sqla.Integer),
+    sqla.Column("kurs", sqla.Float),
+    sqla.Column("aktiv", sqla.Boolean),
+    sqla.Column("geb_date", sqla.Date),
+    sqla.Column("erstellt", sqla.DateTime),
+]
+
+
+def test_codec_round_trip():
+    codec = BlockCodec(COLUMNS)
+    rows = [
+        {
+            "pk": "a",
+            "stand": -(2 ** 40),
+            "kurs": 1.5,
+            "aktiv": True,
+            "geb_date": datetime.date(1990, 1, 2),
+            "erstellt": datetime.datetime(2020, 5, 6, 7, 8, 9),
+        },
+        # NULL values are left out, just like unset attributes
+        {"pk": "b", "stand": 0, "aktiv": False},
+        # Strings containing NUL characters need their lengths stored
+        {"pk": "c\x00d", "geb_date": "2000-12-31"},
+    ]
+
+    data = codec.encode(rows)
+    decoded, end = codec.decode(data)
+    assert end == len(data)
+    assert decoded[:2] == rows[:2]
+    assert decoded[2] == {"pk": "c\x00d", "geb_date": datetime.date(2000, 12, 31)}
+
+
+def test_binary_table(tmp_path):
+    path = tmp_path / "konto.bin"
+    BinaryTable.initialize(path)
+
+    table = BinaryTable(
+        path, "pk", ["pk"], columns=COLUMNS, background_compaction=False
+    )
+    table.block_size = 2
+    table.load()
+    for i in range(5):
+        table.upsert({"pk": str(i), "stand": i})
+        table.flush()
+    table.remove("0")
+    table.flush()
+
+    def reload():
+        return BinaryTable(path, "pk", columns=COLUMNS).load()
+
+    assert list(reload()) == ["1", "2", "3", "4"]
+
+    # A write that has been cut off halfway through is ignored,
+    # and cut off once the next change is written
+    with open(table.log_path, "ab") as fout:
+        fout.write(b"U\x10\x00")
+    assert list(reload()) == ["1", "2", "3", "4"]
+    table.remove("1")
+    table.flush()
+    assert list(reload()) == ["2", "3", "4"]
+
+    table.compact()
+    assert reload() == {str(i): {"pk": str(i), "stand": i} for i in range(2, 5)}
+    chunks = list(BinaryTable(path, "pk", columns=COLUMNS).iter_chunks(2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+
+
+def test_binary_table_overflow(tmp_path):
+    path = tmp_path / "konto.bin"
+    BinaryTable.initialize(path)
+    table = BinaryTable(path, "pk", columns=COLUMNS, background_compaction=False)
+    table.load()
+
+    # a row that can not be encoded never becomes visible or held back
+    with pytest.raises(OverflowError):
+        table.upsert({"pk": "a", "stand": 2 ** 64})
+    with pytest.raises(OverflowError):
+        table.upsert_many([{"pk": "b", "stand": 1}, {"pk": "c", "stand": 2 ** 64}])
+    assert table.get("a") is None and table.get("b") is None
+    assert not table.pending
+
+    # one that still makes it into the log fails just that flush
+    table.upsert({"pk": "a", "stand": 1})
+    table.pending["a"]["row"]["stand"] = 2 ** 64
+    with pytest.raises(OverflowError):
+        table.flush()
+    assert not table.pending
+    assert table.get("a") is None
+
+    table.upsert({"pk": "b", "stand": 2})
+    table.flush()
+    assert BinaryTable(path, "pk", columns=COLUMNS).load() == {
+        "b": {"pk": "b", "stand": 2}
+    }
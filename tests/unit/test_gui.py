@@ -0,0 +1,118 @@
+from concurrent.futures import Future
+
+from src.ui.gui import GUI, BackgroundTask
+
+
+class FakeRoot:
+    """ Collects the callbacks scheduled with after(), instead of a main loop """
+
+    def __init__(self) -> None:
+        self.scheduled = []
+
+    def after(self, ms, func) -> None:
+        self.scheduled.append(func)
+
+    def run_pending(self) -> None:
+        scheduled, self.scheduled = self.scheduled, []
+        for func in scheduled:
+            func()
+
+
+class FakeListbox:
+    def __init__(self) -> None:
+        self.items = []
+        self.calls = []
+
+    def winfo_exists(self) -> bool:
+        return True
+
+    def delete(self, first, last) -> None:
+        self.calls.append(("delete", first, last))
+        del self.items[first : last + 1]
+
+    def insert(self, index, *elements) -> None:
+        self.calls.append(("insert", index) + elements)
+        self.items[index:index] = elements
+
+
+def _task(root, future):
+    results, errors = [], []
+    task = BackgroundTask(root, future, results.append, errors.append)
+    return task, results, errors
+
+
+def test_background_task():
+    root = FakeRoot()
+    future = Future()
+    task, results, errors = _task(root, future)
+
+    # polled again for as long as the call is running
+    root.run_pending()
+    root.run_pending()
+    assert len(root.scheduled) == 1 and not results
+
+    future.set_result(42)
+    root.run_pending()
+    assert results == [42] and not errors
+    assert not root.scheduled
+
+    future = Future()
+    task, results, errors = _task(root, future)
+    future.set_exception(ValueError("kaputt"))
+    root.run_pending()
+    assert not results
+    assert [type(exc) for exc in errors] == [ValueError]
+
+
+def test_background_task_cancel():
+    root = FakeRoot()
+
+    # a call that has not started yet is stopped
+    future = Future()
+    task, results, errors = _task(root, future)
+    task.cancel()
+    assert future.cancelled()
+    root.run_pending()
+    assert not results and not errors and not root.scheduled
+
+    # a running one finishes, but its result is dropped
+    future = Future()
+    future.set_running_or_notify_cancel()
+    task, results, errors = _task(root, future)
+    task.cancel()
+    future.set_result(42)
+    root.run_pending()
+    assert not results and not errors and not root.scheduled
+
+
+def _refresh(gui, rows):
+    gui.konten_list.calls.clear()
+    GUI.refresh_konten(gui, rows)
+    assert gui.konten_list.items == gui.konten_lines
+    return gui.konten_list.calls
+
+
+def _line(kontonummer, kontostand):
+    return f"{kontonummer}: {GUI._format_balance(kontostand)}"
+
+
+def test_refresh_konten():
+    gui = GUI.__new__(GUI)
+    gui.konten_list = FakeListbox()
+    gui.konten_lines = []
+
+    assert _refresh(gui, [("B", 200), ("A", 100)]) == [
+        ("insert", 0, _line("A", 100), _line("B", 200))
+    ]
+    # inserted in the middle, the other lines are left alone
+    assert _refresh(gui, [("A", 100), ("AB", 0), ("B", 200)]) == [
+        ("insert", 1, _line("AB", 0))
+    ]
+    # a changed balance only replaces its own line
+    assert _refresh(gui, [("A", 100), ("AB", 5000), ("B", 200)]) == [
+        ("delete", 1, 1),
+        ("insert", 1, _line("AB", 5000)),
+    ]
+    assert _refresh(gui, [("AB", 5000)]) == [("delete", 2, 2), ("delete", 0, 0)]
+    assert _refresh(gui, [("AB", 5000)]) == []
+    assert gui.konten_lines == [_line("AB", 5000)]
@@ -0,0 +1,51 @@
+import datetime
+
+import pytest
+
+from src.models import Kunde
+from src.storage.hydration import Hydrator, RowProxy
+
+ROW = {
+    "pk": "abc",
+    # too short to pass the validator, but rows from the storage are trusted
+    "username": "ben",
+    "name": "Ben Koch",
+    "geb_date": "1999-02-13",
+}
+
+
+def test_hydration_modes():
+    with pytest.raises(AssertionError):
+        Hydrator.for_model(Kunde, "validate")(ROW)
+
+    kunde = Hydrator.for_model(Kunde, "fast")(ROW)
+    assert type(kunde) is Kunde
+    assert kunde.username == "ben"
+    assert kunde.geb_date == datetime.date(1999, 2, 13)
+    assert kunde.strasse is None
+
+    # Changes made afterwards are still validated
+    with pytest.raises(AssertionError):
+        kunde.username = "ben"
+
+    # The hydrator is only set up once per model
+    assert Hydrator.for_model(Kunde, "fast") is Hydrator.for_model(Kunde, "fast")
+    with pytest.raises(ValueError):
+        Hydrator(Kunde, "eager")
+
+
+def test_row_proxy():
+    proxy = Hydrator.for_model(Kunde, "lazy")(ROW)
+    assert isinstance(proxy, RowProxy)
+    assert isinstance(proxy, Kunde)
+
+    # Columns are read straight from the row
+    assert proxy.geb_date == datetime.date(1999, 2, 13)
+    assert proxy.stadt is None
+    assert proxy._instance is None
+
+    # Setting an attribute creates the instance
+    proxy.stadt = "Berlin"
+    assert type(proxy._instance) is Kunde
+    assert proxy.stadt == "Berlin"
+    assert ROW.get("stadt") is None
@@ -0,0 +1,50 @@
+import gc
+import threading
+
+from src.models import Kunde, Konto
+from src.storage.identity import IdentityMap
+
+
+def test_identity_map():
+    identity_map = IdentityMap()
+    kunde = Kunde(username="ben.koch")
+
+    identity_map.add(Kunde, "abc", kunde)
+    assert identity_map.get(Kunde, "abc") is kunde
+    # keys are scoped to their model
+    assert identity_map.get(Konto, "abc") is None
+
+    identity_map.discard(Kunde, "abc")
+    assert identity_map.get(Kunde, "abc") is None
+
+    # Instances nobody uses anymore are dropped
+    identity_map.add(Kunde, "abc", kunde)
+    del kunde
+    gc.collect()
+    assert identity_map.get(Kunde, "abc") is None
+
+
+def test_identity_map_scope():
+    identity_map = IdentityMap()
+    outer = Kunde(username="ben.koch")
+    identity_map.add(Kunde, "abc", outer)
+
+    with identity_map.scope() as scope:
+        # a scope starts out empty and keeps whatever is loaded within it
+        assert identity_map.get(Kunde, "abc") is None
+        identity_map.add(Kunde, "def", Kunde(username="gerhard.orgel"))
+        gc.collect()
+        assert identity_map.get(Kunde, "def").username == "gerhard.orgel"
+        assert len(scope) == 1
+
+        # other threads still use the shared map
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append(identity_map.get(Kunde, "abc"))
+        )
+        thread.start()
+        thread.join()
+        assert seen == [outer]
+
+    assert identity_map.get(Kunde, "abc") is outer
+    assert identity_map.get(Kunde, "def") is None
@@ -0,0 +1,161 @@
+import threading
+from ast import literal_eval
+
+import pytest
+from drizm_commons.utils.pathing import Path
+
+from src import models  # noqa registers the tables
+from src.storage.json import JsonAdapter
+
+
+def _adapter(tmp_path, **options) -> JsonAdapter:
+    adapter = JsonAdapter(**options)
+    adapter.path = Path(tmp_path) / ".json_db"
+    adapter.table_map = adapter.path / "tbl_map.ini"
+    adapter.create()
+    return adapter
+
+
+def test_write_behind(tmp_path):
+    adapter = _adapter(tmp_path, write_behind=True, flush_interval=3600, flush_size=3)
+    table = adapter.table("konto")
+    table.load()
+
+    table.upsert({"kontonummer": "A", "kontostand": 0})
+    adapter.commit(table)
+    table.upsert({"kontonummer": "A", "kontostand": 5})
+    adapter.commit(table)
+
+    # Nothing has been written yet, but we can read our own changes
+    assert not table.log_path.exists()
+    assert table.load()["A"]["kontostand"] == 5
+
+    # Both saves of the same row are written as a single change
+    adapter.flush()
+    with open(table.log_path) as fin:
+        assert len(fin.readlines()) == 1
+
+    # Reaching the size threshold flushes automatically
+    for konto in "BCD":
+        table.upsert({"kontonummer": konto, "kontostand": 0})
+        adapter.commit(table)
+    with open(table.log_path) as fin:
+        assert len(fin.readlines()) == 4
+
+    adapter.destroy()
+
+
+def test_transaction_isolation(tmp_path):
+    adapter = _adapter(tmp_path, shards=2)
+    table = adapter.table("konto")
+    table.upsert({"kontonummer": "A", "kontostand": 100})
+    adapter.commit(table)
+
+    staged = threading.Event()
+    seen = []
+
+    def save_another():
+        staged.wait()
+        other = adapter.table("konto")
+        seen.append(other.get("A")["kontostand"])
+        other.upsert({"kontonummer": "B", "kontostand": 5})
+        adapter.commit(other)
+
+    thread = threading.Thread(target=save_another)
+    thread.start()
+    with pytest.raises(RuntimeError):
+        with adapter.transaction():
+            table = adapter.table("konto")
+            table.upsert({"kontonummer": "A", "kontostand": 0})
+            adapter.commit(table)
+            staged.set()
+
+            # the other thread has to wait until the transaction is done
+            thread.join(0.2)
+            assert thread.is_alive()
+            raise RuntimeError
+    thread.join()
+
+    # it has neither seen nor written the change that has been rolled back
+    assert seen == [100]
+    rows = adapter._open_table("konto", 2).load()  # noqa protected member
+    assert rows["A"]["kontostand"] == 100
+    assert rows["B"]["kontostand"] == 5
+    adapter.destroy()
+
+
+def test_sharding(tmp_path, monkeypatch):
+    adapter = _adapter(tmp_path, shards=3)
+    table = adapter.table("kunde")
+
+    for i in range(10):
+        table.upsert({"pk": str(i), "username": f"user{i}"})
+    adapter.commit(table)
+
+    # Every row only ends up in the files of its own shard
+    assert len(table.shards) == 3
+    for number, shard in enumerate(table.shards):
+        assert shard.path.name == f"kunde.{number}.json"
+        assert all(table.shard(pk) is shard for pk in shard.load())
+    assert sorted(table.load()) == [str(i) for i in range(10)]
+
+    # Unique values are checked across all shards
+    assert table.find_conflict({"pk": "10", "username": "user3"}) == "username"
+
+    table.remove("4")
+    adapter.commit(table)
+    for shards in (2, 1):
+        adapter.reshard("kunde", shards)
+        rows = adapter.table("kunde").load()
+        assert sorted(rows) == [str(i) for i in range(10) if i != 4]
+
+    # The new number of shards is kept in the table mapping
+    assert not (adapter.path / "kunde.0.json").exists()
+    assert not (adapter.path / "tbl_map.ini.tmp").exists()
+    adapter.tables.clear()
+    adapter._load()
+    assert len(adapter.table("kunde").load()) == 9
+
+    # Dying before the table map is written leaves the old table in place
+    def crash():
+        raise OSError
+
+    monkeypatch.setattr(adapter, "_write_table_map", crash)
+    with pytest.raises(OSError):
+        adapter.reshard("kunde", 4)
+    monkeypatch.undo()
+    adapter.tables.clear()
+    adapter._load()
+    assert (adapter.path / "kunde.json").exists()
+    assert len(adapter.table("kunde").load()) == 9
+
+    # the files left over are simply replaced by the next attempt
+    adapter.reshard("kunde", 4)
+    assert len(adapter.table("kunde").load()) == 9
+
+    adapter.destroy()
+
+
+def test_migrate(tmp_path):
+    adapter = _adapter(tmp_path)
+    assert adapter.create() == []
+
+    # a table map written before the foreign key was indexed
+    adapter.schema["konto"]["ix"] = str(["kontostand"])
+    adapter.schema["konto"].pop("fk")
+    adapter._write_table_map()  # noqa protected member
+    adapter.table("konto")
+
+    assert adapter.migrate() == [
+        "Updated 'fk' of table 'konto' to {'besitzer': 'kunde.pk'}",
+        "Updated 'ix' of table 'konto' to ['kontostand', 'besitzer']",
+    ]
+    # the cached table is opened again with the new indexes
+    assert adapter.table("konto").foreign.keys() == {"besitzer"}
+
+    reopened = JsonAdapter()
+    reopened.path, reopened.table_map = adapter.path, adapter.table_map
+    assert reopened.create() == []
+    assert literal_eval(reopened.schema["konto"]["ix"]) == ["kontostand", "besitzer"]
+
+    adapter.destroy()
@@ -0,0 +1,48 @@
+import threading
+import time
+
+import pytest
+
+from src.storage.locking import FileLock
+
+pytest.importorskip("fcntl")
+
+
+def test_file_lock(tmp_path):
+    # flock() treats every opened file as a holder of its own,
+    # so two locks on the same path behave like two processes
+    path = tmp_path / "konto.lock"
+    reader, writer = FileLock(path), FileLock(path)
+
+    # Readers do not have to wait for each other
+    with reader.shared(), writer.shared():
+        pass
+    assert reader.stats.contended == writer.stats.contended == 0
+
+    # Locks are nested within a process
+    with writer.exclusive():
+        with writer.shared():
+            pass
+    assert writer.stats.acquired == 2
+
+    held = threading.Event()
+
+    def write():
+        with writer.exclusive():
+            held.set()
+            time.sleep(0.2)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    held.wait()
+    with reader.shared():
+        pass
+    thread.join()
+
+    # The reader had to wait for the writer and the time was recorded
+    assert reader.stats.contended == 1
+    assert reader.stats.wait_time >= 0.1
+    assert reader.stats.max_wait == reader.stats.wait_time
+
+    reader.close()
+    writer.close()
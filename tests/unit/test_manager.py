@@ -1,8 +1,37 @@
+import asyncio
 import pytest
 import datetime
 from src.storage.managers.base import BaseManagerInterface
 from src.models import Kunde, Konto
-from src.storage.exc import ObjectNotFound
+from src.storage.exc import ObjectNotFound, ObjectAlreadyExists
+from src.storage.aggregates import Avg, Count, Max, Min, Sum
+from src.storage import Storage
+from src.storage.query import QuerySet
+from src.ui import UI
+from sqlalchemy.orm.exc import StaleDataError
+
+
+class _UI(UI):
+    def mainloop(self):
+        pass
+
+
+def _change_elsewhere(storage, konto, **values):
+    """ Change a row behind the back of the managers, like another process """
+    if storage.manager.db_type == "sql":
+        with storage.db.engine.begin() as connection:
+            connection.execute(
+                Konto.__table__.update()
+                .where(Konto.__table__.c.kontonummer == konto.kontonummer)
+                .values(**values)
+            )
+        return
+
+    shards = int(storage.db.schema["konto"].get("shards", "1"))
+    table = storage.db._open_table("konto", shards)  # noqa protected member
+    table.upsert({**table.get(konto.kontonummer), **values})
+    table.flush()
+    table.close()
 
 
 def test_manager(storage):
@@ -19,10 +48,13 @@ def test_manager(storage):
     # assert isinstance(KundenManager, BaseManagerInterface)
 
     # This is a test-run with an empty database
-    assert Kunde.objects.all() == []
+    assert list(Kunde.objects.all()) == []
+    assert Kunde.objects.all().count() == 0
+    assert not Kunde.objects.all().exists()
+    assert Kunde.objects.all().first() is None
     with pytest.raises(ObjectNotFound):
         Kunde.objects.get(1)
-    assert Kunde.objects.filter(name="Ben Koch") == []
+    assert list(Kunde.objects.filter(name="Ben Koch")) == []
 
     # Create some test data
     kunde_test_pw = "security420"
@@ -36,20 +68,96 @@ def test_manager(storage):
         geb_date=datetime.date(1999, 2, 13)
     )
     kunde.objects.save()
+    # Saving an existing object again updates it
+    kunde.objects.save()
+
+    with pytest.raises(ObjectAlreadyExists):
+        Kunde(
+            username="ben.koch",
+            password=Kunde.objects.hash_password("security421"),
+            name="Ben Koch",
+            strasse="Some Street 13",
+            stadt="Berlin",
+            plz="13689",
+            geb_date=datetime.date(1999, 2, 13)
+        ).objects.save()
+
     konto = Konto(
         besitzer=kunde.pk
     )
     konto.objects.save()
 
     # Test again
+    assert Kunde.objects.get(kunde.pk).pk == kunde.pk
+    assert Konto.objects.get(konto.kontonummer).besitzer == kunde.pk
+
+    # Managers and storages are only created once
+    assert Kunde.objects is Kunde.objects
+    assert kunde.objects is kunde.objects
+    assert kunde.objects is not Kunde.objects
+    assert Storage(storage.manager.db_type) is Storage() is storage
+    other_type = "json" if storage.manager.db_type == "sql" else "sql"
+    assert Storage(other_type) is not storage
+    assert Storage() is storage
+
+    # The same row is always represented by the same instance
+    assert Kunde.objects.get(kunde.pk) is kunde
+    assert Konto.objects.get(konto.kontonummer) is Konto.objects.get(konto.kontonummer)
+    with storage.session():
+        loaded = Konto.objects.get(konto.kontonummer)
+        assert loaded is not konto
+        assert Konto.objects.get(konto.kontonummer) is loaded
+
+    # Changes made by someone else are picked up by get()
+    held = Konto.objects.get(konto.kontonummer)
+    _change_elsewhere(storage, konto, kontostand=123)
+    assert Konto.objects.get(konto.kontonummer) is held
+    assert held.kontostand == 123
+    _change_elsewhere(storage, konto, kontostand=0)
+    assert Konto.objects.get(konto.kontonummer).kontostand == 0
+
+    # but changes that have not been saved yet are kept
+    held.kontostand = 50
+    _change_elsewhere(storage, konto, kontostand=7, waehrung="USD")
+    assert Konto.objects.get(konto.kontonummer) is held
+    assert (held.kontostand, held.waehrung) == (50, "USD")
+    held.kontostand = 0
+    held.waehrung = "EUR"
+    held.objects.save()
+    _change_elsewhere(storage, konto, kontostand=8)
+    assert Konto.objects.get(konto.kontonummer).kontostand == 8
+    _change_elsewhere(storage, konto, kontostand=0)
+    assert Konto.objects.get(konto.kontonummer).kontostand == 0
+
+    # Deleting within a scope also drops the row from the shared map
+    held = Konto.objects.get(konto.kontonummer)
+    with storage.session():
+        Konto.objects.get(konto.kontonummer).objects.delete()
+    with pytest.raises(ObjectNotFound):
+        Konto.objects.get(konto.kontonummer)
+    konto = Konto(kontonummer=held.kontonummer, besitzer=kunde.pk)
+    konto.objects.save()
+
+    # Objects of a query are the ones get() returns as well
+    assert Konto.objects.filter(besitzer=kunde.pk)[0] is Konto.objects.get(
+        konto.kontonummer
+    )
+    assert list(Konto.objects.iterator(besitzer=kunde.pk)) == [
+        Konto.objects.get(konto.kontonummer)
+    ]
+
     konten = kunde.konten
-    assert type(konten) == list
+    assert isinstance(konten, QuerySet)
     assert len(konten) == 1
 
-    assert type(Kunde.objects.all()) == list
+    assert isinstance(Kunde.objects.all(), QuerySet)
     assert len(Kunde.objects.all()) == 1
     assert Kunde.objects.all()[0].pk == kunde.objects.all()[0].pk
 
+    assert [k.pk for k in Kunde.objects.iterator()] == [kunde.pk]
+    assert len(list(Konto.objects.iterator(chunk_size=1, besitzer=kunde.pk))) == 1
+    assert not list(Konto.objects.iterator(besitzer="nobody"))
+
     assert Kunde.objects.filter(name="Ben Koch")
     assert not Kunde.objects.filter(name="Gerhard Orgel")
 
@@ -62,3 +170,263 @@ def test_manager(storage):
     assert not Kunde.objects.login_user(
         username="ben.koch", password="wrongOne"
     )
+
+    # Bulk operations write many objects at once and report the failed ones
+    konten = [Konto(besitzer=kunde.pk, kontostand=i) for i in range(20)]
+    result = Konto.objects.bulk_save(konten)
+    assert result
+    assert result.succeeded == konten
+    assert len(Konto.objects.filter(besitzer=kunde.pk)) == 21
+
+    def new_kunde(username):
+        return Kunde(
+            username=username,
+            password="security420",
+            name="Gerhard Orgel",
+            strasse="Some Street 14",
+            stadt="Berlin",
+            plz="13689",
+            geb_date=datetime.date(1990, 1, 1)
+        )
+
+    twins = [new_kunde("gerhard.orgel"), new_kunde("gerhard.orgel"), new_kunde("ben.koch")]
+    result = Kunde.objects.bulk_save(twins)
+    assert result.succeeded == twins[:1]
+    assert [obj for obj, _ in result.failed] == twins[1:]
+    assert all(isinstance(exc, ObjectAlreadyExists) for _, exc in result.failed)
+    assert len(Kunde.objects.all()) == 2
+
+    result = Konto.objects.bulk_delete(
+        konten[:10] + [k.kontonummer for k in konten[10:]] + ["missing"]
+    )
+    assert len(result.succeeded) == 20
+    assert [obj for obj, _ in result.failed] == ["missing"]
+    assert isinstance(result.failed[0][1], ObjectNotFound)
+    assert len(Konto.objects.all()) == 1
+
+    # the accounts of a customer are deleted along with it
+    Konto(besitzer=twins[0].pk).objects.save()
+    assert Kunde.objects.bulk_delete([twins[0]])
+    assert len(Kunde.objects.all()) == 1
+    assert not Konto.objects.filter(besitzer=twins[0].pk)
+
+    # Projections return plain values instead of objects
+    assert Kunde.objects.values("username", "geb_date") == [
+        {"username": "ben.koch", "geb_date": datetime.date(1999, 2, 13)}
+    ]
+    assert Konto.objects.values_list("kontonummer", "besitzer") == [
+        (konto.kontonummer, kunde.pk)
+    ]
+    assert Konto.objects.values_list("kontonummer", flat=True, besitzer=kunde.pk) == [
+        konto.kontonummer
+    ]
+    assert not Konto.objects.values_list("kontonummer", besitzer="nobody")
+    assert set(Kunde.objects.values()[0]) >= {"pk", "username", "password"}
+    with pytest.raises(TypeError):
+        Konto.objects.values_list("kontonummer", "besitzer", flat=True)
+    with pytest.raises(ValueError):
+        Konto.objects.values("iban")
+
+    # Comparisons and ranges, served from the sorted indexes in JSON
+    konten = [Konto(besitzer=kunde.pk, kontostand=i * 100) for i in range(1, 6)]
+    assert Konto.objects.bulk_save(konten)
+
+    def kontostaende(**kwargs):
+        return sorted(k.kontostand for k in Konto.objects.filter(**kwargs))
+
+    assert kontostaende(kontostand__gt=300) == [400, 500]
+    assert kontostaende(kontostand__gte=300, besitzer=kunde.pk) == [300, 400, 500]
+    assert kontostaende(kontostand__lt=200) == [0, 100]
+    assert kontostaende(kontostand__lte=100, kontostand__gt=0) == [100]
+    assert kontostaende(kontostand__range=(200, 300)) == [200, 300]
+    assert kontostaende(kontostand__in=[100, 500, 501]) == [100, 500]
+    assert kontostaende(kontonummer__in=[konten[0].kontonummer]) == [100]
+    assert kontostaende(kontonummer__startswith=konto.kontonummer[:12]) == [0]
+    assert Konto.objects.values_list(
+        "kontostand", flat=True, kontostand__gt=400
+    ) == [500]
+
+    assert len(Kunde.objects.filter(geb_date__lt=datetime.date(2000, 1, 1))) == 1
+    assert not Kunde.objects.filter(geb_date__lt="1960-01-01")
+    assert Kunde.objects.filter(username__startswith="ben.")
+    with pytest.raises(ValueError):
+        Konto.objects.filter(kontostand__between=(0, 1))
+
+    # Lazy querysets, counting, slicing and ordering
+    query = Konto.objects.filter(besitzer=kunde.pk)
+    assert query.count() == 6
+    assert query.filter(kontostand__gt=250).count() == 3
+    assert Konto.objects.filter(kontostand__gt=250).count() == 3
+    assert query.exists()
+    assert not query.filter(kontostand__gt=500).exists()
+    assert query[6:].count() == 0 and not query[6:].exists()
+
+    ordered = Konto.objects.all().order_by("-kontostand")
+    assert [k.kontostand for k in ordered] == [500, 400, 300, 200, 100, 0]
+    assert [k.kontostand for k in ordered[1:3]] == [400, 300]
+    assert [k.kontostand for k in ordered[1:4][1:]] == [300, 200]
+    assert ordered[2].kontostand == 300
+    assert Konto.objects.all()[1:3].count() == 2
+    assert ordered.first().kontostand == 500
+    assert query.order_by("kontostand").first().kontostand == 0
+    with pytest.raises(IndexError):
+        ordered[6]
+    with pytest.raises(TypeError):
+        query[1:3].filter(kontostand=0)
+    with pytest.raises(ValueError):
+        Konto.objects.all().order_by("iban")
+
+    # the result is cached once a queryset has been evaluated
+    assert len(ordered) == 6
+    assert ordered.count() == 6 and ordered[5].kontostand == 0
+
+    # The accounts of many customers are loaded with a single query
+    kunden = Kunde.objects.all().prefetch_related("konten")
+    assert [len(k.konten) for k in kunden] == [6]
+    assert isinstance(kunden[0].konten, QuerySet)
+    assert sorted(k.kontostand for k in kunden[0].konten) == [0, 100, 200, 300, 400, 500]
+    with pytest.raises(ValueError):
+        Kunde.objects.prefetch_related("username")
+
+    # Prefetched objects are dropped once an object of their model is written
+    extra = Konto(besitzer=kunden[0].pk)
+    extra.objects.save()
+    assert len(kunden[0].konten) == 7
+    extra.objects.delete()
+    assert len(kunden[0].konten) == 6
+
+    # Aggregates, grouped or over all matching accounts
+    totals = Konto.objects.aggregate(
+        Sum("kontostand"), Min("kontostand"), Max("kontostand"), Avg("kontostand")
+    )
+    assert totals == {
+        "kontostand__sum": 1500,
+        "kontostand__min": 0,
+        "kontostand__max": 500,
+        "kontostand__avg": 250,
+    }
+    assert Konto.objects.aggregate(
+        Sum("kontostand", alias="total"), Count(), group_by="besitzer"
+    ) == [{"besitzer": kunde.pk, "total": 1500, "count": 6}]
+    assert Konto.objects.aggregate(
+        Count("kontonummer"), group_by=("besitzer", "waehrung"), kontostand__gt=250
+    ) == [{"besitzer": kunde.pk, "waehrung": "EUR", "kontonummer__count": 3}]
+    assert query.filter(kontostand__gt=500).aggregate(Sum("kontostand"), Count()) == {
+        "kontostand__sum": None,
+        "count": 0,
+    }
+    empty = Konto.objects.aggregate(Sum("kontostand"), group_by="waehrung", kontostand=-1)
+    assert empty == []
+    assert Kunde.objects.aggregate(Max("geb_date"))["geb_date__max"] == (
+        datetime.date(1999, 2, 13)
+    )
+    with pytest.raises(ValueError):
+        Konto.objects.aggregate(Sum("iban"))
+    with pytest.raises(TypeError):
+        Konto.objects.aggregate(group_by="besitzer")
+
+    assert Konto.objects.bulk_delete(konten)
+    # deleted objects are dropped from the identity map
+    with pytest.raises(ObjectNotFound):
+        Konto.objects.get(konten[0].kontonummer)
+
+    # Transactions are written out together, or not at all
+    extra = Konto(besitzer=kunde.pk, kontostand=100)
+    with storage.transaction():
+        extra.objects.save()
+        assert Konto.objects.filter(besitzer=kunde.pk).count() == 2
+
+        with storage.transaction():
+            # nested transactions are part of the outer one
+            extra.kontostand = 200
+            extra.objects.save()
+    assert Konto.objects.values_list(
+        "kontostand", flat=True, kontonummer=extra.kontonummer
+    ) == [200]
+
+    with pytest.raises(ObjectAlreadyExists):
+        with storage.transaction():
+            extra.objects.delete()
+            new_kunde("ben.koch").objects.save()
+    assert Konto.objects.filter(besitzer=kunde.pk).count() == 2
+
+    # a conflict that has been handled does not end the transaction
+    with storage.transaction():
+        with pytest.raises(ObjectAlreadyExists):
+            new_kunde("ben.koch").objects.save()
+        result = Kunde.objects.bulk_save([new_kunde("ben.koch")])
+        assert not result.succeeded and len(result.failed) == 1
+        extra.kontostand = 300
+        extra.objects.save()
+    assert Konto.objects.get(extra.kontonummer).kontostand == 300
+
+    # a failed transaction brings the instances back in line with the storage
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            extra.kontostand = 500
+            extra.objects.save()
+            raise RuntimeError
+    assert extra.kontostand == 300
+    assert Konto.objects.get(extra.kontonummer) is extra
+
+    if storage.manager.db_type == "sql":
+        # the target of a transfer has been deleted by someone else
+        target = Konto(besitzer=kunde.pk)
+        target.objects.save()
+        with storage.db.engine.begin() as connection:
+            connection.execute(
+                Konto.__table__.delete().where(
+                    Konto.__table__.c.kontonummer == target.kontonummer
+                )
+            )
+        ui = _UI()
+        ui.konto = extra
+        with pytest.raises(StaleDataError):
+            ui.do_transfer(100, target)
+        assert ui.show_balance() == ui._format_balance(300)
+        assert target.kontostand == 100
+        with pytest.raises(ObjectNotFound):
+            Konto.objects.get(target.kontonummer)
+
+    extra.objects.delete()
+    assert Konto.objects.filter(besitzer=kunde.pk).count() == 1
+
+    if storage.manager.db_type == "sql":
+        # queries of the same shape are only compiled once
+        Konto.objects.filter(besitzer=kunde.pk).exists()
+        before = storage.db.queries.stats()
+        assert Konto.objects.filter(besitzer="someone else").exists() is False
+        after = storage.db.queries.stats()
+        assert after["hits"] == before["hits"] + 1
+        assert after["misses"] == before["misses"]
+
+        # so are those selecting columns or aggregates, and lookups by primary key
+        for _ in range(2):
+            Konto.objects.values_list("kontostand", besitzer=kunde.pk)
+            Konto.objects.aggregate(Sum("kontostand"), group_by="besitzer")
+            Kunde.objects.get(kunde.pk)
+        before = storage.db.queries.stats()
+        Konto.objects.values_list("kontostand", besitzer="someone else")
+        Konto.objects.aggregate(Sum("kontostand"), group_by="besitzer")
+        Kunde.objects.get(kunde.pk)
+        after = storage.db.queries.stats()
+        assert after["hits"] == before["hits"] + 3
+        assert after["misses"] == before["misses"]
+
+    # The awaitable variants run on the thread pool of the storage
+    async def serve_concurrently():
+        new = [Konto(besitzer=kunde.pk, kontostand=i) for i in range(20)]
+        await asyncio.gather(*[k.objects.asave() for k in new])
+        assert len(await Konto.objects.afilter(besitzer=kunde.pk)) == 21
+        assert await Konto.objects.aget(new[0].kontonummer) is new[0]
+        logins = await asyncio.gather(
+            Kunde.objects.alogin_user("ben.koch", kunde_test_pw),
+            Kunde.objects.alogin_user("ben.koch", "wrongOne"),
+        )
+        assert logins[0].pk == kunde.pk and logins[1] is None
+        await asyncio.gather(*[k.objects.adelete() for k in new])
+        return await Konto.objects.aall()
+
+    assert [k.kontonummer for k in asyncio.run(serve_concurrently())] == [
+        konto.kontonummer
+    ]
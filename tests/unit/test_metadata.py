@@ -0,0 +1,24 @@
+import sqlalchemy as sqla
+
+from src.models import Kunde, Konto
+from src.storage.metadata import MetadataRegistry
+
+
+def test_metadata_registry():
+    registry = MetadataRegistry()
+
+    # all declared models are introspected right away
+    assert registry.models.keys() >= {Kunde, Konto}
+    konto = registry[Konto]
+    assert registry.tables["konto"] is konto
+
+    assert konto.pk == "kontonummer"
+    assert konto.unique == ("kontonummer",)
+    assert konto.foreign_keys == {"besitzer": "kunde.pk"}
+    assert konto.column_names == ("kontonummer", "kontostand", "besitzer", "waehrung")
+    assert isinstance(konto.columns["kontostand"], sqla.Integer)
+    assert "kontostand" in konto.indexed
+
+    kunde = registry[Kunde]
+    assert kunde.pk == "pk"
+    assert kunde.unique == ("pk", "username")
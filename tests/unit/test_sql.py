@@ -0,0 +1,103 @@
+import pytest
+from sqlalchemy import inspect
+
+from src.models import Konto
+from src.storage.baked import QueryCache
+from src.storage.sql import SqlAdapter
+
+
+def _pragma(db, name):
+    with db.engine.connect() as connection:
+        return connection.execute(f"PRAGMA {name}").scalar()
+
+
+def test_sql_profiles(tmp_path):
+    db = SqlAdapter(host=str(tmp_path / "fast.sqlite3"), profile="performance")
+    assert _pragma(db, "journal_mode") == "wal"
+    assert _pragma(db, "synchronous") == 1
+    assert _pragma(db, "temp_store") == 2
+    assert _pragma(db, "busy_timeout") == 5000
+    db.engine.dispose()
+
+    db = SqlAdapter(
+        host=str(tmp_path / "custom.sqlite3"), profile={"cache_size": -2048}
+    )
+    assert _pragma(db, "cache_size") == -2048
+    assert _pragma(db, "journal_mode") == "delete"
+    db.engine.dispose()
+
+    with pytest.raises(ValueError):
+        SqlAdapter(host=str(tmp_path / "x.sqlite3"), profile="turbo")
+    with pytest.raises(ValueError):
+        SqlAdapter(host=str(tmp_path / "x.sqlite3"), profile={"cache_size": "1; --"})
+
+
+def test_sql_transaction(tmp_path):
+    db = SqlAdapter(host=str(tmp_path / "data.sqlite3"))
+    db.create()
+
+    with db.transaction() as outer:
+        with db.Session() as sess:
+            assert sess is outer
+            sess.add(Konto(kontonummer="A"))
+        with db.transaction() as inner:
+            assert inner is outer
+    assert not db.in_transaction()
+
+    with pytest.raises(RuntimeError):
+        with db.transaction() as sess:
+            sess.add(Konto(kontonummer="B"))
+            raise RuntimeError
+
+    with db.Session() as sess:
+        assert [k.kontonummer for k in sess.query(Konto)] == ["A"]
+    db.engine.dispose()
+
+
+def test_sql_migrate(tmp_path):
+    db = SqlAdapter(host=str(tmp_path / "data.sqlite3"))
+    assert db.create() == []
+
+    # a database created before the foreign key was indexed
+    with db.engine.connect() as connection:
+        connection.execute("DROP INDEX ix_konto_besitzer")
+
+    assert db.create() == ["Created index 'ix_konto_besitzer' on table 'konto'"]
+    indexes = inspect(db.engine).get_indexes("konto")
+    assert "ix_konto_besitzer" in {index["name"] for index in indexes}
+    assert db.migrate() == []
+    db.engine.dispose()
+
+
+def test_query_cache_size(tmp_path):
+    db = SqlAdapter(host=str(tmp_path / "data.sqlite3"))
+    db.create()
+    db.queries = QueryCache(size=2)
+
+    def run(shape):
+        def bake(bakery):
+            query = bakery(lambda s: s.query(Konto), Konto)
+            query.add_criteria(lambda q: q.filter(Konto.kontostand > shape), shape)
+            return query
+
+        with db.Session() as sess:
+            return db.queries.get(shape, bake, sess).all()
+
+    run(0)
+    run(0)
+    assert db.queries.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    # a known shape is a hit, whether its rows, its count or its first row is asked for
+    with db.Session() as sess:
+        db.queries.get(0, None, sess).count()
+        db.queries.get(0, None, sess).first()
+    assert db.queries.stats() == {"hits": 3, "misses": 1, "size": 1}
+
+    # the least recently used shapes are dropped, along with their statements,
+    # so running them again has to compile them again
+    for shape in range(1, 10):
+        run(shape)
+    assert db.queries.stats()["size"] <= 3
+    run(0)
+    assert db.queries.stats()["misses"] == 11
+    db.engine.dispose()
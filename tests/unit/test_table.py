@@ -0,0 +1,230 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from src.storage.table import JsonTable, iter_json_array
+
+
+def _write(path, rows):
+    with open(path, "w") as fout:
+        json.dump(rows, fout)
+
+
+def test_table_cache(tmp_path):
+    path = tmp_path / "konto.json"
+    _write(path, [{"kontonummer": "A", "kontostand": 0}])
+
+    table = JsonTable(path, "kontonummer")
+    rows = table.load()
+    assert rows == {"A": {"kontonummer": "A", "kontostand": 0}}
+
+    # An unchanged file is served from memory
+    assert table.load() is rows
+
+    # Writes go through the cache
+    table.upsert({"kontonummer": "B", "kontostand": 5})
+    table.flush()
+    assert table.load() is rows
+    assert JsonTable(path, "kontonummer").load() == rows
+
+    # Someone else changing the file makes us read it again
+    _write(path, [{"kontonummer": "C", "kontostand": 1}])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert list(table.load()) == ["C", "B"]
+
+
+def test_table_primary_key_index(tmp_path):
+    path = tmp_path / "konto.json"
+    _write(path, [{"kontonummer": str(i), "kontostand": i} for i in range(3)])
+
+    table = JsonTable(path, "kontonummer")
+    rows = table.load()
+
+    # The very first row has to be found as well
+    assert rows["0"]["kontostand"] == 0
+
+    table.remove("1")
+    table.upsert({"kontonummer": "3", "kontostand": 3})
+    table.flush()
+
+    table.invalidate()
+    assert list(table.load()) == ["0", "2", "3"]
+
+
+def test_table_unique_index(tmp_path):
+    path = tmp_path / "kunde.json"
+    _write(path, [{"pk": "1", "username": "ben.koch"}])
+
+    table = JsonTable(path, "pk", ["pk", "username"])
+    table.load()
+
+    assert table.find_conflict({"pk": "2", "username": "ben.koch"}) == "username"
+    # Updating the row that holds the value is fine
+    assert table.find_conflict({"pk": "1", "username": "ben.koch"}) is None
+    assert table.find_conflict({"pk": "2", "username": None}) is None
+
+    # Values are released once they are changed or their row is removed
+    table.upsert({"pk": "1", "username": "gerhard.orgel"})
+    assert table.find_conflict({"pk": "2", "username": "ben.koch"}) is None
+    table.remove("1")
+    assert table.find_conflict({"pk": "2", "username": "gerhard.orgel"}) is None
+
+
+def test_table_log(tmp_path):
+    path = tmp_path / "konto.json"
+    _write(path, [])
+
+    table = JsonTable(path, "kontonummer", background_compaction=False)
+    table.load()
+    for i in range(3):
+        table.upsert({"kontonummer": str(i), "kontostand": i})
+        table.flush()
+    table.remove("0")
+    table.flush()
+
+    # Every change is a single line in the log, the snapshot is untouched
+    with open(table.log_path) as fin:
+        assert len(fin.readlines()) == 4
+    with open(path) as fin:
+        assert json.load(fin) == []
+
+    # Another process appending to the log is picked up
+    other = JsonTable(path, "kontonummer")
+    other.load()
+    other.upsert({"kontonummer": "3", "kontostand": 3})
+    other.flush()
+    assert list(table.load()) == ["1", "2", "3"]
+
+    # A write that has been cut off halfway through is ignored
+    with open(table.log_path, "a") as fout:
+        fout.write('{"op": "delete", "pk": "1"')
+    assert list(JsonTable(path, "kontonummer").load()) == ["1", "2", "3"]
+    other.remove("3")
+    other.flush()
+    assert list(table.load()) == ["1", "2"]
+
+
+def test_table_compaction(tmp_path):
+    path = tmp_path / "konto.json"
+    _write(path, [])
+
+    table = JsonTable(path, "kontonummer", background_compaction=False)
+    table.min_compaction_size = 0
+    table.load()
+
+    table.upsert({"kontonummer": "A", "kontostand": 0})
+    table.flush()
+
+    # The log has outgrown the snapshot and has been folded into it
+    assert os.stat(table.log_path).st_size == 0
+    with open(path) as fin:
+        assert json.load(fin) == [{"kontonummer": "A", "kontostand": 0}]
+
+    table.remove("A")
+    table.upsert({"kontonummer": "B", "kontostand": 1})
+    table.compact()
+    assert JsonTable(path, "kontonummer").load() == {
+        "B": {"kontonummer": "B", "kontostand": 1}
+    }
+
+
+def test_table_streaming(tmp_path):
+    path = tmp_path / "konto.json"
+    _write(path, [{"kontonummer": str(i), "kontostand": i} for i in range(5)])
+
+    writer = JsonTable(path, "kontonummer")
+    writer.load()
+    writer.upsert({"kontonummer": "1", "kontostand": 10})
+    writer.remove("2")
+    writer.upsert({"kontonummer": "5", "kontostand": 5})
+    writer.flush()
+
+    # A table that is not held in memory is streamed from its files
+    reader = JsonTable(path, "kontonummer")
+    chunks = list(reader.iter_chunks(2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    rows = [row for chunk in chunks for row in chunk]
+    assert rows == list(writer.load().values())
+    assert not reader.rows
+
+    with open(path) as fin:
+        assert len(list(iter_json_array(fin, block_size=3))) == 5
+
+
+def test_table_sorted_index(tmp_path):
+    path = tmp_path / "konto.json"
+    _write(path, [{"kontonummer": str(i), "kontostand": i * 10} for i in range(5)])
+
+    table = JsonTable(path, "kontonummer", indexed=["kontostand"])
+    table.load()
+    assert table.sorted["kontostand"].values == [0, 10, 20, 30, 40]
+
+    assert table.search("kontostand", "gt", 20) == ["3", "4"]
+    assert table.search("kontostand", "lte", 10) == ["0", "1"]
+    assert table.search("kontostand", "range", (10, 30)) == ["1", "2", "3"]
+    assert table.search("kontostand", "in", [40, 0, 40]) == ["4", "0"]
+
+    # The index follows every change
+    table.upsert({"kontonummer": "1", "kontostand": 35})
+    table.remove("3")
+    table.upsert({"kontonummer": "5"})
+    assert table.search("kontostand", "gte", 20) == ["2", "1", "4"]
+
+    # Columns without an index and values that can not be compared
+    # have to be answered by scanning the rows
+    assert table.search("kontonummer", "gt", "1") is None
+    assert table.search("kontostand", "gt", "abc") is None
+
+
+def test_table_foreign_key_index(tmp_path):
+    path = tmp_path / "konto.json"
+    _write(path, [{"kontonummer": str(i), "besitzer": f"K{i % 2}"} for i in range(4)])
+
+    table = JsonTable(path, "kontonummer", foreign_keys=["besitzer"])
+    table.load()
+    assert table.search("besitzer", "exact", "K0") == ["0", "2"]
+    assert table.search("besitzer", "in", ["K1", "K2", "K1"]) == ["1", "3"]
+
+    # The index follows every change
+    table.upsert({"kontonummer": "2", "besitzer": "K1"})
+    table.remove("1")
+    table.upsert({"kontonummer": "4"})
+    assert table.search("besitzer", "exact", "K0") == ["0"]
+    assert table.search("besitzer", "exact", "K1") == ["3", "2"]
+    assert table.foreign["besitzer"].keys() == {"K0", "K1"}
+
+    # Comparisons can not be answered by it
+    assert table.search("besitzer", "gt", "K0") is None
+
+
+def _insert(path, pk, barrier, results):
+    table = JsonTable(path, "pk", ["pk", "username"])
+    table.load()
+    barrier.wait()
+    results.put(table.upsert_many([{"pk": pk, "username": "ben.koch"}], flush=True))
+
+
+def test_table_unique_across_processes(tmp_path):
+    pytest.importorskip("fcntl")
+    context = multiprocessing.get_context("fork")
+    path = tmp_path / "kunde.json"
+    _write(path, [])
+
+    # Both processes have read the empty table before either of them writes,
+    # still only one of them may take the username
+    barrier, results = context.Barrier(2), context.Queue()
+    processes = [
+        context.Process(target=_insert, args=(path, pk, barrier, results))
+        for pk in ("1", "2")
+    ]
+    for process in processes:
+        process.start()
+    conflicts = [results.get(timeout=10) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert sorted(conflicts, key=repr) == [["username"], [None]]
+    assert len(JsonTable(path, "pk", ["pk", "username"]).load()) == 1